@@ -2,8 +2,10 @@ from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.dispatcher.filters import Command
-from bot import dp, bot, check_user_access
-import sqlite3
+from bot import dp, bot, get_main_keyboard, requires_role, role_cache
+from audit import audit
+from database import db
+from ledger import rebuild_driver_balances
 
 # Состояния для FSM
 class AdminStates(StatesGroup):
@@ -22,16 +24,9 @@ def get_admin_keyboard():
 
 # Обработчик команды /admin
 @dp.message_handler(Command("admin"))
+@requires_role(0)
 async def cmd_admin(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if await check_user_access(cursor, message.from_user.id, required_role=0):
-        await message.answer("Панель администратора", reply_markup=get_admin_keyboard())
-    else:
-        await message.answer("У вас нет доступа к этой команде.")
-    
-    conn.close()
+    await message.answer("Панель администратора", reply_markup=get_admin_keyboard())
 
 @dp.message_handler(commands=['reset'], state="*")
 async def cmd_reset(message: types.Message, state: FSMContext):
@@ -41,22 +36,13 @@ async def cmd_reset(message: types.Message, state: FSMContext):
     await message.answer("Состояние сброшено. Используйте /admin для доступа к панели администратора.")
 
 @dp.message_handler(lambda message: message.text == "🔑 Назначить роль")
+@requires_role(0)
 async def assign_role(message: types.Message, state: FSMContext):
     # Сначала сбрасываем любое активное состояние
     await state.finish()
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=0):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     await message.answer("Введите Telegram ID пользователя:")
     await AdminStates.waiting_for_user_id.set()
-    
-    conn.close()
 
 # Обработчик ввода ID пользователя
 @dp.message_handler(state=AdminStates.waiting_for_user_id)
@@ -76,6 +62,23 @@ async def process_user_id(message: types.Message, state: FSMContext):
     except ValueError:
         await message.answer("Ошибка! Введите числовой ID.")
 
+# Назначение роли пользователю
+def _save_role(cursor, user_id, role):
+    # Проверяем существует ли пользователь
+    cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
+    result = cursor.fetchone()
+    
+    # Если пользователь существует, обновляем его роль
+    if result:
+        cursor.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
+        action = "обновлена"
+    # Если пользователя нет, создаем нового
+    else:
+        cursor.execute("INSERT INTO users (user_id, role) VALUES (?, ?)", (user_id, role))
+        action = "назначена"
+    
+    return action
+
 # Обработчик выбора роли
 @dp.message_handler(state=AdminStates.waiting_for_role)
 async def process_role(message: types.Message, state: FSMContext):
@@ -94,30 +97,11 @@ async def process_role(message: types.Message, state: FSMContext):
     user_data = await state.get_data()
     user_id = user_data.get("user_id")
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Проверяем существует ли пользователь
-    cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    
-    # Если пользователь существует, обновляем его роль
-    if result:
-        cursor.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
-        action = "обновлена"
-    # Если пользователя нет, создаем нового
-    else:
-        cursor.execute("INSERT INTO users (user_id, role) VALUES (?, ?)", (user_id, role))
-        action = "назначена"
+    action = await db.transaction(_save_role, user_id, role)
+    role_cache.set(user_id, role)
     
     # Логируем действие
-    cursor.execute(
-        "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-        (message.from_user.id, "Назначение роли", f"Пользователю {user_id} {action} роль {role}")
-    )
-    
-    conn.commit()
-    conn.close()
+    await audit(message.from_user.id, "Назначение роли", f"Пользователю {user_id} {action} роль {role}")
     
     # Показываем сообщение об успехе и сбрасываем состояние
     await message.answer(
@@ -127,38 +111,35 @@ async def process_role(message: types.Message, state: FSMContext):
     await state.finish()
 
 @dp.message_handler(lambda message: message.text == "👥 Управление пользователями")
+@requires_role(0)
 async def manage_users(message: types.Message, state: FSMContext):
     # Сначала сбрасываем любое активное состояние
     await state.finish()
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if await check_user_access(cursor, message.from_user.id, required_role=0):
-        await message.answer("Панель администратора", reply_markup=get_admin_keyboard())
-    else:
-        await message.answer("У вас нет доступа к этой команде.")
-    
-    conn.close()
+    await message.answer("Панель администратора", reply_markup=get_admin_keyboard())
 
 # Обработчик кнопки "Удалить роль"
 @dp.message_handler(lambda message: message.text == "🗑️ Удалить роль")
+@requires_role(0)
 async def delete_role(message: types.Message, state: FSMContext):
     # Сначала сбрасываем любое активное состояние
     await state.finish()
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=0):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     await message.answer("Введите Telegram ID пользователя:")
     await AdminStates.waiting_for_delete_confirmation.set()
+
+# Удаление пользователя
+def _delete_user(cursor, user_id):
+    # Проверяем, существует ли пользователь
+    cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
+    
+    if not cursor.fetchone():
+        return False
     
-    conn.close()
+    # Удаляем пользователя
+    cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+    
+    return True
 
 # Обработчик ввода ID пользователя для удаления роли
 @dp.message_handler(state=AdminStates.waiting_for_delete_confirmation)
@@ -166,30 +147,16 @@ async def process_delete_user_id(message: types.Message, state: FSMContext):
     try:
         user_id = int(message.text)
         
-        conn = sqlite3.connect('salary_bot.db')
-        cursor = conn.cursor()
-        
-        # Проверяем, существует ли пользователь
-        cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
+        deleted = await db.transaction(_delete_user, user_id)
+        role_cache.invalidate(user_id)
         
-        if not result:
+        if not deleted:
             await message.answer("Пользователь с таким ID не найден.", reply_markup=get_admin_keyboard())
             await state.finish()
-            conn.close()
             return
         
-        # Удаляем пользователя
-        cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-        
         # Логируем действие
-        cursor.execute(
-            "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-            (message.from_user.id, "Удаление пользователя", f"Удален пользователь с ID {user_id}")
-        )
-        
-        conn.commit()
-        conn.close()
+        await audit(message.from_user.id, "Удаление пользователя", f"Удален пользователь с ID {user_id}")
         
         await message.answer(f"✅ Пользователь с ID {user_id} успешно удален.", reply_markup=get_admin_keyboard())
         
@@ -201,25 +168,16 @@ async def process_delete_user_id(message: types.Message, state: FSMContext):
 
 # Обработчик кнопки "Список пользователей"
 @dp.message_handler(lambda message: message.text == "📋 Список пользователей")
+@requires_role(0)
 async def list_users(message: types.Message, state: FSMContext):
     # Сначала сбрасываем любое активное состояние
     await state.finish()
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=0):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     # Получаем список пользователей
-    cursor.execute("SELECT user_id, username, role FROM users ORDER BY role")
-    users = cursor.fetchall()
+    users = await db.fetchall("SELECT user_id, username, role FROM users ORDER BY role")
     
     if not users:
         await message.answer("Список пользователей пуст.", reply_markup=get_admin_keyboard())
-        conn.close()
         return
     
     text = "📋 Список пользователей:\n\n"
@@ -229,28 +187,29 @@ async def list_users(message: types.Message, state: FSMContext):
         text += f"ID: {user_id}\nИмя: {username or 'Не указано'}\nРоль: {role_name}\n\n"
     
     await message.answer(text, reply_markup=get_admin_keyboard())
-    conn.close()
 
 # Обработчик кнопки "Назад" в панели администратора
 @dp.message_handler(lambda message: message.text == "◀️ Назад", state="*")
-async def admin_back(message: types.Message, state: FSMContext):
+async def admin_back(message: types.Message, state: FSMContext, role):
     # Сбрасываем любое текущее состояние
     await state.finish()
     
-    from bot import get_admin_keyboard, get_editor_keyboard, get_viewer_keyboard
-    
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Проверяем роль пользователя
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (message.from_user.id,))
-    user_role = cursor.fetchone()
-    
-    if user_role and user_role[0] == 0:  # Администратор
-        await message.answer("Возврат в главное меню.", reply_markup=get_admin_keyboard())
-    elif await check_user_access(cursor, message.from_user.id, required_role=1):  # Редактор
-        await message.answer("Возврат в главное меню.", reply_markup=get_editor_keyboard())
-    else:  # Просмотрщик
-        await message.answer("Возврат в главное меню.", reply_markup=get_viewer_keyboard())
+    await message.answer("Возврат в главное меню.", reply_markup=get_main_keyboard(role))
+
+# Пересборка сводки задолженности по водителям с проверкой расхождений
+@dp.message_handler(commands=['rebuild_balances'])
+@requires_role(0)
+async def cmd_rebuild_balances(message: types.Message):
+    mismatches = await db.transaction(rebuild_driver_balances)
+    
+    if not mismatches:
+        await message.answer("✅ Сводка задолженности совпадает с рейсами, пересобрана.")
+        return
     
-    conn.close()
+    text = f"⚠️ Найдено расхождений: {len(mismatches)}. Сводка пересобрана.\n\n"
+    for driver_id, have, want in mismatches[:20]:
+        text += (
+            f"Водитель #{driver_id}: было {have[0]} рейс(ов) / {have[1]:.2f} ₽, "
+            f"по рейсам {want[0]} / {want[1]:.2f} ₽\n"
+        )
+    await message.answer(text)
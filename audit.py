@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from database import db
+
+# Журнал действий пользователей (таблица logs).
+# События копятся в памяти и пишутся пачками через executemany - по размеру
+# пачки или по таймеру, поэтому запись в лог не удлиняет транзакции обработчиков.
+
+AUDIT_BATCH_SIZE = 100  # Сколько событий писать за один раз
+AUDIT_FLUSH_INTERVAL = 2.0  # Не реже чем раз в столько секунд
+AUDIT_QUEUE_SIZE = 10000  # Больше событий в очереди - обработчики ждут записи
+
+def _write_batch(conn, rows):
+    conn.executemany(
+        "INSERT INTO logs (user_id, action, details, created_at) VALUES (?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+
+class AuditLog:
+    def __init__(self, database, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL, max_queue=AUDIT_QUEUE_SIZE):
+        self._db = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._pending = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.stats = {
+            'events': 0,
+            'written': 0,
+            'batches': 0,
+            'waits': 0,
+            'errors': 0,
+            'dropped': 0,
+        }
+
+    async def log(self, user_id, action, details):
+        # Очередь заполнена - ждем, пока она запишется (обратное давление)
+        if len(self._pending) >= self.max_queue:
+            self.stats['waits'] += 1
+            await self._flush_quietly()
+            if len(self._pending) >= self.max_queue:
+                # БД недоступна - теряем самое старое событие, но не растем бесконечно
+                self._pending.pop(0)
+                self.stats['dropped'] += 1
+
+        # Время события, а не записи пачки; в формате CURRENT_TIMESTAMP (UTC)
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._pending.append((user_id, action, details, created_at))
+        self.stats['events'] += 1
+
+        if len(self._pending) >= self.batch_size:
+            if self._task is None:
+                await self._flush_quietly()
+            else:
+                self._wakeup.set()
+
+    # Записать все накопленные события
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:len(batch)]
+                try:
+                    await self._db.run(_write_batch, batch)
+                except Exception:
+                    # Возвращаем пачку в начало очереди, запишем при следующей попытке
+                    self._pending[:0] = batch
+                    self.stats['errors'] += 1
+                    raise
+                self.stats['batches'] += 1
+                self.stats['written'] += len(batch)
+
+    # Запись из log(): ошибка БД уже учтена в stats['errors'] и не должна
+    # доходить до обработчика - его собственная транзакция уже сохранена
+    async def _flush_quietly(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Ошибка записи журнала действий: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush_quietly()
+
+    # Запустить фоновую запись (из on_startup, внутри цикла событий)
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    # Остановить фоновую запись и дописать все, что осталось в очереди
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def metrics(self):
+        return {
+            'queued': len(self._pending),
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+            **self.stats,
+        }
+
+audit_log = AuditLog(db)
+
+# Записать действие пользователя в журнал
+async def audit(user_id, action, details):
+    await audit_log.log(user_id, action, details)
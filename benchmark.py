@@ -0,0 +1,689 @@
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from database import STORAGE_PROFILES, ConnectionPool, apply_storage_profile, migrate
+from dataset import generate_dataset
+from export import export_to_file
+from payments import PAYOUTS_FOR_RANGE
+from payroll import PAYMENT_FIELDS, calculate_trip_payment, calculate_trip_payments, np, trip_rates
+from rollup import DRIVER_STATS_FOR_RANGE
+
+# Бенчмарки базы данных бота. Запуск:
+#   python benchmark.py storage [--profiles durable fast] [--trips 2000]
+#   python benchmark.py plans [--trips 2000]
+#   python benchmark.py reports [--scales 1000 100000 1000000] [--output reports.json]
+#   python benchmark.py export [--scales 10000 100000]
+
+CITIES = [
+    'Москва', 'Санкт-Петербург', 'Казань', 'Нижний Новгород', 'Екатеринбург',
+    'Самара', 'Воронеж', 'Ростов-на-Дону', 'Краснодар', 'Тверь',
+]
+
+# Создание пустой БД со справочниками водителей и автопоездов
+def seed_database(path, profile, drivers=20, vehicles=20):
+    conn = sqlite3.connect(path)
+    apply_storage_profile(conn, profile)
+    migrate(conn)
+    cursor = conn.cursor()
+
+    for i in range(vehicles):
+        cursor.execute(
+            "INSERT INTO vehicles (truck_number, trailer_number) VALUES (?, ?)",
+            (f"А{i:03d}АА77", f"ВА{i:04d}77")
+        )
+
+    for i in range(drivers):
+        cursor.execute(
+            """
+            INSERT INTO drivers
+            (name, km_rate, side_loading_rate, roof_loading_rate,
+             regular_downtime_rate, forced_downtime_rate, vehicle_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (f"Водитель {i + 1}", 12.0, 500.0, 700.0, 300.0, 450.0, i % vehicles + 1)
+        )
+
+    conn.commit()
+    conn.close()
+
+# Одна запись рейса так же, как при подтверждении в боте: рейс, простой и лог
+def write_trip(conn, rnd, drivers):
+    distance = rnd.randint(50, 1500)
+    total_payment = distance * 12.0
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO trips
+        (driver_id, vehicle_id, loading_city, unloading_city, distance,
+         side_loading_count, roof_loading_count, total_payment)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            rnd.randint(1, drivers), rnd.randint(1, drivers),
+            rnd.choice(CITIES), rnd.choice(CITIES), distance,
+            rnd.randint(0, 2), rnd.randint(0, 2), total_payment
+        )
+    )
+    trip_id = cursor.lastrowid
+
+    if rnd.random() < 0.3:
+        cursor.execute(
+            "INSERT INTO downtimes (trip_id, type, hours, payment) VALUES (?, 1, ?, ?)",
+            (trip_id, 4, 1200.0)
+        )
+
+    cursor.execute(
+        "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
+        (1, "Добавление рейса", f"Рейс #{trip_id}")
+    )
+    conn.commit()
+
+# Отчеты, которые смотрят просмотрщики, пока редакторы добавляют рейсы
+def read_reports(conn):
+    conn.execute("""
+    SELECT d.name, COUNT(t.id), SUM(t.distance), SUM(t.total_payment)
+    FROM drivers d
+    LEFT JOIN trips t ON d.id = t.driver_id
+    GROUP BY d.id
+    ORDER BY SUM(t.total_payment) DESC
+    """).fetchall()
+    conn.execute("SELECT COUNT(*), SUM(total_payment) FROM trips").fetchone()
+
+def run_storage_workload(profile, trips, writers, readers, drivers=20):
+    workdir = tempfile.mkdtemp(prefix='salary_bench_')
+    path = os.path.join(workdir, 'bench.db')
+    seed_database(path, profile, drivers=drivers)
+
+    bench_pool = ConnectionPool(path, size=writers + readers, profile=profile)
+    write_latencies = []
+    reads = [0]
+    errors = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def writer(seed, count):
+        rnd = random.Random(seed)
+        try:
+            with bench_pool.connection() as conn:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    write_trip(conn, rnd, drivers)
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        write_latencies.append(elapsed)
+        except Exception as e:
+            errors.append(e)
+
+    def reader():
+        try:
+            with bench_pool.connection() as conn:
+                while not done.is_set():
+                    read_reports(conn)
+                    with lock:
+                        reads[0] += 1
+        except Exception as e:
+            errors.append(e)
+
+    per_writer = max(1, trips // writers)
+    writer_threads = [threading.Thread(target=writer, args=(i, per_writer)) for i in range(writers)]
+    reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+
+    started = time.perf_counter()
+    for thread in reader_threads + writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    for thread in reader_threads:
+        thread.join()
+
+    bench_pool.close_all()
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+
+    if errors:
+        raise errors[0]
+
+    write_latencies.sort()
+    return {
+        'profile': profile,
+        'seconds': elapsed,
+        'writes': len(write_latencies),
+        'writes_per_sec': len(write_latencies) / elapsed,
+        'reads_per_sec': reads[0] / elapsed,
+        'write_p50_ms': statistics.median(write_latencies) * 1000,
+        'write_p95_ms': write_latencies[int(len(write_latencies) * 0.95) - 1] * 1000,
+    }
+
+def bench_storage(args):
+    print(f"Рейсов: {args.trips}, писателей: {args.writers}, читателей: {args.readers}")
+    print(f"{'профиль':<10} {'время, с':>9} {'записей/с':>10} {'отчетов/с':>10} {'p50, мс':>8} {'p95, мс':>8}")
+    for profile in args.profiles:
+        result = run_storage_workload(profile, args.trips, args.writers, args.readers)
+        print(
+            f"{result['profile']:<10} {result['seconds']:>9.2f} {result['writes_per_sec']:>10.0f} "
+            f"{result['reads_per_sec']:>10.1f} {result['write_p50_ms']:>8.2f} {result['write_p95_ms']:>8.2f}"
+        )
+
+# Частые запросы обработчиков: (где используется, SQL, параметры, таблицы,
+# которые допустимо читать целиком - справочник водителей и сводка по водителям)
+HOT_QUERIES = [
+    ("salaries.show_current_data",
+     "SELECT COALESCE(SUM(unpaid_count), 0), SUM(unpaid_amount) FROM driver_balances",
+     (), ('driver_balances',)),
+    ("salaries.view_debts (страница)",
+     """
+     SELECT t.created_at, t.id, t.id, d.name, t.loading_city, t.unloading_city,
+            t.distance, t.total_payment, t.paid_amount, t.created_at
+     FROM trips t JOIN drivers d ON t.driver_id = d.id
+     WHERE t.paid = 0 AND (t.created_at, t.id) < (?, ?)
+     ORDER BY t.created_at DESC, t.id DESC LIMIT 11
+     """, ('2100-01-01 00:00:00', 0), ()),
+    ("salaries.view_debts_by_driver",
+     """
+     SELECT d.id, d.name, b.unpaid_count as trips_count,
+            b.unpaid_amount as total_debt
+     FROM driver_balances b
+     JOIN drivers d ON d.id = b.driver_id
+     WHERE b.unpaid_count > 0
+     ORDER BY total_debt DESC
+     """, (), ('b', 'd')),
+    ("salaries.view_driver_trips",
+     """
+     SELECT id, loading_city, unloading_city,
+            distance, total_payment, created_at
+     FROM trips
+     WHERE driver_id = ? AND paid = 0
+     ORDER BY created_at DESC
+     """, (1,), ()),
+    ("salaries.mark_all_driver_trips_paid",
+     "SELECT COUNT(*), SUM(total_payment) FROM trips WHERE driver_id = ? AND paid = 0",
+     (1,), ()),
+    ("salaries.mark_all_driver_trips_paid (update)",
+     "UPDATE trips SET paid = 1 WHERE driver_id = ? AND paid = 0",
+     (1,), ()),
+    ("salaries.export_debts",
+     """
+     SELECT t.id, d.name, v.truck_number, v.trailer_number,
+            t.loading_city, t.unloading_city, t.distance,
+            t.side_loading_count, t.roof_loading_count,
+            t.total_payment, t.paid_amount, (t.total_payment - t.paid_amount) as remaining, t.created_at
+     FROM trips t
+     JOIN drivers d ON t.driver_id = d.id
+     JOIN vehicles v ON t.vehicle_id = v.id
+     WHERE t.paid = 0
+     ORDER BY d.name, t.created_at
+     """, (), ()),
+    ("trips.process_history_selection (7 дней, страница)",
+     """
+     SELECT t.created_at, t.id, t.id, d.name, v.truck_number, v.trailer_number,
+            t.loading_city, t.unloading_city, t.distance,
+            t.total_payment, t.created_at, t.trip_1c_number
+     FROM trips t
+     JOIN drivers d ON t.driver_id = d.id
+     JOIN vehicles v ON t.vehicle_id = v.id
+     WHERE t.created_at >= datetime('now', '-7 days') AND (t.created_at, t.id) < (?, ?)
+     ORDER BY t.created_at DESC, t.id DESC LIMIT 11
+     """, ('2100-01-01 00:00:00', 0), ()),
+    ("trips.process_history_selection (все, страница)",
+     """
+     SELECT t.created_at, t.id, t.id, d.name, v.truck_number, v.trailer_number,
+            t.loading_city, t.unloading_city, t.distance,
+            t.total_payment, t.created_at, t.trip_1c_number
+     FROM trips t
+     JOIN drivers d ON t.driver_id = d.id
+     JOIN vehicles v ON t.vehicle_id = v.id
+     WHERE (t.created_at, t.id) < (?, ?)
+     ORDER BY t.created_at DESC, t.id DESC LIMIT 11
+     """, ('2100-01-01 00:00:00', 0), ()),
+    ("salaries.get_detailed_report_totals (выплаты)", PAYOUTS_FOR_RANGE,
+     ('2024-01-01 00:00:00', '2024-01-08 00:00:00'), ()),
+    ("trips.driver_statistics", DRIVER_STATS_FOR_RANGE, ('2024-01-01', '2024-03-31'), ('d',)),
+    ("trips.confirm_delete_trip",
+     "DELETE FROM downtimes WHERE trip_id = ?",
+     (1,), ()),
+]
+
+# Полные проходы по таблице (SCAN без индекса) в плане запроса
+def find_full_scans(conn, sql, params, allowed=()):
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    details = [row[3] for row in plan]
+    scans = []
+    for detail in details:
+        if not detail.startswith('SCAN '):
+            continue
+        if 'USING' in detail:  # проход по индексу, а не по таблице
+            continue
+        table = detail.split()[1]
+        if table not in allowed:
+            scans.append(detail)
+    return details, scans
+
+def check_query_plans(conn, verbose=True):
+    failed = []
+    for name, sql, params, allowed in HOT_QUERIES:
+        details, scans = find_full_scans(conn, sql, params, allowed)
+        if verbose:
+            print(f"{'ОШИБКА' if scans else 'ok':<7} {name}")
+            for detail in details:
+                print(f"        {detail}")
+        if scans:
+            failed.append((name, scans))
+    return failed
+
+def bench_plans(args):
+    workdir = tempfile.mkdtemp(prefix='salary_bench_')
+    path = os.path.join(workdir, 'plans.db')
+    seed_database(path, 'durable')
+
+    conn = sqlite3.connect(path)
+    rnd = random.Random(0)
+    for _ in range(args.trips):
+        write_trip(conn, rnd, 20)
+    # Как в рабочей базе: большая часть рейсов уже оплачена
+    conn.execute("UPDATE trips SET paid = 1, paid_amount = total_payment WHERE id % 10 != 0")
+    conn.commit()
+
+    # Планы проверяются и без статистики, и после ANALYZE
+    print("Без статистики:")
+    failed = check_query_plans(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+    print("\nПосле ANALYZE:")
+    failed += check_query_plans(conn)
+    conn.close()
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+
+    if failed:
+        print(f"\nПолный проход по таблице в {len(failed)} запросах:")
+        for name, scans in failed:
+            print(f"  {name}: {'; '.join(scans)}")
+        sys.exit(1)
+    print(f"\nВсе {len(HOT_QUERIES)} частых запросов используют индексы")
+
+# SQL отчетов в том виде, в каком его выполняют обработчики:
+# (обработчик, [(SQL, параметры), ...]) - все запросы одного нажатия кнопки.
+# Списки постраничные (paging.PagedList): замеряется первая страница
+HISTORY_QUERY = """
+    SELECT t.created_at, t.id, t.id, d.name, v.truck_number, v.trailer_number,
+           t.loading_city, t.unloading_city, t.distance,
+           t.total_payment, t.created_at, t.trip_1c_number
+    FROM trips t
+    JOIN drivers d ON t.driver_id = d.id
+    JOIN vehicles v ON t.vehicle_id = v.id
+    """
+HISTORY_ORDER = " ORDER BY t.created_at DESC, t.id DESC LIMIT 11"
+DEBTS_TOTAL_QUERY = "SELECT COALESCE(SUM(unpaid_count), 0), SUM(unpaid_amount) FROM driver_balances"
+
+REPORT_QUERIES = [
+    ("salaries.show_current_data", [
+        ("SELECT COALESCE(SUM(unpaid_count), 0), SUM(unpaid_amount) FROM driver_balances", ()),
+    ]),
+    ("salaries.view_debts", [
+        ("""
+        SELECT t.created_at, t.id, t.id, d.name, t.loading_city, t.unloading_city,
+               t.distance, t.total_payment, t.paid_amount, t.created_at
+        FROM trips t JOIN drivers d ON t.driver_id = d.id
+        WHERE t.paid = 0
+        ORDER BY t.created_at DESC, t.id DESC LIMIT 11
+        """, ()),
+        (DEBTS_TOTAL_QUERY, ()),
+    ]),
+    ("salaries.view_debts_by_driver", [
+        ("""
+        SELECT d.id, d.name, b.unpaid_count as trips_count, 
+               b.unpaid_amount as total_debt
+        FROM driver_balances b
+        JOIN drivers d ON d.id = b.driver_id
+        WHERE b.unpaid_count > 0
+        ORDER BY total_debt DESC
+        """, ()),
+    ]),
+    ("salaries.show_detailed_report", [
+        ("""
+        SELECT b.unpaid_amount, b.driver_id, d.id, d.name, b.unpaid_count, b.unpaid_amount, b.partial_amount
+        FROM driver_balances b JOIN drivers d ON d.id = b.driver_id
+        WHERE b.unpaid_count > 0
+        ORDER BY b.unpaid_amount DESC, b.driver_id DESC LIMIT 6
+        """, ()),
+        ("""
+        SELECT COALESCE(SUM(unpaid_count), 0), COALESCE(SUM(unpaid_amount), 0),
+               COALESCE(SUM(partial_amount), 0)
+        FROM driver_balances
+        """, ()),
+        ("SELECT COUNT(*), COALESCE(SUM(total_payment), 0) FROM trips", ()),
+        ("""
+        SELECT driver_id, COUNT(*), SUM(total_payment)
+        FROM trips
+        WHERE driver_id IN (
+            SELECT driver_id FROM driver_balances WHERE unpaid_count > 0
+            ORDER BY unpaid_amount DESC, driver_id DESC LIMIT 5
+        )
+        GROUP BY driver_id
+        """, ()),
+    ]),
+    ("trips.driver_statistics", [
+        (DRIVER_STATS_FOR_RANGE, (time.strftime('%Y-%m-%d', time.gmtime(time.time() - 29 * 86400)),
+                                  time.strftime('%Y-%m-%d', time.gmtime()))),
+    ]),
+    ("trips.process_history_selection (7 дней)", [
+        (HISTORY_QUERY + " WHERE t.created_at >= datetime('now', '-7 days')" + HISTORY_ORDER, ()),
+    ]),
+    ("trips.process_history_selection (30 дней)", [
+        (HISTORY_QUERY + " WHERE t.created_at >= datetime('now', '-30 days')" + HISTORY_ORDER, ()),
+    ]),
+    ("trips.process_history_selection (все)", [
+        (HISTORY_QUERY + HISTORY_ORDER, ()),
+    ]),
+    ("trips.export_history", [
+        ("""
+        SELECT t.id, d.name, v.truck_number, v.trailer_number,
+               t.trip_1c_number, t.loading_city, t.unloading_city, t.distance,
+               t.side_loading_count, t.roof_loading_count,
+               t.total_payment, t.created_at
+        FROM trips t
+        JOIN drivers d ON t.driver_id = d.id
+        JOIN vehicles v ON t.vehicle_id = v.id
+        ORDER BY t.created_at DESC
+        """, ()),
+    ]),
+    ("salaries.export_debts", [
+        ("""
+        SELECT t.id, d.name, v.truck_number, v.trailer_number,
+               t.loading_city, t.unloading_city, t.distance,
+               t.side_loading_count, t.roof_loading_count,
+               t.total_payment, t.paid_amount, (t.total_payment - t.paid_amount) as remaining, t.created_at
+        FROM trips t
+        JOIN drivers d ON t.driver_id = d.id
+        JOIN vehicles v ON t.vehicle_id = v.id
+        WHERE t.paid = 0
+        ORDER BY d.name, t.created_at
+        """, ()),
+    ]),
+]
+
+# Время одного нажатия: все запросы обработчика с выборкой всех строк
+def time_report(conn, queries, repeat):
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = 0
+        for sql, params in queries:
+            rows += len(conn.execute(sql, params).fetchall())
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        'rows': rows,
+        'min_ms': timings[0] * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'max_ms': timings[-1] * 1000,
+    }
+
+def run_report_suite(conn, repeat):
+    # Первый прогон прогревает кэш страниц и в замеры не входит
+    for _, queries in REPORT_QUERIES:
+        for sql, params in queries:
+            conn.execute(sql, params).fetchall()
+    return {name: time_report(conn, queries, repeat) for name, queries in REPORT_QUERIES}
+
+def print_report_results(label, results):
+    print(f"\n{label}")
+    print(f"{'обработчик':<45} {'строк':>9} {'медиана, мс':>12} {'макс, мс':>10}")
+    for name, result in results.items():
+        print(f"{name:<45} {result['rows']:>9} {result['median_ms']:>12.2f} {result['max_ms']:>10.2f}")
+
+def bench_reports(args):
+    output = {
+        'started_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'sqlite_version': sqlite3.sqlite_version,
+        'profile': args.profile,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'scales': [],
+    }
+
+    if args.db:
+        # Замер на готовой базе (например, копии рабочей)
+        conn = sqlite3.connect(args.db)
+        apply_storage_profile(conn, args.profile)
+        trips = conn.execute("SELECT COUNT(*) FROM trips").fetchone()[0]
+        drivers = conn.execute("SELECT COUNT(*) FROM drivers").fetchone()[0]
+        results = run_report_suite(conn, args.repeat)
+        conn.close()
+        print_report_results(f"{args.db}: рейсов {trips}, водителей {drivers}", results)
+        output['scales'].append({'db': args.db, 'trips': trips, 'drivers': drivers, 'reports': results})
+    else:
+        for trips in args.scales:
+            workdir = tempfile.mkdtemp(prefix='salary_bench_')
+            path = os.path.join(workdir, 'reports.db')
+            conn = sqlite3.connect(path)
+            apply_storage_profile(conn, args.profile)
+            migrate(conn)
+
+            started = time.perf_counter()
+            counts = generate_dataset(conn, drivers=args.drivers, vehicles=args.drivers,
+                                      trips=trips, days=args.days, seed=args.seed)
+            generated = time.perf_counter() - started
+
+            results = run_report_suite(conn, args.repeat)
+            conn.close()
+            for name in os.listdir(workdir):
+                os.remove(os.path.join(workdir, name))
+            os.rmdir(workdir)
+
+            print_report_results(
+                f"Рейсов: {trips}, водителей: {args.drivers} (генерация {generated:.1f} с)", results
+            )
+            output['scales'].append({
+                'trips': trips,
+                'drivers': args.drivers,
+                'days': args.days,
+                'counts': counts,
+                'generate_seconds': generated,
+                'reports': results,
+            })
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты записаны в {args.output}")
+
+EXPORT_HISTORY_SQL = """
+SELECT t.id, d.name, v.truck_number, v.trailer_number,
+       t.trip_1c_number, t.loading_city, t.unloading_city, t.distance,
+       t.side_loading_count, t.roof_loading_count,
+       t.total_payment, t.created_at
+FROM trips t
+JOIN drivers d ON t.driver_id = d.id
+JOIN vehicles v ON t.vehicle_id = v.id
+ORDER BY t.created_at DESC
+"""
+EXPORT_HISTORY_HEADER = [
+    "ID", "Водитель", "Тягач", "Прицеп", "Номер из 1С", "Город погрузки",
+    "Город разгрузки", "Расстояние (км)", "Боковой тент",
+    "Крыша", "Сумма (руб)", "Дата"
+]
+
+# Прежняя выгрузка: fetchall, StringIO, encode и BytesIO - три копии данных
+def export_in_memory(conn, sql, params, header):
+    rows = conn.execute(sql, params).fetchall()
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=';', quotechar='"')
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+    data = io.BytesIO(output.getvalue().encode('utf-8-sig'))
+    return data, len(rows), len(data.getbuffer())
+
+def export_streaming(conn, sql, params, header, compress=False):
+    export_file, rows, _ = export_to_file(conn, sql, params, header, compress=compress)
+    export_file.seek(0, os.SEEK_END)
+    size = export_file.tell()
+    return export_file, rows, size
+
+# Пиковая память (tracemalloc) и время одной выгрузки
+def measure_export(func, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result, rows, size = func(*args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result.close()
+    return {'rows': rows, 'bytes': size, 'seconds': elapsed, 'peak_mb': peak / 1024 / 1024}
+
+def bench_export(args):
+    print(f"{'рейсов':>9} {'способ':<12} {'файл, МБ':>9} {'время, с':>9} {'пик памяти, МБ':>15}")
+    for trips in args.scales:
+        workdir = tempfile.mkdtemp(prefix='salary_bench_')
+        path = os.path.join(workdir, 'export.db')
+        conn = sqlite3.connect(path)
+        apply_storage_profile(conn, 'fast')
+        migrate(conn)
+        generate_dataset(conn, drivers=args.drivers, vehicles=args.drivers, trips=trips, seed=args.seed)
+
+        methods = [
+            ('в памяти', export_in_memory, ()),
+            ('поток', export_streaming, (False,)),
+            ('поток+gzip', export_streaming, (True,)),
+        ]
+        for label, func, extra in methods:
+            result = measure_export(func, conn, EXPORT_HISTORY_SQL, (), EXPORT_HISTORY_HEADER, *extra)
+            print(
+                f"{trips:>9} {label:<12} {result['bytes'] / 1024 / 1024:>9.1f} "
+                f"{result['seconds']:>9.2f} {result['peak_mb']:>15.1f}"
+            )
+
+        conn.close()
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+# Синтетические рейсы для расчета оплаты: (ставки водителей, водитель рейса, колонки)
+def make_payroll_columns(count, drivers, seed):
+    rnd = random.Random(seed)
+    driver_rates = {
+        driver_id: {
+            'km_rate': rnd.choice([8.0, 9.5, 10.0, 11.25]),
+            'side_loading_rate': rnd.choice([500.0, 700.0]),
+            'roof_loading_rate': rnd.choice([800.0, 1000.0]),
+            'regular_downtime_rate': rnd.choice([150.0, 200.0]),
+            'forced_downtime_rate': rnd.choice([250.0, 300.0]),
+        }
+        for driver_id in range(1, drivers + 1)
+    }
+    driver_ids = [rnd.randint(1, drivers) for _ in range(count)]
+    columns = (
+        [round(rnd.uniform(50, 2500), 1) for _ in range(count)],
+        [rnd.choice([0, 0, 1, 2]) for _ in range(count)],
+        [rnd.choice([0, 0, 0, 1]) for _ in range(count)],
+        [rnd.choice([0, 0, 0, 2.5, 4]) for _ in range(count)],
+        [rnd.choice([0, 0, 0, 0, 3]) for _ in range(count)],
+    )
+    return driver_rates, driver_ids, columns
+
+def payroll_scalar(driver_rates, driver_ids, columns):
+    return [
+        calculate_trip_payment(driver_rates[driver_id], *values)
+        for driver_id, *values in zip(driver_ids, *columns)
+    ]
+
+def payroll_batch(driver_rates, driver_ids, columns):
+    return calculate_trip_payments(trip_rates(driver_rates, driver_ids), *columns)
+
+def bench_payroll(args):
+    engine = "NumPy " + np.__version__ if np is not None else "без NumPy (цикл)"
+    print(f"Пакетный расчет: {engine}")
+    print(f"{'рейсов':>10} {'по одному, с':>13} {'пакетом, с':>11} {'рейсов/с':>13} {'ускорение':>10} {'совпадает':>10}")
+    for count in args.scales:
+        driver_rates, driver_ids, columns = make_payroll_columns(count, args.drivers, args.seed)
+        if np is not None:
+            # Массивы готовятся один раз, как при чтении из БД
+            driver_ids = np.asarray(driver_ids)
+            columns = tuple(np.asarray(column) for column in columns)
+
+        started = time.perf_counter()
+        batch = payroll_batch(driver_rates, driver_ids, columns)
+        batch_seconds = time.perf_counter() - started
+
+        # Расчет по одному рейсу - только на ограниченной выборке, дальше экстраполяция
+        sample = min(count, args.scalar_limit)
+        sample_columns = tuple(list(column[:sample]) for column in columns)
+        started = time.perf_counter()
+        scalar = payroll_scalar(driver_rates, list(driver_ids[:sample]), sample_columns)
+        scalar_seconds = (time.perf_counter() - started) * count / max(sample, 1)
+
+        identical = all(
+            list(batch[key][:sample]) == [result[key] for result in scalar]
+            for key in PAYMENT_FIELDS
+        )
+        print(
+            f"{count:>10} {scalar_seconds:>13.4f} {batch_seconds:>11.4f} "
+            f"{count / batch_seconds if batch_seconds else float('inf'):>13.0f} "
+            f"{scalar_seconds / batch_seconds if batch_seconds else float('inf'):>9.1f}x "
+            f"{'да' if identical else 'НЕТ':>10}"
+        )
+        if not identical:
+            sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки базы данных бота")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    storage = subparsers.add_parser('storage', help="Сравнение профилей хранилища на синтетических рейсах")
+    storage.add_argument('--profiles', nargs='+', default=list(STORAGE_PROFILES), choices=list(STORAGE_PROFILES))
+    storage.add_argument('--trips', type=int, default=2000)
+    storage.add_argument('--writers', type=int, default=2)
+    storage.add_argument('--readers', type=int, default=2)
+    storage.set_defaults(func=bench_storage)
+
+    plans = subparsers.add_parser('plans', help="Проверка, что частые запросы не читают таблицы целиком")
+    plans.add_argument('--trips', type=int, default=2000)
+    plans.set_defaults(func=bench_plans)
+
+    reports = subparsers.add_parser('reports', help="Время отчетов бота на синтетических данных разного объема")
+    reports.add_argument('--scales', nargs='+', type=int, default=[1000, 10000, 100000],
+                         help="количество рейсов для каждого прогона")
+    reports.add_argument('--drivers', type=int, default=50)
+    reports.add_argument('--days', type=int, default=365)
+    reports.add_argument('--repeat', type=int, default=5)
+    reports.add_argument('--seed', type=int, default=0)
+    reports.add_argument('--profile', default='balanced', choices=list(STORAGE_PROFILES))
+    reports.add_argument('--db', help="замерить готовую базу вместо синтетической")
+    reports.add_argument('--output', default='bench_reports.json')
+    reports.set_defaults(func=bench_reports)
+
+    export = subparsers.add_parser('export', help="Память и время выгрузки истории рейсов в CSV")
+    export.add_argument('--scales', nargs='+', type=int, default=[10000, 100000])
+    export.add_argument('--drivers', type=int, default=50)
+    export.add_argument('--seed', type=int, default=0)
+    export.set_defaults(func=bench_export)
+
+    payroll = subparsers.add_parser('payroll', help="Пакетный расчет оплаты рейсов против расчета по одному")
+    payroll.add_argument('--scales', nargs='+', type=int, default=[1, 1000, 100000, 1000000, 10000000])
+    payroll.add_argument('--drivers', type=int, default=200)
+    payroll.add_argument('--scalar-limit', type=int, default=200000,
+                         help="сколько рейсов считать по одному (остальное экстраполируется)")
+    payroll.add_argument('--seed', type=int, default=0)
+    payroll.set_defaults(func=bench_payroll)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -5,9 +5,13 @@ from aiogram.utils import executor
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
-import sqlite3
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
 import os
-from database import init_db
+import threading
+import time
+from datetime import datetime
+from database import db
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -40,42 +44,166 @@ def get_admin_keyboard():
     keyboard.add(types.KeyboardButton("👥 Управление пользователями"))
     return keyboard
 
-# Проверка роли пользователя
-async def check_user_access(cursor, user_id, required_role=2):
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
+# Главная клавиатура для роли пользователя
+def get_main_keyboard(role):
+    if role == 0:  # Администратор
+        return get_admin_keyboard()
+    elif role == 1:  # Редактор
+        return get_editor_keyboard()
+    else:  # Просмотрщик
+        return get_viewer_keyboard()
+
+PERIOD_FORMAT_HINT = "ДД.ММ.ГГГГ-ДД.ММ.ГГГГ"
+
+# Период из текста вида 01.01.2024-31.03.2024: (начало, конец) как date.
+# ValueError - неверный формат или начало позже конца
+def parse_period(text):
+    start_text, end_text = text.replace(" ", "").split("-")
+    start = datetime.strptime(start_text, "%d.%m.%Y").date()
+    end = datetime.strptime(end_text, "%d.%m.%Y").date()
+    if start > end:
+        raise ValueError("Начало периода позже конца")
+    return start, end
+
+# Сколько секунд роль пользователя хранится в кэше
+ROLE_CACHE_TTL = 300
+
+# Кэш ролей по Telegram ID. Роли меняются только через админку,
+# которая сразу обновляет кэш, поэтому TTL - лишь страховка.
+# Незарегистрированные пользователи тоже кэшируются (роль None).
+class RoleCache:
+    def __init__(self, ttl=ROLE_CACHE_TTL):
+        self.ttl = ttl
+        self._roles = {}
+        # Номер изменения для каждого пользователя: не даем запросу, начатому
+        # до смены роли, записать в кэш устаревшее значение
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+        }
+
+    # (найдено ли в кэше, роль)
+    def get(self, user_id):
+        with self._lock:
+            entry = self._roles.get(user_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self.stats['hits'] += 1
+                return True, entry[0]
+            self.stats['misses'] += 1
+            return False, None
+
+    def version(self, user_id):
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    # Запомнить роль, прочитанную из БД, если она не менялась с момента version
+    def store(self, user_id, role, version):
+        with self._lock:
+            if self._versions.get(user_id, 0) == version:
+                self._roles[user_id] = (role, time.monotonic() + self.ttl)
+
+    # Записать новую роль сразу после ее сохранения в БД
+    def set(self, user_id, role):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._roles[user_id] = (role, time.monotonic() + self.ttl)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._roles.pop(user_id, None)
+            self.stats['invalidations'] += 1
+
+    def metrics(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'size': len(self._roles),
+            'ttl': self.ttl,
+            'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+            **self.stats,
+        }
+
+role_cache = RoleCache()
+
+# Роль пользователя (None, если пользователь не зарегистрирован)
+async def get_user_role(user_id):
+    found, role = role_cache.get(user_id)
+    if found:
+        return role
+    
+    version = role_cache.version(user_id)
+    result = await db.fetchone("SELECT role FROM users WHERE user_id = ?", (user_id,))
+    role = result[0] if result else None
+    role_cache.store(user_id, role, version)
     
-    if not result:
+    return role
+
+# Проверка роли пользователя: 0 - администратор, 1 - редактор, 2 - просмотрщик
+def has_access(role, required_role=2):
+    if role is None:
         return False
     
-    return result[0] <= required_role
+    return role <= required_role
+
+# Минимальная роль для обработчика. Декоратор ставится под @dp.*_handler:
+#   @dp.message_handler(...)
+#   @requires_role(1)
+#   async def handler(message: types.Message): ...
+def requires_role(required_role):
+    def decorator(handler):
+        handler.required_role = required_role
+        return handler
+    return decorator
+
+ACCESS_DENIED_TEXT = "У вас нет доступа к этой функции."
+
+# Определяет роль пользователя один раз на каждое обновление, не пускает
+# к обработчикам с @requires_role пользователей без нужной роли и передает
+# роль в обработчики, у которых есть параметр role
+class AuthMiddleware(BaseMiddleware):
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        data['role'] = await get_user_role(message.from_user.id)
+
+    async def on_pre_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        data['role'] = await get_user_role(callback_query.from_user.id)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        if not self._allowed(data):
+            await message.answer(ACCESS_DENIED_TEXT)
+            raise CancelHandler()
+
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        if not self._allowed(data):
+            await callback_query.answer(ACCESS_DENIED_TEXT, show_alert=True)
+            raise CancelHandler()
+
+    def _allowed(self, data):
+        handler = current_handler.get()
+        required_role = getattr(handler, 'required_role', None)
+        if required_role is None:
+            return True
+        return has_access(data.get('role'), required_role)
+
+dp.middleware.setup(AuthMiddleware())
 
 # Обработчик команды /start
 @dp.message_handler(commands=['start'])
-async def cmd_start(message: types.Message):
-    conn = init_db()
-    cursor = conn.cursor()
-    
-    user_id = message.from_user.id
-    username = message.from_user.username
-    
+async def cmd_start(message: types.Message, role):
     # Проверяем наличие пользователя
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-    user = cursor.fetchone()
-    
-    if not user:
+    if role is None:
         # Новый пользователь - не регистрируем, отправляем шуточное сообщение
         await message.answer("О нет, кажется вы вотермелон, сбросьте 50 кг, чтобы пользоваться ботом!")
     else:
         # Существующий пользователь
-        if user[0] == 0:
+        if role == 0:
             await message.answer("Привет! Вы вошли как администратор.", reply_markup=get_admin_keyboard())
-        elif user[0] == 1:
+        elif role == 1:
             await message.answer("Привет! Вы вошли как редактор.", reply_markup=get_editor_keyboard())
         else:
             await message.answer("Привет! Вы вошли как просмотрщик.", reply_markup=get_viewer_keyboard())
-    
-    conn.close()
 
 @dp.message_handler(commands=['myid'])
 async def cmd_myid(message: types.Message):
@@ -84,9 +212,7 @@ async def cmd_myid(message: types.Message):
 @dp.message_handler(commands=['makeadmin'])
 async def cmd_makeadmin(message: types.Message):
     user_id = message.from_user.id
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET role = 0 WHERE user_id = ?", (user_id,))
-    conn.commit()
+    cursor = await db.execute("UPDATE users SET role = 0 WHERE user_id = ?", (user_id,))
+    if cursor.rowcount:
+        role_cache.set(user_id, 0)
     await message.answer("Ваша роль обновлена до администратора!")
-    conn.close()
@@ -0,0 +1,131 @@
+# Подсказки городов погрузки и разгрузки по уже введенным в рейсах.
+# Индекс в памяти строится один раз из trips (loading_city и unloading_city)
+# и дальше обновляется по сохраненным, измененным и удаленным рейсам:
+#   - ключ города: без регистра, ё = е, дефисы и лишние пробелы - пробел,
+#     так что "Ростов-на-Дону" и "ростов на дону" - один город;
+#   - показывается самое частое написание города;
+#   - по префиксу ищется bisect в отсортированном списке ключей,
+#     по триграммам - города с опечатками и совпадением в середине названия;
+#   - подсказки упорядочены по числу рейсов.
+
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+CITY_MIN_PREFIX = 2  # Сколько букв нужно ввести для подсказок
+CITY_SUGGESTIONS = 6  # Подсказок (кнопок) не больше
+CITY_FUZZY_THRESHOLD = 0.4  # Доля общих триграмм для подсказки с опечаткой
+
+# Все города рейсов с числом упоминаний
+CITY_COUNTS = """
+SELECT city, COUNT(*)
+FROM (SELECT loading_city AS city FROM trips UNION ALL SELECT unloading_city FROM trips)
+WHERE city IS NOT NULL AND city != ''
+GROUP BY city
+"""
+
+def city_key(name):
+    return re.sub(r"[\s\-]+", " ", name.casefold().replace('ё', 'е')).strip()
+
+# Триграммы ключа; у введенного текста конец слова не отмечается - его могли
+# не допечатать
+def _trigrams(key, complete=True):
+    padded = f"  {key} " if complete else f"  {key}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class CityIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.loaded = False
+        self._counts = Counter()  # ключ -> рейсов
+        self._spellings = {}  # ключ -> Counter(написание -> рейсов)
+        self._keys = []  # ключи по алфавиту
+        self._trigrams = {}  # триграмма -> ключи
+
+    def _add(self, name, count):
+        key = city_key(name)
+        if not key:
+            return
+        if key not in self._spellings:
+            self._spellings[key] = Counter()
+            insort(self._keys, key)
+            for trigram in _trigrams(key):
+                self._trigrams.setdefault(trigram, set()).add(key)
+        self._spellings[key][name.strip()] += count
+        self._counts[key] += count
+
+    # Полная загрузка: rows - (город, рейсов), см. CITY_COUNTS
+    def load(self, rows):
+        with self._lock:
+            self._reset()
+            for name, count in rows:
+                self._add(name, count)
+            self.loaded = True
+
+    # Инкрементальные обновления по рейсам (до загрузки не нужны - их учтет загрузка)
+    def add(self, *names):
+        with self._lock:
+            if self.loaded:
+                for name in names:
+                    if name:
+                        self._add(name, 1)
+
+    # Уменьшить счетчики; город без рейсов остается в индексе, но уходит в конец подсказок
+    def remove(self, *names):
+        with self._lock:
+            if not self.loaded:
+                return
+            for name in names:
+                key = city_key(name or '')
+                if self._counts.get(key, 0) > 0:
+                    self._counts[key] -= 1
+                    self._spellings[key][name.strip()] -= 1
+
+    def clear(self):
+        with self._lock:
+            self.loaded = False
+
+    def _display(self, key):
+        return self._spellings[key].most_common(1)[0][0]
+
+    # Принятое написание известного города или None
+    def canonical(self, name):
+        key = city_key(name)
+        with self._lock:
+            return self._display(key) if key in self._spellings else None
+
+    # До limit подсказок: сначала по префиксу, затем по триграммам
+    def suggest(self, text, limit=CITY_SUGGESTIONS):
+        key = city_key(text)
+        if len(key) < CITY_MIN_PREFIX:
+            return []
+        with self._lock:
+            start = bisect_left(self._keys, key)
+            end = bisect_left(self._keys, key + '\uffff')
+            found = heapq.nlargest(limit, self._keys[start:end], key=self._counts.__getitem__)
+
+            if len(found) < limit and len(key) >= 3:
+                query = _trigrams(key, complete=False)
+                scores = Counter()
+                for trigram in query:
+                    for candidate in self._trigrams.get(trigram, ()):
+                        scores[candidate] += 1
+                fuzzy = [
+                    candidate for candidate, score in scores.items()
+                    if score >= CITY_FUZZY_THRESHOLD * len(query) and candidate not in found
+                ]
+                fuzzy.sort(key=lambda candidate: (-scores[candidate], -self._counts[candidate]))
+                found.extend(fuzzy[:limit - len(found)])
+
+            return [self._display(candidate) for candidate in found]
+
+city_index = CityIndex()
+
+# Загрузка индекса в потоке БД (db.run)
+def load_city_index(conn):
+    city_index.load(conn.execute(CITY_COUNTS).fetchall())
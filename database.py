@@ -1,4 +1,364 @@
+import asyncio
+import logging
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from ledger import create_driver_balances
+from rollup import create_daily_driver_stats, split_trip_update_trigger
+from payments import create_payments, create_payout_batches, create_payment_allocation
+from rates import create_driver_rates
+from directory import create_directory_version
+from routes import create_routes
+
+# Путь к файлу базы данных
+DB_PATH = 'salary_bot.db'
+
+# Настройки пула соединений
+POOL_SIZE = 5  # Максимальное количество открытых соединений
+POOL_TIMEOUT = 10.0  # Сколько секунд ждать свободное соединение
+
+# Профили производительности хранилища (PRAGMA SQLite).
+# durable  - настройки SQLite по умолчанию: журнал отката, synchronous=FULL
+# balanced - WAL: читатели не блокируют писателей, fsync только на контрольных точках
+# fast     - WAL без fsync: максимум скорости, последние транзакции могут
+#            потеряться при отключении питания (но не при падении процесса)
+STORAGE_PROFILES = {
+    'durable': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,  # КиБ (отрицательное значение), ~2 МБ
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 10000,  # мс
+    },
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+    },
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+    },
+}
+
+# Профиль, применяемый при запуске бота
+STORAGE_PROFILE = 'balanced'
+
+class PoolTimeoutError(Exception):
+    pass
+
+def get_storage_profile(profile):
+    if isinstance(profile, dict):
+        return profile
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Неизвестный профиль хранилища: {profile} (доступны: {', '.join(STORAGE_PROFILES)})")
+    return STORAGE_PROFILES[profile]
+
+# Настройки, действующие в пределах одного соединения
+def configure_connection(conn, profile=STORAGE_PROFILE):
+    settings = get_storage_profile(profile)
+    conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(settings['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store = {settings['temp_store']}")
+    conn.execute(f"PRAGMA busy_timeout = {int(settings['busy_timeout'])}")
+
+# Режим журнала хранится в самом файле БД, поэтому задается один раз при запуске,
+# пока другие соединения еще не открыты
+def apply_storage_profile(conn, profile=STORAGE_PROFILE):
+    settings = get_storage_profile(profile)
+    journal_mode = conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}").fetchone()[0]
+    configure_connection(conn, settings)
+    return journal_mode
+
+# Пул переиспользуемых соединений с SQLite.
+# Соединения не закрываются после каждого обработчика, поэтому
+# не тратится время на connect/разбор схемы и сохраняется кэш страниц.
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=POOL_TIMEOUT, profile=STORAGE_PROFILE):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.profile = profile
+        # LIFO: чаще всего отдаем последнее возвращенное ("теплое") соединение
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self.stats = {
+            'created': 0,
+            'acquired': 0,
+            'released': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'discarded': 0,
+            'wait_time': 0.0,
+        }
+
+    def _create(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        try:
+            configure_connection(conn, self.profile)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        self.stats['created'] += 1
+        return conn
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._create()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                # Все соединения заняты - ждем, пока какое-нибудь вернут
+                self.stats['waits'] += 1
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f"Нет свободных соединений с БД за {timeout} с (размер пула: {self.size})"
+                    )
+                finally:
+                    self.stats['wait_time'] += time.perf_counter() - started
+        
+        self.stats['acquired'] += 1
+        return conn
+
+    def release(self, conn):
+        self.stats['released'] += 1
+        try:
+            # Незавершенную транзакцию не отдаем следующему обработчику
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("SELECT 1")
+        except sqlite3.Error:
+            # Соединение испорчено - закрываем, вместо него позже откроется новое
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        self.stats['discarded'] += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def health(self):
+        idle = self._idle.qsize()
+        return {
+            'size': self.size,
+            'opened': self._opened,
+            'idle': idle,
+            'in_use': self._opened - idle,
+            **self.stats,
+        }
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+# Соединение из пула с интерфейсом обычного sqlite3.Connection:
+# close() возвращает соединение в пул, а не закрывает его
+class PooledConnection:
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+        self._conn = pool.acquire()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        # Повторный close() ничего не делает
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._conn is not None:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        self.close()
+
+    def __del__(self):
+        # Страховка для обработчиков, забывших вызвать close()
+        if self.__dict__.get('_conn') is not None:
+            self.close()
+
+pool = ConnectionPool()
+
+# Получить соединение из общего пула
+def connect():
+    return PooledConnection(pool)
+
+# Асинхронный шлюз к БД.
+# Запросы выполняются в отдельном пуле потоков, поэтому медленный отчет
+# не блокирует цикл событий aiogram и FSM-шаги других пользователей.
+DB_WORKERS = POOL_SIZE  # Количество потоков; больше размера пула смысла нет
+
+def _fetchone(conn, sql, params):
+    return conn.execute(sql, params).fetchone()
+
+def _fetchall(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+def _execute(conn, sql, params):
+    cursor = conn.execute(sql, params)
+    conn.commit()
+    return cursor
+
+def _transaction(conn, func, args):
+    cursor = conn.cursor()
+    try:
+        result = func(cursor, *args)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+
+class AsyncDatabase:
+    def __init__(self, pool, workers=DB_WORKERS):
+        self._pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self.workers = workers
+        self.stats = {
+            'jobs': 0,
+            'errors': 0,
+            'max_queue_depth': 0,
+            'wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'run_time': 0.0,
+        }
+
+    def _job(self, func, args, enqueued):
+        started = time.perf_counter()
+        wait = started - enqueued
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            with self._pool.connection() as conn:
+                return func(conn, *args)
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+                self.stats['jobs'] += 1
+                self.stats['wait_time'] += wait
+                self.stats['max_wait_time'] = max(self.stats['max_wait_time'], wait)
+                self.stats['run_time'] += time.perf_counter() - started
+
+    # Выполнить func(conn, *args) в потоке БД с соединением из пула
+    async def run(self, func, *args):
+        with self._lock:
+            self._queued += 1
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self._queued)
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._executor, self._job, func, args, time.perf_counter())
+        except RuntimeError:
+            # Пул потоков уже остановлен - задача так и не попала в очередь
+            with self._lock:
+                self._queued -= 1
+            raise
+        return await future
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(_fetchone, sql, params)
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(_fetchall, sql, params)
+
+    # Одиночный запрос на изменение с commit; возвращает курсор (lastrowid, rowcount)
+    async def execute(self, sql, params=()):
+        return await self.run(_execute, sql, params)
+
+    # Выполнить func(cursor, *args) в одной транзакции: commit или rollback при ошибке
+    async def transaction(self, func, *args):
+        return await self.run(_transaction, func, args)
+
+    def metrics(self):
+        jobs = self.stats['jobs']
+        return {
+            'workers': self.workers,
+            'queue_depth': self._queued,
+            'running': self._running,
+            'avg_wait_time': self.stats['wait_time'] / jobs if jobs else 0.0,
+            'avg_run_time': self.stats['run_time'] / jobs if jobs else 0.0,
+            **self.stats,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+db = AsyncDatabase(pool)
+
+# Контекстный менеджер: commit при успехе, rollback при ошибке, возврат в пул
+@contextmanager
+def get_connection():
+    with pool.connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
 def create_tables(cursor):
     # Таблица пользователей и ролей
@@ -51,6 +411,9 @@ def create_tables(cursor):
         side_loading_count INTEGER DEFAULT 0,
         roof_loading_count INTEGER DEFAULT 0,
         total_payment REAL NOT NULL,
+        paid INTEGER DEFAULT 0,  -- 1: рейс полностью оплачен
+        paid_amount REAL DEFAULT 0,  -- Сколько уже выплачено по рейсу
+        trip_1c_number TEXT,  -- Номер рейса в 1С
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (driver_id) REFERENCES drivers (id),
         FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
@@ -82,10 +445,148 @@ def create_tables(cursor):
     )
     ''')
 
-def init_db():
-    conn = sqlite3.connect('salary_bot.db')
+# Индексы под частые запросы отчетов и выплат
+INDEXES = [
+    # Неоплаченные рейсы по дате: списки долгов и общий остаток к выплате
+    # (частичный индекс - в нем только paid = 0; колонка paid включена,
+    # чтобы суммы считались по индексу без обращения к таблице)
+    ('idx_trips_unpaid_created',
+     "CREATE INDEX IF NOT EXISTS idx_trips_unpaid_created "
+     "ON trips (created_at, total_payment, paid_amount, paid) WHERE paid = 0"),
+    # Долги по водителям и неоплаченные рейсы конкретного водителя (покрывающий)
+    ('idx_trips_unpaid_driver',
+     "CREATE INDEX IF NOT EXISTS idx_trips_unpaid_driver "
+     "ON trips (driver_id, created_at, total_payment, paid_amount, paid) WHERE paid = 0"),
+    # Статистика водителей за период (покрывающий)
+    ('idx_trips_driver_created',
+     "CREATE INDEX IF NOT EXISTS idx_trips_driver_created "
+     "ON trips (driver_id, created_at, distance, total_payment)"),
+    # История рейсов за период и выгрузка по дате
+    ('idx_trips_created',
+     "CREATE INDEX IF NOT EXISTS idx_trips_created ON trips (created_at)"),
+    # Простои рейса (удаление рейса вместе с простоями)
+    ('idx_downtimes_trip',
+     "CREATE INDEX IF NOT EXISTS idx_downtimes_trip ON downtimes (trip_id)"),
+]
+
+def create_indexes(cursor):
+    for _, sql in INDEXES:
+        cursor.execute(sql)
+
+# Добавить колонку, если ее еще нет (для баз, созданных старыми версиями бота)
+def _add_column(cursor, table, column, definition):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _migrate_trip_payments(cursor):
+    _add_column(cursor, 'trips', 'paid', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'trips', 'paid_amount', 'REAL DEFAULT 0')
+
+def _migrate_trip_1c_number(cursor):
+    _add_column(cursor, 'trips', 'trip_1c_number', 'TEXT')
+
+def _migrate_driver_vehicle(cursor):
+    _add_column(cursor, 'drivers', 'vehicle_id', 'INTEGER')
+
+# Версия данных для кэша отчетов (report_cache): триггеры увеличивают ее
+# в той же транзакции, что и любую запись в таблицы, из которых строятся отчеты
+DATA_VERSION_TABLES = ['trips', 'downtimes', 'drivers', 'vehicles']
+
+def create_data_version_triggers(cursor, table):
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_data_version
+        AFTER {event} ON {table}
+        BEGIN
+            UPDATE data_version SET version = version + 1 WHERE id = 1;
+        END
+        """)
+
+def create_data_version(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+    for table in DATA_VERSION_TABLES:
+        create_data_version_triggers(cursor, table)
+
+def _migrate_payments(cursor):
+    create_payments(cursor)
+    create_data_version_triggers(cursor, 'payments')
+
+# Миграции схемы по порядку: (версия, описание, функция(cursor)).
+# Новые изменения схемы добавляются только в конец списка со следующим номером.
+MIGRATIONS = [
+    (1, "Начальная схема", create_tables),
+    (2, "Оплата рейсов: paid, paid_amount", _migrate_trip_payments),
+    (3, "Номер рейса из 1С", _migrate_trip_1c_number),
+    (4, "Привязка автопоезда к водителю", _migrate_driver_vehicle),
+    (5, "Индексы для отчетов и выплат", create_indexes),
+    (6, "Сводка задолженности по водителям", create_driver_balances),
+    (7, "Версия данных для кэша отчетов", create_data_version),
+    (8, "Дневная статистика по водителям", create_daily_driver_stats),
+    (9, "Журнал выплат", _migrate_payments),
+    (10, "Пакеты выплат", create_payout_batches),
+    (11, "Распределение выплаты по рейсам", create_payment_allocation),
+    (12, "Быстрый учет изменения сумм рейса в дневной статистике", split_trip_update_trigger),
+    (13, "История ставок водителей", create_driver_rates),
+    (14, "Версия справочников для клавиатур выбора", create_directory_version),
+    (15, "Справочник расстояний маршрутов", create_routes),
+]
+
+def get_schema_version(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return cursor.fetchone()[0] or 0
+
+# Применить недостающие миграции; каждая - в своей транзакции вместе с отметкой о версии
+def migrate(conn):
+    cursor = conn.cursor()
+    current = get_schema_version(cursor)
+    conn.commit()
+    
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        cursor.execute("BEGIN")
+        try:
+            func(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logging.error(f"Ошибка миграции схемы БД до версии {version}: {description}")
+            raise
+        logging.info(f"Схема БД обновлена до версии {version}: {description}")
+        applied.append(version)
+    
+    return applied
+
+def init_db(profile=STORAGE_PROFILE):
+    conn = sqlite3.connect(DB_PATH)
+    # Режим журнала и прочие PRAGMA из профиля хранилища
+    expected = get_storage_profile(profile)['journal_mode']
+    journal_mode = apply_storage_profile(conn, profile)
+    if journal_mode.upper() != expected:
+        logging.warning(f"Не удалось включить режим журнала {expected}, используется {journal_mode}")
+    # Обновляем схему до последней версии (один раз при запуске)
+    migrate(conn)
+    
     cursor = conn.cursor()
-    create_tables(cursor)
     
     # Проверяем наличие администратора
     cursor.execute("SELECT COUNT(*) FROM users WHERE role = 0")
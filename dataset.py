@@ -0,0 +1,251 @@
+import argparse
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from database import DB_PATH, apply_storage_profile, migrate
+from ledger import rebuild_driver_balances
+
+# Генератор синтетических данных автопарка для проверки бота на больших объемах.
+#   python dataset.py --drivers 200 --trips 1000000 [путь к БД]
+# Распределения приближены к рабочим:
+#   - водители работают неравномерно (у части водителей рейсов в разы больше);
+#   - рейсов в будни больше, чем в выходные, время погрузки - днем;
+#   - расстояние - логнормальное (много коротких рейсов, редкие дальние);
+#   - старые рейсы оплачены, свежие - нет, часть из них оплачена частично.
+
+CITIES = [
+    ('Москва', 30), ('Санкт-Петербург', 14), ('Казань', 6), ('Нижний Новгород', 6),
+    ('Екатеринбург', 6), ('Самара', 4), ('Воронеж', 4), ('Ростов-на-Дону', 5),
+    ('Краснодар', 5), ('Тверь', 3), ('Ярославль', 3), ('Тула', 3), ('Рязань', 2),
+    ('Владимир', 2), ('Новосибирск', 3), ('Челябинск', 3), ('Пермь', 2), ('Уфа', 2),
+    ('Волгоград', 2), ('Смоленск', 1),
+]
+
+FIRST_NAMES = ['Александр', 'Сергей', 'Дмитрий', 'Андрей', 'Алексей', 'Иван', 'Михаил',
+               'Николай', 'Владимир', 'Евгений', 'Олег', 'Павел', 'Юрий', 'Виктор']
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов',
+              'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев']
+
+CHUNK_SIZE = 10000  # Рейсов в одной транзакции вставки
+PAID_AFTER_DAYS = 21  # Рейсы старше - как правило уже оплачены
+PARTIAL_SHARE = 0.15  # Доля частично оплаченных среди неоплаченных рейсов
+REGULAR_DOWNTIME_SHARE = 0.25
+FORCED_DOWNTIME_SHARE = 0.08
+WEEKEND_WEIGHT = 0.35  # Относительная загрузка субботы и воскресенья
+
+# Формат CURRENT_TIMESTAMP, чтобы сравнения с datetime('now', ...) работали как в боте
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def _seed_vehicles(cursor, rnd, count):
+    letters = 'АВЕКМНОРСТУХ'
+    vehicle_ids = []
+    for i in range(count):
+        truck = f"{rnd.choice(letters)}{i % 1000:03d}{rnd.choice(letters)}{rnd.choice(letters)}{rnd.choice(['77', '99', '177', '50', '78'])}"
+        trailer = f"{rnd.choice(letters)}{rnd.choice(letters)}{i % 10000:04d}{rnd.choice(['77', '50', '78'])}"
+        cursor.execute("INSERT INTO vehicles (truck_number, trailer_number) VALUES (?, ?)", (truck, trailer))
+        vehicle_ids.append(cursor.lastrowid)
+    return vehicle_ids
+
+def _seed_drivers(cursor, rnd, count, vehicle_ids):
+    drivers = []
+    for i in range(count):
+        km_rate = round(rnd.uniform(9, 16), 1)
+        rates = (km_rate, rnd.choice([400, 500, 600]), rnd.choice([600, 700, 800]),
+                 rnd.choice([250, 300, 350]), rnd.choice([400, 450, 500]))
+        vehicle_id = vehicle_ids[i % len(vehicle_ids)] if vehicle_ids else None
+        cursor.execute(
+            """
+            INSERT INTO drivers
+            (name, km_rate, side_loading_rate, roof_loading_rate,
+             regular_downtime_rate, forced_downtime_rate, vehicle_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (f"{rnd.choice(LAST_NAMES)} {rnd.choice(FIRST_NAMES)} #{i + 1}", *rates, vehicle_id)
+        )
+        # Вес активности водителя: распределение Парето дает "тяжелый хвост"
+        drivers.append((cursor.lastrowid, vehicle_id, rates, rnd.paretovariate(2.0)))
+    return drivers
+
+def _random_moment(rnd, now, days):
+    # Будни загружены сильнее выходных
+    while True:
+        moment = now - timedelta(days=rnd.random() * days)
+        if moment.weekday() < 5 or rnd.random() < WEEKEND_WEIGHT:
+            break
+    # Большинство рейсов оформляются в рабочее время
+    hour = min(23, max(0, int(rnd.gauss(13, 3.5))))
+    return moment.replace(hour=hour, minute=rnd.randint(0, 59), second=rnd.randint(0, 59))
+
+def _make_trip(rnd, driver, vehicle_ids, cities, city_weights, now, days):
+    driver_id, vehicle_id, rates, _ = driver
+    km_rate, side_rate, roof_rate, regular_rate, forced_rate = rates
+
+    loading_city, unloading_city = rnd.choices(cities, city_weights, k=2)
+    while unloading_city == loading_city:
+        unloading_city = rnd.choices(cities, city_weights)[0]
+
+    distance = round(min(3500, max(30, rnd.lognormvariate(6.0, 0.7))))
+    side_count = rnd.choices([0, 1, 2, 3], [50, 30, 15, 5])[0]
+    roof_count = rnd.choices([0, 1, 2], [75, 20, 5])[0]
+
+    downtimes = []
+    if rnd.random() < REGULAR_DOWNTIME_SHARE:
+        hours = rnd.choice([2, 4, 6, 8, 12, 24])
+        downtimes.append((1, hours, hours * regular_rate))
+    if rnd.random() < FORCED_DOWNTIME_SHARE:
+        hours = rnd.choice([4, 8, 12, 24, 48])
+        downtimes.append((2, hours, hours * forced_rate))
+
+    total_payment = (distance * km_rate + side_count * side_rate + roof_count * roof_rate
+                     + sum(payment for _, _, payment in downtimes))
+
+    created = _random_moment(rnd, now, days)
+    age_days = (now - created).days
+    # Чем старше рейс, тем вероятнее он оплачен
+    paid = 1 if rnd.random() < min(0.99, age_days / PAID_AFTER_DAYS) else 0
+    paid_amount = total_payment if paid else 0
+    if not paid and rnd.random() < PARTIAL_SHARE:
+        paid_amount = round(total_payment * rnd.uniform(0.1, 0.9), -2)
+    # Выплата - через несколько дней после рейса, но не позже сегодняшнего дня
+    paid_at = created + timedelta(days=rnd.uniform(0, min(age_days, PAID_AFTER_DAYS)))
+
+    # Водитель иногда едет на другом автопоезде
+    if vehicle_id is None or rnd.random() < 0.05:
+        vehicle_id = rnd.choice(vehicle_ids) if vehicle_ids else None
+
+    trip = (
+        driver_id, vehicle_id, loading_city, unloading_city, distance,
+        side_count, roof_count, total_payment, paid, paid_amount,
+        f"РЕЙС-{rnd.randint(1, 999999):06d}" if rnd.random() < 0.8 else None,
+        created.strftime(TIMESTAMP_FORMAT)
+    )
+    return trip, downtimes, paid_at.strftime(TIMESTAMP_FORMAT)
+
+def _insert_chunk(cursor, trips, user_ids, rnd):
+    downtime_rows = []
+    payment_rows = []
+    log_rows = []
+    for trip, downtimes, paid_at in trips:
+        cursor.execute(
+            """
+            INSERT INTO trips
+            (driver_id, vehicle_id, loading_city, unloading_city, distance,
+             side_loading_count, roof_loading_count, total_payment, paid, paid_amount,
+             trip_1c_number, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            trip
+        )
+        trip_id = cursor.lastrowid
+        created_at = trip[11]
+        for downtime_type, hours, payment in downtimes:
+            downtime_rows.append((trip_id, downtime_type, hours, payment, created_at))
+
+        user_id = rnd.choice(user_ids)
+        if trip[9]:
+            payment_rows.append((trip_id, trip[0], trip[9], paid_at, user_id))
+        log_rows.append((user_id, "Добавление рейса",
+                         f"Рейс #{trip_id}: {trip[2]} - {trip[3]}, {trip[4]} км", created_at))
+        if trip[8]:
+            log_rows.append((user_id, "Полная оплата рейса",
+                             f"Рейс #{trip_id}: {trip[7]} руб.", paid_at))
+        elif trip[9]:
+            log_rows.append((user_id, "Частичная оплата рейса",
+                             f"Рейс #{trip_id}: внесено {trip[9]} ₽", paid_at))
+
+    cursor.executemany(
+        "INSERT INTO downtimes (trip_id, type, hours, payment, created_at) VALUES (?, ?, ?, ?, ?)",
+        downtime_rows
+    )
+    cursor.executemany(
+        "INSERT INTO payments (trip_id, driver_id, amount, paid_at, user_id) VALUES (?, ?, ?, ?, ?)",
+        payment_rows
+    )
+    cursor.executemany(
+        "INSERT INTO logs (user_id, action, details, created_at) VALUES (?, ?, ?, ?)",
+        log_rows
+    )
+    return len(downtime_rows), len(log_rows)
+
+# Заполнить БД синтетическими данными; возвращает количество созданных записей
+def generate_dataset(conn, drivers=50, vehicles=50, trips=10000, days=365, users=5,
+                     seed=0, progress=None):
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    cursor = conn.cursor()
+
+    user_ids = [900000000 + i for i in range(users)]
+    cursor.executemany(
+        "INSERT OR IGNORE INTO users (user_id, username, role) VALUES (?, ?, ?)",
+        [(user_id, f"synthetic_{i}", 1) for i, user_id in enumerate(user_ids)]
+    )
+    vehicle_ids = _seed_vehicles(cursor, rnd, vehicles)
+    driver_list = _seed_drivers(cursor, rnd, drivers, vehicle_ids)
+    conn.commit()
+
+    cities = [name for name, _ in CITIES]
+    city_weights = [weight for _, weight in CITIES]
+    driver_weights = [driver[3] for driver in driver_list]
+
+    counts = {'drivers': drivers, 'vehicles': vehicles, 'trips': 0, 'downtimes': 0, 'logs': 0}
+    while counts['trips'] < trips:
+        size = min(CHUNK_SIZE, trips - counts['trips'])
+        chunk = [
+            _make_trip(rnd, driver, vehicle_ids, cities, city_weights, now, days)
+            for driver in rnd.choices(driver_list, driver_weights, k=size)
+        ]
+        downtime_count, log_count = _insert_chunk(cursor, chunk, user_ids, rnd)
+        conn.commit()
+        counts['trips'] += size
+        counts['downtimes'] += downtime_count
+        counts['logs'] += log_count
+        if progress:
+            progress(counts)
+
+    # Сводка задолженности и статистика планировщика по новым данным
+    rebuild_driver_balances(cursor)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетических данных автопарка")
+    parser.add_argument('path', nargs='?', default=DB_PATH)
+    parser.add_argument('--drivers', type=int, default=50)
+    parser.add_argument('--vehicles', type=int, default=None, help="по умолчанию - по числу водителей")
+    parser.add_argument('--trips', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=365, help="за сколько дней распределить рейсы")
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', default='fast', help="профиль хранилища на время генерации")
+    parser.add_argument('--append', action='store_true', help="дописать в БД, где уже есть рейсы")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.path)
+    apply_storage_profile(conn, args.profile)
+    migrate(conn)
+
+    existing = conn.execute("SELECT COUNT(*) FROM trips").fetchone()[0]
+    if existing and not args.append:
+        conn.close()
+        print(f"В {args.path} уже есть рейсы ({existing}). Укажите --append или другой файл.")
+        sys.exit(1)
+
+    started = time.perf_counter()
+
+    def progress(counts):
+        print(f"\rРейсов: {counts['trips']}/{args.trips}", end='', flush=True)
+
+    counts = generate_dataset(
+        conn, drivers=args.drivers, vehicles=args.vehicles or args.drivers, trips=args.trips,
+        days=args.days, users=args.users, seed=args.seed, progress=progress
+    )
+    conn.close()
+    print(f"\nГотово за {time.perf_counter() - started:.1f} с: {counts}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# Справочники водителей и автопоездов в памяти для клавиатур выбора
+# (pickers.py): списки, отсортированные по алфавиту, и границы букв в них.
+# Клавиатура любой страницы собирается срезом списка без запросов к БД.
+# Снимок перечитывается, только когда меняется directory_version - ее
+# увеличивают триггеры на добавление, удаление и переименование водителей
+# и автопоездов (записи рейсов, ставок и т.п. снимок не сбрасывают).
+
+import threading
+
+# Справочник -> запрос (id, подпись кнопки)
+DIRECTORY_QUERIES = {
+    'drivers': "SELECT id, name FROM drivers",
+    'vehicles': "SELECT id, truck_number || ' / ' || COALESCE(trailer_number, '') FROM vehicles",
+}
+
+# Поля, при изменении которых меняются подписи кнопок
+_DIRECTORY_FIELDS = {
+    'drivers': "name",
+    'vehicles': "truck_number, trailer_number",
+}
+
+def create_directory_version(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS directory_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO directory_version (id, version) VALUES (1, 0)")
+    for table, fields in _DIRECTORY_FIELDS.items():
+        for event in ('INSERT', 'DELETE', f'UPDATE OF {fields}'):
+            cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.split()[0].lower()}_directory_version
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE directory_version SET version = version + 1 WHERE id = 1;
+            END
+            """)
+
+def _sort_key(label):
+    return label.casefold().replace('ё', 'е')
+
+# Буква алфавитного раздела: первая буква или цифра подписи ('#' - прочие)
+def bucket_letter(label):
+    for char in label:
+        if char.isalnum():
+            return '#' if char.isdigit() else char.upper().replace('Ё', 'Е')
+    return '#'
+
+class DirectorySnapshot:
+    def __init__(self, rows_by_kind):
+        # справочник -> [(id, подпись)] по алфавиту
+        self.items = {}
+        # справочник -> {буква: (начало, конец) в items}, буквы по алфавиту
+        self.buckets = {}
+        for kind, rows in rows_by_kind.items():
+            items = sorted(((row[0], row[1] or '') for row in rows), key=lambda item: _sort_key(item[1]))
+            buckets = {}
+            for position, (_, label) in enumerate(items):
+                letter = bucket_letter(label)
+                start, _ = buckets.get(letter, (position, position))
+                buckets[letter] = (start, position + 1)
+            self.items[kind] = items
+            self.buckets[kind] = buckets
+
+    def count(self, kind):
+        return len(self.items[kind])
+
+    # Записи справочника: все или только раздела letter
+    def section(self, kind, letter=None):
+        if letter is None:
+            return self.items[kind]
+        start, end = self.buckets[kind].get(letter, (0, 0))
+        return self.items[kind][start:end]
+
+class Directory:
+    def __init__(self):
+        self._version = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'loads': 0,
+            'hits': 0,
+        }
+
+    def _load(self, cursor):
+        rows_by_kind = {}
+        for kind, query in DIRECTORY_QUERIES.items():
+            cursor.execute(query)
+            rows_by_kind[kind] = cursor.fetchall()
+        return DirectorySnapshot(rows_by_kind)
+
+    # Актуальный снимок: проверка версии - один запрос по первичному ключу.
+    # Снимок, прочитанный в транзакции с записями, не кэшируется
+    def snapshot(self, cursor):
+        cursor.execute("SELECT version FROM directory_version WHERE id = 1")
+        version = cursor.fetchone()[0]
+        with self._lock:
+            if self._snapshot is not None and self._version == version:
+                self.stats['hits'] += 1
+                return self._snapshot
+        snapshot = self._load(cursor)
+        if cursor.connection.in_transaction:
+            return snapshot
+        with self._lock:
+            self._version = version
+            self._snapshot = snapshot
+            self.stats['loads'] += 1
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._snapshot = None
+
+directory = Directory()
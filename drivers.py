@@ -1,9 +1,17 @@
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from bot import dp, bot, check_user_access
-import sqlite3
+from bot import dp, bot, get_main_keyboard, requires_role
+from audit import audit
+from database import db
+from paging import PagedList
+from pickers import Picker
+from payroll import RATE_FIELDS
+from rates import set_driver_rate
+from repricing import preview_repricing, apply_repricing
+from datetime import datetime
 import aiogram.utils.exceptions
+import logging
 
 # Состояния для добавления/редактирования водителя
 class DriverStates(StatesGroup):
@@ -34,33 +42,16 @@ async def manage_menu(message: types.Message):
     await message.answer("Выберите раздел для управления:", reply_markup=keyboard)
 
 @dp.message_handler(lambda message: message.text == "👤 Водители")
+@requires_role(1)
 async def manage_drivers(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     await message.answer("Управление водителями", reply_markup=get_drivers_keyboard())
-    conn.close()
 
 # Обработчик для добавления водителя
 @dp.message_handler(lambda message: message.text == "👤 Добавить водителя")
+@requires_role(1)
 async def add_driver(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     await message.answer("Введите ФИО водителя:")
     await DriverStates.waiting_for_name.set()
-    
-    conn.close()
 
 # Последовательность шагов для ввода данных о водителе
 @dp.message_handler(state=DriverStates.waiting_for_name)
@@ -91,29 +82,13 @@ async def process_km_rate(message: types.Message, state: FSMContext):
 
 # Обработчик для кнопки "Назад"
 @dp.message_handler(lambda message: message.text == "◀️ Назад", state="*")
-async def back_button_handler(message: types.Message, state: FSMContext):
+async def back_button_handler(message: types.Message, state: FSMContext, role):
     # Получаем и сбрасываем текущее состояние
     current_state = await state.get_state()
     if current_state:
         await state.finish()
     
-    from bot import get_editor_keyboard, get_viewer_keyboard, get_admin_keyboard
-    
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Проверяем роль пользователя
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (message.from_user.id,))
-    user_role = cursor.fetchone()
-    
-    if user_role and user_role[0] == 0:  # Администратор
-        await message.answer("Действие отменено. Возврат в главное меню.", reply_markup=get_admin_keyboard())
-    elif await check_user_access(cursor, message.from_user.id, required_role=1):  # Редактор
-        await message.answer("Действие отменено. Возврат в главное меню.", reply_markup=get_editor_keyboard())
-    else:  # Просмотрщик
-        await message.answer("Действие отменено. Возврат в главное меню.", reply_markup=get_viewer_keyboard())
-    
-    conn.close()
+    await message.answer("Действие отменено. Возврат в главное меню.", reply_markup=get_main_keyboard(role))
     
     # Важно! Сообщаем, что сообщение обработано, чтобы оно не попало в другие обработчики
     return
@@ -213,48 +188,48 @@ async def process_notes(message: types.Message, state: FSMContext):
     await message.answer(confirmation_text)
     await DriverStates.waiting_for_confirmation.set()
 
+# Страница списка водителей с кнопками для просмотра деталей
+async def render_drivers_page(page):
+    text = "📋 Список водителей:\n\n"
+    
+    for driver_id, name, km_rate in page.rows:
+        text += f"ID: {driver_id} | 👤 {name} | 💰 {km_rate} руб/км\n"
+    
+    text += "\nНажмите на имя водителя ниже, чтобы просмотреть детали:"
+    
+    buttons = [
+        types.InlineKeyboardButton(f"👤 {name}", callback_data=f"driver_info_{driver_id}")
+        for driver_id, name, _ in page.rows
+    ]
+    return text, buttons
+
+# Водители в порядке добавления
+drivers_list = PagedList(
+    'drivers',
+    columns="d.id, d.name, d.km_rate",
+    tables="drivers d",
+    key=('d.created_at', 'd.id'),
+    descending=False,
+    render=render_drivers_page,
+    required_role=1
+)
+
 # Обработчик списка водителей
 @dp.message_handler(lambda message: message.text == "📋 Список водителей")
+@requires_role(1)
 async def list_drivers(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
-    cursor.execute("SELECT id, name, km_rate FROM drivers ORDER BY name")
-    drivers = cursor.fetchall()
+    text, keyboard = await drivers_list.render_page()
     
-    if not drivers:
+    if text is None:
         await message.answer("Список водителей пуст. Добавьте водителей с помощью кнопки '👤 Добавить водителя'.", 
                            reply_markup=get_drivers_keyboard())
-        conn.close()
         return
     
-    # Формируем список водителей с инлайн-кнопками
-    text = "📋 Список водителей:\n\n"
-    
-    for driver_id, name, km_rate in drivers:
-        text += f"ID: {driver_id} | 👤 {name} | 💰 {km_rate} руб/км\n"
-    
-    text += "\nНажмите на имя водителя ниже, чтобы просмотреть детали:"
-    
-    # Создаем инлайн-клавиатуру для выбора водителя
-    keyboard = types.InlineKeyboardMarkup(row_width=1)
-    for driver_id, name, _ in drivers:
-        keyboard.add(types.InlineKeyboardButton(
-            f"👤 {name}", callback_data=f"driver_info_{driver_id}"
-        ))
-    
     # Отправляем одно сообщение с инлайн-клавиатурой
     await message.answer(text, reply_markup=keyboard)
     
     # Показываем обычную клавиатуру отдельным вызовом (без текста)
     await message.answer("", reply_markup=get_drivers_keyboard())
-    
-    conn.close()
 
 # Обработчик для просмотра информации о водителе
 @dp.callback_query_handler(lambda c: c.data.startswith('driver_info_'))
@@ -263,47 +238,21 @@ async def show_driver_info(callback_query: types.CallbackQuery):
     
     driver_id = int(callback_query.data.split('_')[2])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Проверяем структуру таблицы перед выполнением запроса
-    cursor.execute("PRAGMA table_info(drivers)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    has_vehicle_id = 'vehicle_id' in columns
-    
-    if has_vehicle_id:
-        # Получаем данные водителя с информацией о транспорте
-        cursor.execute("""
-            SELECT d.name, d.km_rate, d.side_loading_rate, d.roof_loading_rate,
-                d.regular_downtime_rate, d.forced_downtime_rate, d.notes,
-                v.truck_number, v.trailer_number
-            FROM drivers d
-            LEFT JOIN vehicles v ON d.vehicle_id = v.id
-            WHERE d.id = ?
-        """, (driver_id,))
-    else:
-        # Получаем данные водителя без информации о транспорте
-        cursor.execute("""
-            SELECT name, km_rate, side_loading_rate, roof_loading_rate,
-                regular_downtime_rate, forced_downtime_rate, notes
-            FROM drivers
-            WHERE id = ?
-        """, (driver_id,))
-    
-    driver_data = cursor.fetchone()
+    # Получаем данные водителя с информацией о транспорте
+    driver_data = await db.fetchone("""
+        SELECT d.name, d.km_rate, d.side_loading_rate, d.roof_loading_rate,
+            d.regular_downtime_rate, d.forced_downtime_rate, d.notes,
+            v.truck_number, v.trailer_number
+        FROM drivers d
+        LEFT JOIN vehicles v ON d.vehicle_id = v.id
+        WHERE d.id = ?
+    """, (driver_id,))
     
     if not driver_data:
         await bot.send_message(callback_query.from_user.id, "Водитель не найден!")
-        conn.close()
         return
     
-    # Формируем сообщение в зависимости от наличия столбца vehicle_id
-    if has_vehicle_id:
-        name, km_rate, side_rate, roof_rate, reg_rate, forced_rate, notes, truck, trailer = driver_data
-    else:
-        name, km_rate, side_rate, roof_rate, reg_rate, forced_rate, notes = driver_data
-        truck, trailer = None, None
+    name, km_rate, side_rate, roof_rate, reg_rate, forced_rate, notes, truck, trailer = driver_data
     
     # Формируем сообщение
     text = (
@@ -316,7 +265,7 @@ async def show_driver_info(callback_query: types.CallbackQuery):
         f"⏱️ Вынужденный простой: {forced_rate} руб/день\n"
     )
     
-    if has_vehicle_id and truck and trailer:
+    if truck and trailer:
         text += f"🚛 Автопоезд: {truck}/{trailer}\n"
     else:
         text += "🚛 Автопоезд: не назначен\n"
@@ -330,12 +279,8 @@ async def show_driver_info(callback_query: types.CallbackQuery):
         types.InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_driver_{driver_id}")
     )
     
-    # Добавляем кнопку назначения автопоезда только если колонка существует
-    if has_vehicle_id:
-        keyboard.add(types.InlineKeyboardButton("🚛 Назначить автопоезд", callback_data=f"assign_vehicle_{driver_id}"))
-    else:
-        # Если столбца нет, то предлагаем обновить БД
-        keyboard.add(types.InlineKeyboardButton("🔄 Обновить базу данных", callback_data=f"update_db_structure"))
+    keyboard.add(types.InlineKeyboardButton("🚛 Назначить автопоезд", callback_data=f"assign_vehicle_{driver_id}"))
+    keyboard.add(types.InlineKeyboardButton("🔁 Пересчитать рейсы", callback_data=f"reprice_driver_{driver_id}"))
     
     keyboard.add(types.InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_driver_{driver_id}"))
     keyboard.add(types.InlineKeyboardButton("◀️ Назад к списку", callback_data="back_to_drivers_list"))
@@ -346,8 +291,6 @@ async def show_driver_info(callback_query: types.CallbackQuery):
         text, 
         reply_markup=keyboard
     )
-    
-    conn.close()
 
 # Обработчик для кнопки "Назад к списку"
 @dp.callback_query_handler(lambda c: c.data == "back_to_drivers_list")
@@ -366,46 +309,8 @@ async def back_to_drivers_list(callback_query: types.CallbackQuery):
     # Вызываем функцию для отображения списка водителей
     await list_drivers(message)
 
-# Обработчик для обновления структуры БД
-@dp.callback_query_handler(lambda c: c.data == "update_db_structure")
-async def update_db_structure(callback_query: types.CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-    
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute("ALTER TABLE drivers ADD COLUMN vehicle_id INTEGER")
-        conn.commit()
-        await bot.send_message(
-            callback_query.from_user.id,
-            "✅ База данных успешно обновлена! Теперь вы можете назначать автопоезда водителям.",
-            reply_markup=get_drivers_keyboard()
-        )
-    except sqlite3.OperationalError:
-        await bot.send_message(
-            callback_query.from_user.id,
-            "❌ Не удалось обновить базу данных. Возможно, она уже обновлена.",
-            reply_markup=get_drivers_keyboard()
-        )
-    
-    conn.close()
-
-# Финальный обработчик для сохранения водителя
-@dp.message_handler(state=DriverStates.waiting_for_confirmation)
-async def process_confirmation(message: types.Message, state: FSMContext):
-    if message.text.lower() not in ["да", "сохранить", "+"]:
-        await message.answer("Отменено. Данные не сохранены.", reply_markup=get_drivers_keyboard())
-        await state.finish()
-        return
-    
-    # Получаем все введенные данные
-    data = await state.get_data()
-    
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Сохраняем в базу
+# Сохранение водителя
+def _save_driver(cursor, data):
     cursor.execute(
         """
         INSERT INTO drivers 
@@ -423,15 +328,22 @@ async def process_confirmation(message: types.Message, state: FSMContext):
             data.get('notes', '')
         )
     )
+
+# Финальный обработчик для сохранения водителя
+@dp.message_handler(state=DriverStates.waiting_for_confirmation)
+async def process_confirmation(message: types.Message, state: FSMContext):
+    if message.text.lower() not in ["да", "сохранить", "+"]:
+        await message.answer("Отменено. Данные не сохранены.", reply_markup=get_drivers_keyboard())
+        await state.finish()
+        return
     
-    # Логируем действие
-    cursor.execute(
-        "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-        (message.from_user.id, "Добавление водителя", f"Добавлен водитель: {data.get('name')}")
-    )
+    # Получаем все введенные данные
+    data = await state.get_data()
     
-    conn.commit()
-    conn.close()
+    await db.transaction(_save_driver, data)
+    
+    # Логируем действие
+    await audit(message.from_user.id, "Добавление водителя", f"Добавлен водитель: {data.get('name')}")
     
     await message.answer(
         f"Водитель {data.get('name')} успешно добавлен!", 
@@ -444,6 +356,7 @@ class DriverEditStates(StatesGroup):
     waiting_for_driver_id = State()
     waiting_for_field = State()
     waiting_for_new_value = State()
+    waiting_for_valid_from = State()
     waiting_for_confirmation = State()
 
 # Обработчик для редактирования водителя
@@ -475,7 +388,7 @@ async def edit_driver(callback_query: types.CallbackQuery):
 async def edit_field(callback_query: types.CallbackQuery, state: FSMContext):
     parts = callback_query.data.split('_')
     driver_id = int(parts[2])
-    field = parts[3]
+    field = '_'.join(parts[3:])
     
     # Сохраняем информацию о водителе и поле
     await state.update_data(driver_id=driver_id, field=field)
@@ -499,6 +412,18 @@ async def edit_field(callback_query: types.CallbackQuery, state: FSMContext):
     
     await DriverEditStates.waiting_for_new_value.set()
 
+# Изменение поля водителя
+def _update_driver_field(cursor, driver_id, field, new_value):
+    # Обновляем данные в базе
+    cursor.execute(
+        f"UPDATE drivers SET {field} = ? WHERE id = ?",
+        (new_value, driver_id)
+    )
+    
+    # Получаем обновленные данные
+    cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
+    return cursor.fetchone()[0]
+
 # Обработчик для ввода нового значения
 @dp.message_handler(state=DriverEditStates.waiting_for_new_value)
 async def process_new_value(message: types.Message, state: FSMContext):
@@ -513,8 +438,7 @@ async def process_new_value(message: types.Message, state: FSMContext):
     
     # Проверяем и обрабатываем значение в зависимости от поля
     try:
-        if field in ['km_rate', 'side_loading_rate', 'roof_loading_rate', 
-                    'regular_downtime_rate', 'forced_downtime_rate']:
+        if field in RATE_FIELDS:
             new_value = float(message.text.replace(',', '.'))
         else:
             new_value = message.text
@@ -522,44 +446,115 @@ async def process_new_value(message: types.Message, state: FSMContext):
         await message.answer("Ошибка! Введите число.")
         return
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
+    # Ставка меняется с выбранной даты (история ставок)
+    if field in RATE_FIELDS:
+        await state.update_data(new_value=new_value)
+        await DriverEditStates.waiting_for_valid_from.set()
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(types.InlineKeyboardButton("📅 С сегодняшнего дня", callback_data="rate_from_today"))
+        await message.answer(
+            "С какой даты действует новая ставка? Введите дату в формате ДД.ММ.ГГГГ.\n"
+            "Рейсы до этой даты по-прежнему считаются по старой ставке.",
+            reply_markup=keyboard
+        )
+        return
     
-    # Обновляем данные в базе
-    cursor.execute(
-        f"UPDATE drivers SET {field} = ? WHERE id = ?",
-        (new_value, driver_id)
-    )
+    driver_name = await db.transaction(_update_driver_field, driver_id, field, new_value)
     
     # Логируем действие
-    cursor.execute(
-        "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-        (message.from_user.id, "Редактирование водителя", 
-         f"Водитель ID#{driver_id}, изменено поле {field} на {new_value}")
-    )
-    
-    conn.commit()
-    
-    # Получаем обновленные данные
-    cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
-    driver_name = cursor.fetchone()[0]
-    
-    conn.close()
+    await audit(message.from_user.id, "Редактирование водителя", 
+                f"Водитель ID#{driver_id}, изменено поле {field} на {new_value}")
     
     await message.answer(
         f"✅ Данные водителя {driver_name} успешно обновлены!",
         reply_markup=get_drivers_keyboard()
     )
     await state.finish()
+    await _show_updated_driver(message, message.from_user, driver_id)
+
+# Изменение ставки с даты; возвращает (имя водителя, рейсов в периоде новой
+# ставки, день окончания периода или None)
+def _set_driver_rate(cursor, driver_id, field, new_value, from_day):
+    until = set_driver_rate(cursor, driver_id, field, new_value, from_day)
+    cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
+    driver_name = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT COUNT(*) FROM trips WHERE driver_id = ? AND created_at >= ? AND (? IS NULL OR created_at < ?)",
+        (driver_id, from_day, until, until)
+    )
+    return driver_name, cursor.fetchone()[0], until
+
+async def _save_rate_change(message, user, state, from_date):
+    data = await state.get_data()
+    driver_id = data['driver_id']
+    field = data['field']
+    from_day = from_date.strftime('%Y-%m-%d')
+    
+    driver_name, trips_count, until = await db.transaction(
+        _set_driver_rate, driver_id, field, data['new_value'], from_day
+    )
+    await state.finish()
+    
+    await audit(user.id, "Редактирование водителя",
+                f"Водитель ID#{driver_id}, ставка {field} = {data['new_value']} с {from_day}")
+    
+    text = f"✅ Ставка водителя {driver_name} изменена с {from_date.strftime('%d.%m.%Y')}."
+    if until:
+        # Более позднее изменение этой ставки остается в силе
+        until_date = datetime.strptime(until, '%Y-%m-%d')
+        text += (
+            f"\nНовая ставка действует до {until_date.strftime('%d.%m.%Y')}: "
+            f"с этого дня ставка уже была изменена позже и остается прежней."
+        )
+    keyboard = None
+    if trips_count:
+        # Уже внесенные рейсы сами не пересчитываются
+        text += f"\nРейсов в периоде новой ставки: {trips_count}, их суммы пока посчитаны по прежней ставке."
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(types.InlineKeyboardButton(
+            f"🔁 Пересчитать рейсы с {from_date.strftime('%d.%m.%Y')}",
+            callback_data=f"reprice_from_{driver_id}_{from_date.strftime('%Y%m%d')}"
+        ))
+    await message.answer(text, reply_markup=keyboard or get_drivers_keyboard())
+    await _show_updated_driver(message, user, driver_id)
+
+# Обработчик ввода даты, с которой действует новая ставка
+@dp.message_handler(state=DriverEditStates.waiting_for_valid_from)
+async def process_rate_valid_from(message: types.Message, state: FSMContext):
+    if message.text == "◀️ Назад":
+        await state.finish()
+        await message.answer("Действие отменено", reply_markup=get_drivers_keyboard())
+        return
     
-    # После обновления данных показываем обновленную карточку водителя
+    try:
+        from_date = datetime.strptime(message.text.strip(), "%d.%m.%Y").date()
+    except ValueError:
+        await message.answer("Неверная дата. Введите ее в формате ДД.ММ.ГГГГ")
+        return
+    
+    if from_date > datetime.utcnow().date():
+        await message.answer("Ставку нельзя задать с будущей даты. Введите сегодняшнюю или прошедшую дату.")
+        return
+    
+    await _save_rate_change(message, message.from_user, state, from_date)
+
+# Обработчик кнопки "С сегодняшнего дня"
+@dp.callback_query_handler(lambda c: c.data == "rate_from_today", state=DriverEditStates.waiting_for_valid_from)
+async def process_rate_from_today(callback_query: types.CallbackQuery, state: FSMContext):
+    await bot.answer_callback_query(callback_query.id)
+    await _save_rate_change(
+        callback_query.message, callback_query.from_user, state, datetime.utcnow().date()
+    )
+
+# Карточка водителя после изменения его данных
+async def _show_updated_driver(message, user, driver_id):
     # Создаем callback с id водителя
     callback_data = f"driver_info_{driver_id}"
     
     # Создаем новый объект callback_query (через объект Message)
     callback = types.CallbackQuery(
         id=str(message.message_id),
-        from_user=message.from_user,
+        from_user=user,
         chat_instance=str(message.chat.id),
         message=message,
         data=callback_data,
@@ -570,89 +565,38 @@ async def process_new_value(message: types.Message, state: FSMContext):
     # Показываем карточку водителя с обновленными данными
     await show_driver_info(callback)
 
+# Клавиатура выбора автопоезда для водителя (аргумент - id водителя)
+assign_vehicle_picker = Picker(
+    'assign_vehicle', 'vehicles', "set_vehicle_{arg}_{id}",
+    footer=[("❌ Отменить назначение", "set_vehicle_{arg}_0")]
+)
+
 # Обработчик для назначения автопоезда водителю
 @dp.callback_query_handler(lambda c: c.data.startswith('assign_vehicle_'))
 async def assign_vehicle(callback_query: types.CallbackQuery):
     driver_id = int(callback_query.data.split('_')[2])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Проверяем структуру таблицы перед выполнением запроса
-    cursor.execute("PRAGMA table_info(drivers)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    if 'vehicle_id' not in columns:
-        # Если колонки нет, добавляем ее
-        try:
-            cursor.execute("ALTER TABLE drivers ADD COLUMN vehicle_id INTEGER")
-            conn.commit()
-            await bot.send_message(
-                callback_query.from_user.id,
-                "✅ База данных обновлена: добавлена поддержка автопоездов!"
-            )
-        except sqlite3.OperationalError:
-            # Колонка уже существует или другая ошибка
-            pass
-    
-    # Получаем список автопоездов
-    cursor.execute("SELECT id, truck_number, trailer_number FROM vehicles ORDER BY truck_number")
-    vehicles = cursor.fetchall()
-    
-    if not vehicles:
+    # Клавиатура из справочника автопоездов
+    keyboard, vehicles_count = await assign_vehicle_picker.markup(driver_id)
+    
+    if not vehicles_count:
         await bot.answer_callback_query(callback_query.id, "Нет доступных автопоездов!")
         await bot.send_message(
             callback_query.from_user.id,
             "Список автопоездов пуст. Добавьте автопоезда в разделе Управление → Автопоезда.",
             reply_markup=get_drivers_keyboard()
         )
-        conn.close()
         return
     
-    # Создаем клавиатуру для выбора автопоезда
-    keyboard = types.InlineKeyboardMarkup(row_width=1)
-    for vehicle_id, truck, trailer in vehicles:
-        keyboard.add(types.InlineKeyboardButton(
-            f"{truck}/{trailer}", callback_data=f"set_vehicle_{driver_id}_{vehicle_id}"
-        ))
-    
-    # Добавляем кнопку для отмены назначения
-    keyboard.add(types.InlineKeyboardButton(
-        "❌ Отменить назначение", callback_data=f"set_vehicle_{driver_id}_0"
-    ))
-    
     await bot.answer_callback_query(callback_query.id)
     await bot.send_message(
         callback_query.from_user.id,
         "Выберите автопоезд для водителя:",
         reply_markup=keyboard
     )
-    
-    conn.close()
 
-# Обработчик для установки автопоезда
-@dp.callback_query_handler(lambda c: c.data.startswith('set_vehicle_'))
-async def set_vehicle(callback_query: types.CallbackQuery):
-    parts = callback_query.data.split('_')
-    driver_id = int(parts[2])
-    vehicle_id = int(parts[3])
-    
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Проверяем структуру таблицы перед выполнением запроса
-    cursor.execute("PRAGMA table_info(drivers)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    if 'vehicle_id' not in columns:
-        # Если колонки нет, добавляем ее
-        try:
-            cursor.execute("ALTER TABLE drivers ADD COLUMN vehicle_id INTEGER")
-            conn.commit()
-        except sqlite3.OperationalError:
-            # Колонка уже существует или другая ошибка
-            pass
-    
+# Назначение автопоезда водителю
+def _set_driver_vehicle(cursor, driver_id, vehicle_id):
     # Получаем имя водителя
     cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
     driver_name = cursor.fetchone()[0]
@@ -671,15 +615,20 @@ async def set_vehicle(callback_query: types.CallbackQuery):
         truck, trailer = cursor.fetchone()
         vehicle_info = f"{truck}/{trailer}"
     
-    # Логируем действие
-    cursor.execute(
-        "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-        (callback_query.from_user.id, "Назначение автопоезда", 
-         f"Водителю {driver_name} (ID#{driver_id}) назначен автопоезд {vehicle_info}")
-    )
+    return driver_name, vehicle_info
+
+# Обработчик для установки автопоезда
+@dp.callback_query_handler(lambda c: c.data.startswith('set_vehicle_'))
+async def set_vehicle(callback_query: types.CallbackQuery):
+    parts = callback_query.data.split('_')
+    driver_id = int(parts[2])
+    vehicle_id = int(parts[3])
     
-    conn.commit()
-    conn.close()
+    driver_name, vehicle_info = await db.transaction(_set_driver_vehicle, driver_id, vehicle_id)
+    
+    # Логируем действие
+    await audit(callback_query.from_user.id, "Назначение автопоезда", 
+                f"Водителю {driver_name} (ID#{driver_id}) назначен автопоезд {vehicle_info}")
     
     await bot.answer_callback_query(callback_query.id)
     
@@ -712,16 +661,11 @@ async def set_vehicle(callback_query: types.CallbackQuery):
 async def delete_driver(callback_query: types.CallbackQuery):
     driver_id = int(callback_query.data.split('_')[2])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     # Получаем имя водителя
-    cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
-    driver_result = cursor.fetchone()
+    driver_result = await db.fetchone("SELECT name FROM drivers WHERE id = ?", (driver_id,))
     
     if not driver_result:
         await bot.answer_callback_query(callback_query.id, "Водитель не найден!")
-        conn.close()
         return
     
     driver_name = driver_result[0]
@@ -739,39 +683,36 @@ async def delete_driver(callback_query: types.CallbackQuery):
         f"⚠️ Вы уверены, что хотите удалить водителя {driver_name}?",
         reply_markup=keyboard
     )
-    
-    conn.close()
 
-# Обработчик для подтверждения удаления
-@dp.callback_query_handler(lambda c: c.data.startswith('confirm_delete_'))
-async def confirm_delete_driver(callback_query: types.CallbackQuery):
-    driver_id = int(callback_query.data.split('_')[2])
-    
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
+# Удаление водителя
+def _delete_driver(cursor, driver_id):
     # Получаем имя водителя
     cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
     driver_result = cursor.fetchone()
     
     if not driver_result:
-        await bot.answer_callback_query(callback_query.id, "Водитель не найден!")
-        conn.close()
-        return
+        return None
     
     driver_name = driver_result[0]
     
     # Удаляем водителя
     cursor.execute("DELETE FROM drivers WHERE id = ?", (driver_id,))
     
-    # Логируем действие
-    cursor.execute(
-        "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-        (callback_query.from_user.id, "Удаление водителя", f"Удален водитель: {driver_name}")
-    )
+    return driver_name
+
+# Обработчик для подтверждения удаления
+@dp.callback_query_handler(lambda c: c.data.startswith('confirm_delete_'))
+async def confirm_delete_driver(callback_query: types.CallbackQuery):
+    driver_id = int(callback_query.data.split('_')[2])
+    
+    driver_name = await db.transaction(_delete_driver, driver_id)
+    
+    if driver_name is None:
+        await bot.answer_callback_query(callback_query.id, "Водитель не найден!")
+        return
     
-    conn.commit()
-    conn.close()
+    # Логируем действие
+    await audit(callback_query.from_user.id, "Удаление водителя", f"Удален водитель: {driver_name}")
     
     await bot.answer_callback_query(callback_query.id)
     await bot.send_message(
@@ -789,3 +730,181 @@ async def cancel_delete(callback_query: types.CallbackQuery):
         "❌ Удаление отменено.",
         reply_markup=get_drivers_keyboard()
     )
+
+# Состояния для пересчета рейсов водителя по ставкам на дату рейса
+class RepriceStates(StatesGroup):
+    waiting_for_start_date = State()
+    waiting_for_scope = State()
+    waiting_for_confirmation = State()
+
+# Обработчик кнопки "Пересчитать рейсы"
+@dp.callback_query_handler(lambda c: c.data.startswith('reprice_driver_'))
+@requires_role(1)
+async def reprice_driver(callback_query: types.CallbackQuery, state: FSMContext):
+    driver_id = int(callback_query.data.split('_')[2])
+    
+    await state.update_data(driver_id=driver_id)
+    await RepriceStates.waiting_for_start_date.set()
+    
+    await bot.answer_callback_query(callback_query.id)
+    await bot.send_message(
+        callback_query.from_user.id,
+        "Рейсы водителя будут пересчитаны по ставкам, действовавшим в день каждого рейса.\n"
+        "Введите дату, с которой пересчитать рейсы, в формате ДД.ММ.ГГГГ\n"
+        "Например: 01.03.2024"
+    )
+
+# Обработчик ввода даты начала пересчета
+@dp.message_handler(state=RepriceStates.waiting_for_start_date)
+async def process_reprice_start_date(message: types.Message, state: FSMContext):
+    if message.text == "◀️ Назад":
+        await state.finish()
+        await message.answer("Действие отменено", reply_markup=get_drivers_keyboard())
+        return
+    
+    try:
+        start_date = datetime.strptime(message.text.strip(), "%d.%m.%Y").date()
+    except ValueError:
+        await message.answer("Неверная дата. Введите ее в формате ДД.ММ.ГГГГ")
+        return
+    
+    await ask_reprice_scope(message.chat.id, state, start_date)
+
+# Выбор рейсов для пересчета с даты start_date
+async def ask_reprice_scope(chat_id, state, start_date):
+    await state.update_data(start_day=start_date.strftime('%Y-%m-%d'))
+    await RepriceStates.waiting_for_scope.set()
+    
+    keyboard = types.InlineKeyboardMarkup(row_width=1)
+    keyboard.add(
+        types.InlineKeyboardButton("💰 Только неоплаченные", callback_data="reprice_scope_unpaid"),
+        types.InlineKeyboardButton("📋 Все рейсы", callback_data="reprice_scope_all"),
+        types.InlineKeyboardButton("❌ Отмена", callback_data="reprice_cancel")
+    )
+    await bot.send_message(
+        chat_id,
+        f"Какие рейсы с {start_date.strftime('%d.%m.%Y')} пересчитать?\n"
+        "Оплаченный рейс, который станет дороже выплаченного, снова станет неоплаченным на разницу.",
+        reply_markup=keyboard
+    )
+
+# Обработчик кнопки пересчета после изменения ставки: дата уже известна
+@dp.callback_query_handler(lambda c: c.data.startswith('reprice_from_'))
+@requires_role(1)
+async def reprice_driver_from(callback_query: types.CallbackQuery, state: FSMContext):
+    _, _, driver_id, start_text = callback_query.data.split('_')
+    
+    await state.finish()
+    await state.update_data(driver_id=int(driver_id))
+    await bot.answer_callback_query(callback_query.id)
+    await ask_reprice_scope(
+        callback_query.message.chat.id, state, datetime.strptime(start_text, '%Y%m%d').date()
+    )
+
+# Текст предпросмотра или итогов пересчета
+def format_repricing(driver_name, start_day, unpaid_only, summary, applied=False):
+    trips, changed, old_total, new_total, debt_delta, reopened = summary
+    text = (
+        f"{'✅ Рейсы пересчитаны' if applied else '🔁 Пересчет рейсов'}\n\n"
+        f"👤 Водитель: {driver_name}\n"
+        f"📅 С {datetime.strptime(start_day, '%Y-%m-%d').strftime('%d.%m.%Y')}, "
+        f"{'только неоплаченные' if unpaid_only else 'все рейсы'}\n"
+        f"🚚 Рейсов: {trips}, {'изменено' if applied else 'изменится'}: {changed}\n"
+        f"💵 Сумма рейсов: {int(old_total)} ₽ → {int(new_total)} ₽ ({new_total - old_total:+.0f} ₽)\n"
+        f"💰 Долг водителю: {debt_delta:+.0f} ₽\n"
+    )
+    if reopened:
+        text += f"⚠️ Оплаченных рейсов станут неоплаченными: {reopened}\n"
+    return text
+
+# Обработчик выбора рейсов для пересчета: предпросмотр без изменений
+@dp.callback_query_handler(lambda c: c.data in ["reprice_scope_unpaid", "reprice_scope_all"],
+                           state=RepriceStates.waiting_for_scope)
+async def process_reprice_scope(callback_query: types.CallbackQuery, state: FSMContext):
+    unpaid_only = callback_query.data == "reprice_scope_unpaid"
+    data = await state.get_data()
+    
+    driver = await db.fetchone("SELECT name FROM drivers WHERE id = ?", (data['driver_id'],))
+    summary = await db.transaction(preview_repricing, data['driver_id'], data['start_day'], unpaid_only)
+    await bot.answer_callback_query(callback_query.id)
+    
+    if driver is None or summary is None:
+        await state.finish()
+        await bot.send_message(callback_query.from_user.id, "Водитель не найден!",
+                               reply_markup=get_drivers_keyboard())
+        return
+    
+    if not summary[1]:
+        await state.finish()
+        await bot.send_message(
+            callback_query.from_user.id,
+            f"Рейсов для пересчета: {summary[0]}. Суммы уже соответствуют ставкам на даты рейсов.",
+            reply_markup=get_drivers_keyboard()
+        )
+        return
+    
+    await state.update_data(unpaid_only=unpaid_only)
+    await RepriceStates.waiting_for_confirmation.set()
+    
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(
+        types.InlineKeyboardButton("✅ Применить", callback_data="reprice_apply"),
+        types.InlineKeyboardButton("❌ Отмена", callback_data="reprice_cancel")
+    )
+    await bot.send_message(
+        callback_query.from_user.id,
+        format_repricing(driver[0], data['start_day'], unpaid_only, summary),
+        reply_markup=keyboard
+    )
+
+# Пересчет рейсов одной транзакцией
+def _apply_repricing(cursor, driver_id, start_day, unpaid_only):
+    cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
+    driver = cursor.fetchone()
+    if driver is None:
+        return None, None
+    return driver[0], apply_repricing(cursor, driver_id, start_day, unpaid_only)
+
+# Обработчик подтверждения пересчета
+@dp.callback_query_handler(lambda c: c.data == "reprice_apply", state=RepriceStates.waiting_for_confirmation)
+async def confirm_repricing(callback_query: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await state.finish()
+    await bot.answer_callback_query(callback_query.id)
+    
+    try:
+        driver_name, summary = await db.transaction(
+            _apply_repricing, data['driver_id'], data['start_day'], data['unpaid_only']
+        )
+    except Exception as e:
+        logging.error(f"Ошибка при пересчете рейсов водителя: {str(e)}")
+        await bot.send_message(callback_query.from_user.id, f"❌ Ошибка при пересчете рейсов: {str(e)}")
+        return
+    
+    if summary is None:
+        await bot.send_message(callback_query.from_user.id, "Водитель не найден!",
+                               reply_markup=get_drivers_keyboard())
+        return
+    
+    trips, changed, old_total, new_total, debt_delta, reopened = summary
+    await audit(callback_query.from_user.id, "Пересчет рейсов",
+                f"Водитель ID#{data['driver_id']}, рейсы с {data['start_day']}"
+                f"{' (неоплаченные)' if data['unpaid_only'] else ''}: изменено {changed} из {trips}, "
+                f"сумма {old_total:.2f} -> {new_total:.2f}, долг {debt_delta:+.2f}")
+    
+    await bot.send_message(
+        callback_query.from_user.id,
+        format_repricing(driver_name, data['start_day'], data['unpaid_only'], summary, applied=True),
+        reply_markup=get_drivers_keyboard()
+    )
+
+# Обработчик отмены пересчета
+@dp.callback_query_handler(lambda c: c.data == "reprice_cancel", state="*")
+async def cancel_repricing(callback_query: types.CallbackQuery, state: FSMContext):
+    await state.finish()
+    await bot.answer_callback_query(callback_query.id)
+    await bot.send_message(
+        callback_query.from_user.id,
+        "❌ Пересчет отменен.",
+        reply_markup=get_drivers_keyboard()
+    )
@@ -0,0 +1,87 @@
+import csv
+import gzip
+import io
+import shutil
+import tempfile
+
+from database import db
+
+# Выгрузка отчетов в CSV без копий всей таблицы в памяти: строки читаются
+# пачками (fetchmany) и сразу пишутся во временный файл, который отправляется
+# в Telegram как есть. Пока файл маленький, он живет в памяти, большой
+# автоматически уходит на диск - пиковое потребление памяти не зависит от объема.
+
+EXPORT_BATCH_SIZE = 1000  # Строк за один fetchmany
+EXPORT_SPOOL_SIZE = 1024 * 1024  # Больше - временный файл переносится на диск
+EXPORT_GZIP_OVER = 20 * 1024 * 1024  # CSV больше этого размера сжимается (лимит Telegram - 50 МБ)
+
+# Формат CSV, который открывается в Excel без мастера импорта
+CSV_ENCODING = 'utf-8-sig'
+CSV_DELIMITER = ';'
+
+# Выгрузка отменена пользователем (бросается из функции progress)
+class ExportCancelled(Exception):
+    pass
+
+def _spooled_file():
+    return tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE, mode='w+b')
+
+# Записать результат запроса в бинарный файл; возвращает количество строк.
+# progress(rows) вызывается после каждой пачки и может прервать выгрузку исключением
+def write_csv(conn, sql, params, header, fileobj, batch_size=EXPORT_BATCH_SIZE, progress=None):
+    text = io.TextIOWrapper(fileobj, encoding=CSV_ENCODING, newline='')
+    writer = csv.writer(text, delimiter=CSV_DELIMITER, quotechar='"')
+    writer.writerow(header)
+
+    rows = 0
+    cursor = conn.execute(sql, params)
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        writer.writerows(batch)
+        rows += len(batch)
+        if progress:
+            progress(rows)
+
+    # Отцепляем обертку, чтобы она не закрыла файл вместе с собой
+    text.flush()
+    text.detach()
+    return rows
+
+def _gzip_file(source):
+    compressed = _spooled_file()
+    source.seek(0)
+    with gzip.GzipFile(fileobj=compressed, mode='wb') as archive:
+        shutil.copyfileobj(source, archive)
+    source.close()
+    return compressed
+
+# Выгрузка в потоке БД: (файл, количество строк, сжат ли файл).
+# compress=None - сжимать, только если CSV больше EXPORT_GZIP_OVER.
+# Файл открыт и перемотан в начало; закрыть его после отправки.
+def export_to_file(conn, sql, params, header, compress=None, batch_size=EXPORT_BATCH_SIZE,
+                   progress=None):
+    export_file = _spooled_file()
+    try:
+        if compress:
+            with gzip.GzipFile(fileobj=export_file, mode='wb') as archive:
+                rows = write_csv(conn, sql, params, header, archive, batch_size, progress)
+        else:
+            rows = write_csv(conn, sql, params, header, export_file, batch_size, progress)
+            if compress is None and export_file.tell() > EXPORT_GZIP_OVER:
+                export_file = _gzip_file(export_file)
+                compress = True
+    except Exception:
+        export_file.close()
+        raise
+
+    export_file.seek(0)
+    return export_file, rows, bool(compress)
+
+async def export_csv(sql, params, header, compress=None, progress=None):
+    return await db.run(export_to_file, sql, params, header, compress, EXPORT_BATCH_SIZE, progress)
+
+# Имя файла выгрузки с учетом сжатия
+def export_filename(name, compressed):
+    return f"{name}.csv.gz" if compressed else f"{name}.csv"
@@ -0,0 +1,238 @@
+import asyncio
+import itertools
+import logging
+import time
+from aiogram import types
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.exceptions import TelegramAPIError
+from bot import dp, bot
+from export import ExportCancelled, export_csv, export_filename
+
+# Фоновые выгрузки. Обработчик кнопки только ставит задачу в очередь и сразу
+# отвечает; файл собирают несколько воркеров, которые обновляют сообщение
+# с прогрессом и присылают документ, когда он готов.
+
+EXPORT_WORKERS = 2  # Одновременных выгрузок; каждая занимает поток БД целиком
+EXPORT_JOBS_PER_USER = 1  # Выгрузок одного пользователя в очереди и в работе
+EXPORT_PROGRESS_INTERVAL = 3.0  # Как часто обновлять сообщение с прогрессом, секунд
+
+class ExportJob:
+    def __init__(self, job_id, user_id, chat_id, title, sql, params, header, filename, caption):
+        self.id = job_id
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.title = title
+        self.sql = sql
+        self.params = params
+        self.header = header
+        self.filename = filename
+        self.caption = caption
+        self.message_id = None
+        self.started = False
+        self.rows = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    # Вызывается из потока БД после каждой пачки строк
+    def report_progress(self, rows):
+        self.rows = rows
+        if self.cancelled:
+            raise ExportCancelled()
+
+    def cancel_keyboard(self):
+        return InlineKeyboardMarkup().add(
+            InlineKeyboardButton("✖️ Отменить", callback_data=f"export_cancel_{self.id}")
+        )
+
+class ExportQueue:
+    def __init__(self, workers=EXPORT_WORKERS, per_user=EXPORT_JOBS_PER_USER,
+                 progress_interval=EXPORT_PROGRESS_INTERVAL):
+        self.workers = workers
+        self.per_user = per_user
+        self.progress_interval = progress_interval
+        self._queue = asyncio.Queue()
+        self._jobs = {}  # Задачи в очереди и в работе по id
+        self._ids = itertools.count(1)
+        self._tasks = []
+        self.stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'cancelled': 0,
+            'failed': 0,
+            'rows': 0,
+        }
+
+    def active_jobs(self, user_id):
+        return [job for job in self._jobs.values() if job.user_id == user_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    # Поставить выгрузку в очередь; None - у пользователя уже много выгрузок
+    async def submit(self, user_id, chat_id, title, sql, params, header, filename, caption):
+        if len(self.active_jobs(user_id)) >= self.per_user:
+            self.stats['rejected'] += 1
+            return None
+
+        job = ExportJob(next(self._ids), user_id, chat_id, title, sql, params, header, filename, caption)
+        self._jobs[job.id] = job
+        self.stats['submitted'] += 1
+
+        try:
+            message = await bot.send_message(
+                chat_id,
+                f"⏳ {title}: в очереди ({self._queue.qsize() + 1})",
+                reply_markup=job.cancel_keyboard()
+            )
+        except Exception:
+            self._jobs.pop(job.id, None)
+            raise
+        job.message_id = message.message_id
+        await self._queue.put(job)
+        return job
+
+    async def _set_status(self, job, text, with_cancel=False):
+        try:
+            await bot.edit_message_text(
+                chat_id=job.chat_id,
+                message_id=job.message_id,
+                text=text,
+                reply_markup=job.cancel_keyboard() if with_cancel else None
+            )
+        except TelegramAPIError as e:
+            # "message is not modified" и удаленные сообщения не мешают выгрузке
+            logging.debug(f"Не удалось обновить прогресс выгрузки #{job.id}: {e}")
+
+    async def _run_job(self, job):
+        job.started = True
+        if job.cancelled:
+            self.stats['cancelled'] += 1
+            await self._set_status(job, f"✖️ {job.title}: отменено")
+            return
+
+        await self._set_status(job, f"⏳ {job.title}: формируется...", with_cancel=True)
+        task = asyncio.ensure_future(
+            export_csv(job.sql, job.params, job.header, progress=job.report_progress)
+        )
+
+        # Пока файл собирается, показываем, сколько строк уже записано
+        reported = 0
+        while not task.done():
+            await asyncio.wait({task}, timeout=self.progress_interval)
+            if not task.done() and job.rows != reported and not job.cancelled:
+                reported = job.rows
+                await self._set_status(
+                    job, f"⏳ {job.title}: записано строк: {reported}", with_cancel=True
+                )
+
+        try:
+            export_file, rows, compressed = task.result()
+        except ExportCancelled:
+            self.stats['cancelled'] += 1
+            await self._set_status(job, f"✖️ {job.title}: отменено")
+            return
+
+        with export_file:
+            if not rows:
+                await self._set_status(job, f"{job.title}: нет данных для экспорта.")
+                return
+
+            await self._set_status(job, f"📤 {job.title}: отправка файла ({rows} строк)...")
+            await bot.send_document(
+                job.chat_id,
+                types.InputFile(export_file, filename=export_filename(job.filename, compressed)),
+                caption=job.caption
+            )
+
+        self.stats['completed'] += 1
+        self.stats['rows'] += rows
+        await self._set_status(job, f"✅ {job.title}: готово, {rows} строк")
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            started = time.perf_counter()
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                job.cancel()
+                raise
+            except Exception as e:
+                self.stats['failed'] += 1
+                logging.error(f"Ошибка выгрузки #{job.id} ({job.title}): {e}")
+                await self._set_status(job, f"❌ {job.title}: ошибка при экспорте: {e}")
+            finally:
+                self._jobs.pop(job.id, None)
+                self._queue.task_done()
+                logging.info(f"Выгрузка #{job.id} ({job.title}): {job.rows} строк за "
+                             f"{time.perf_counter() - started:.1f} с")
+
+    # Запустить воркеры (из on_startup, внутри цикла событий)
+    def start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    # Остановить воркеры; незавершенные выгрузки отменяются
+    async def stop(self):
+        for job in self._jobs.values():
+            job.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def metrics(self):
+        return {
+            'workers': self.workers,
+            'queued': self._queue.qsize(),
+            'active': len(self._jobs),
+            **self.stats,
+        }
+
+export_queue = ExportQueue()
+
+# Поставить выгрузку по нажатию кнопки и сразу ответить на callback
+async def submit_export(callback_query, title, sql, params, header, filename, caption):
+    job = await export_queue.submit(
+        callback_query.from_user.id, callback_query.message.chat.id,
+        title, sql, params, header, filename, caption
+    )
+    if job is None:
+        await bot.answer_callback_query(
+            callback_query.id,
+            text="Дождитесь окончания предыдущей выгрузки или отмените ее.",
+            show_alert=True
+        )
+        return None
+
+    await bot.answer_callback_query(callback_query.id, text="Выгрузка поставлена в очередь")
+    return job
+
+# Обработчик кнопки отмены выгрузки
+@dp.callback_query_handler(lambda c: c.data.startswith("export_cancel_"))
+async def cancel_export(callback_query: types.CallbackQuery):
+    job = export_queue.get(int(callback_query.data.split("_")[2]))
+
+    if job is None:
+        await bot.answer_callback_query(callback_query.id, text="Выгрузка уже завершена.")
+        return
+
+    if job.user_id != callback_query.from_user.id:
+        await bot.answer_callback_query(callback_query.id, text="Это не ваша выгрузка.", show_alert=True)
+        return
+
+    job.cancel()
+    await bot.answer_callback_query(callback_query.id, text="Выгрузка будет отменена")
+    
+    # Задача еще в очереди - воркер ее пропустит, сообщение обновляем сразу
+    if not job.started:
+        await bot.edit_message_text(
+            chat_id=job.chat_id,
+            message_id=job.message_id,
+            text=f"✖️ {job.title}: отменено",
+            reply_markup=None
+        )
@@ -0,0 +1,167 @@
+# Сводка задолженности по водителям (таблица driver_balances).
+# Обновляется в тех же транзакциях, что и рейсы, поэтому "Актуальные данные"
+# и долги по водителям читаются из нее, а не считаются по всей таблице trips.
+#   unpaid_count   - количество неоплаченных рейсов (paid = 0)
+#   unpaid_amount  - остаток к выплате по ним (total_payment - paid_amount)
+#   partial_amount - сколько по ним уже выплачено частично (paid_amount)
+
+# Допустимое расхождение сумм при проверке (накопление ошибок округления)
+BALANCE_TOLERANCE = 0.01
+
+def create_driver_balances(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS driver_balances (
+        driver_id INTEGER PRIMARY KEY,
+        unpaid_count INTEGER NOT NULL DEFAULT 0,
+        unpaid_amount REAL NOT NULL DEFAULT 0,
+        partial_amount REAL NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    rebuild_driver_balances(cursor)
+
+# Состояние рейса, влияющее на сводку: (driver_id, paid, total_payment, paid_amount)
+def trip_snapshot(cursor, trip_id):
+    cursor.execute(
+        "SELECT driver_id, paid, total_payment, paid_amount FROM trips WHERE id = ?",
+        (trip_id,)
+    )
+    return cursor.fetchone()
+
+# Вклад одного рейса в сводку водителя
+def _contribution(snapshot):
+    if snapshot is None:
+        return None, 0, 0.0, 0.0
+    driver_id, paid, total_payment, paid_amount = snapshot
+    if paid:
+        return driver_id, 0, 0.0, 0.0
+    paid_amount = paid_amount or 0
+    return driver_id, 1, (total_payment or 0) - paid_amount, paid_amount
+
+def _add_to_balance(cursor, driver_id, count, amount, partial):
+    if driver_id is None or (count == 0 and amount == 0 and partial == 0):
+        return
+    cursor.execute(
+        """
+        INSERT INTO driver_balances (driver_id, unpaid_count, unpaid_amount, partial_amount)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(driver_id) DO UPDATE SET
+            unpaid_count = unpaid_count + excluded.unpaid_count,
+            unpaid_amount = unpaid_amount + excluded.unpaid_amount,
+            partial_amount = partial_amount + excluded.partial_amount,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        (driver_id, count, amount, partial)
+    )
+
+# Учесть изменение рейса: before/after - результат trip_snapshot до и после
+# изменения (None - рейса не было или он удален)
+def apply_trip_change(cursor, before, after):
+    old_driver, old_count, old_amount, old_partial = _contribution(before)
+    new_driver, new_count, new_amount, new_partial = _contribution(after)
+
+    if old_driver == new_driver:
+        _add_to_balance(cursor, new_driver, new_count - old_count,
+                        new_amount - old_amount, new_partial - old_partial)
+    else:
+        _add_to_balance(cursor, old_driver, -old_count, -old_amount, -old_partial)
+        _add_to_balance(cursor, new_driver, new_count, new_amount, new_partial)
+
+# Новые неоплаченные рейсы водителя, добавленные разом (импорт)
+def add_trips_to_balance(cursor, driver_id, count, amount):
+    _add_to_balance(cursor, driver_id, count, amount, 0.0)
+
+# Рейсы водителя оплачены разом: убрать из сводки их количество, остаток
+# и частичные выплаты
+def remove_from_balance(cursor, driver_id, count, amount, partial):
+    _add_to_balance(cursor, driver_id, -count, -amount, -partial)
+
+# Все рейсы водителя оплачены - долгов больше нет
+def clear_driver_balance(cursor, driver_id):
+    cursor.execute(
+        """
+        UPDATE driver_balances
+        SET unpaid_count = 0, unpaid_amount = 0, partial_amount = 0,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE driver_id = ?
+        """,
+        (driver_id,)
+    )
+
+# Пересчитать сводку одного водителя по его неоплаченным рейсам
+# (частичный индекс idx_trips_unpaid_driver) - после массовых изменений сумм
+def refresh_driver_balance(cursor, driver_id):
+    cursor.execute("DELETE FROM driver_balances WHERE driver_id = ?", (driver_id,))
+    cursor.execute("""
+    INSERT INTO driver_balances (driver_id, unpaid_count, unpaid_amount, partial_amount)
+    SELECT driver_id, COUNT(*), COALESCE(SUM(total_payment - paid_amount), 0), COALESCE(SUM(paid_amount), 0)
+    FROM trips
+    WHERE paid = 0 AND driver_id = ?
+    GROUP BY driver_id
+    """, (driver_id,))
+
+# Сводка, посчитанная заново по таблице trips: {driver_id: (count, amount, partial)}
+def _actual_balances(cursor):
+    cursor.execute("""
+    SELECT driver_id, COUNT(*), SUM(total_payment - paid_amount), SUM(paid_amount)
+    FROM trips
+    WHERE paid = 0 AND driver_id IS NOT NULL
+    GROUP BY driver_id
+    """)
+    return {row[0]: (row[1], row[2] or 0, row[3] or 0) for row in cursor.fetchall()}
+
+def _stored_balances(cursor):
+    cursor.execute("SELECT driver_id, unpaid_count, unpaid_amount, partial_amount FROM driver_balances")
+    return {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
+
+# Расхождения сводки с таблицей trips: [(driver_id, в сводке, по рейсам)]
+def verify_driver_balances(cursor):
+    actual = _actual_balances(cursor)
+    stored = _stored_balances(cursor)
+    empty = (0, 0.0, 0.0)
+
+    mismatches = []
+    for driver_id in sorted(set(actual) | set(stored)):
+        have = stored.get(driver_id, empty)
+        want = actual.get(driver_id, empty)
+        if (have[0] != want[0]
+                or abs(have[1] - want[1]) > BALANCE_TOLERANCE
+                or abs(have[2] - want[2]) > BALANCE_TOLERANCE):
+            mismatches.append((driver_id, have, want))
+    return mismatches
+
+# Пересобрать сводку по таблице trips; возвращает найденные до пересборки расхождения
+def rebuild_driver_balances(cursor):
+    mismatches = verify_driver_balances(cursor)
+    cursor.execute("DELETE FROM driver_balances")
+    cursor.execute("""
+    INSERT INTO driver_balances (driver_id, unpaid_count, unpaid_amount, partial_amount)
+    SELECT driver_id, COUNT(*), COALESCE(SUM(total_payment - paid_amount), 0), COALESCE(SUM(paid_amount), 0)
+    FROM trips
+    WHERE paid = 0 AND driver_id IS NOT NULL
+    GROUP BY driver_id
+    """)
+    return mismatches
+
+# Пересборка из командной строки: python ledger.py [--check] [путь к БД]
+if __name__ == '__main__':
+    import sqlite3
+    import sys
+    from database import DB_PATH
+
+    args = [arg for arg in sys.argv[1:] if arg != '--check']
+    check_only = '--check' in sys.argv[1:]
+    conn = sqlite3.connect(args[0] if args else DB_PATH)
+    cursor = conn.cursor()
+
+    if check_only:
+        mismatches = verify_driver_balances(cursor)
+    else:
+        mismatches = rebuild_driver_balances(cursor)
+        conn.commit()
+    conn.close()
+
+    for driver_id, have, want in mismatches:
+        print(f"Водитель #{driver_id}: в сводке {have}, по рейсам {want}")
+    print(f"Расхождений: {len(mismatches)}" + ("" if check_only else ", сводка пересобрана"))
+    sys.exit(1 if check_only and mismatches else 0)
@@ -3,7 +3,11 @@ from aiogram import executor
 from aiogram.utils.exceptions import TelegramAPIError
 
 # Импортируем нашего бота из модуля bot
-from bot import dp, bot, init_db
+from bot import dp, bot, role_cache
+from audit import audit_log
+from export_jobs import export_queue
+from report_cache import report_cache
+from database import db, init_db, pool
 
 # Импортируем все обработчики
 import salaries
@@ -20,10 +24,16 @@ logging.basicConfig(
 
 # Обработчик запуска бота
 async def on_startup(dispatcher):
-    # Инициализируем базу данных
+    # Инициализируем базу данных и применяем миграции схемы
     conn = init_db()
     conn.close()
     
+    # Запускаем фоновую запись журнала действий
+    audit_log.start()
+    
+    # Запускаем воркеры фоновых выгрузок
+    export_queue.start()
+    
     # Уведомляем о запуске (в консоль)
     logging.info('Бот запущен!')
 
@@ -34,6 +44,18 @@ async def on_shutdown(dispatcher):
     # Закрываем соединения с базой данных
     await dispatcher.storage.close()
     await dispatcher.storage.wait_closed()
+    logging.info(f'Статистика кэша ролей: {role_cache.metrics()}')
+    logging.info(f'Статистика кэша отчетов: {report_cache.metrics()}')
+    # Отменяем незавершенные выгрузки, пока пул потоков базы данных работает
+    await export_queue.stop()
+    logging.info(f'Статистика выгрузок: {export_queue.metrics()}')
+    # Дописываем журнал действий до остановки пула потоков базы данных
+    await audit_log.stop()
+    logging.info(f'Статистика журнала действий: {audit_log.metrics()}')
+    logging.info(f'Статистика запросов к базе данных: {db.metrics()}')
+    db.shutdown()
+    logging.info(f'Статистика пула соединений: {pool.health()}')
+    pool.close_all()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,204 @@
+from aiogram import types
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from bot import dp, bot, has_access, ACCESS_DENIED_TEXT
+from database import db
+from report_cache import cached_report
+import base64
+import logging
+import re
+
+# Постраничный вывод длинных списков (долги, история рейсов, справочники).
+# Страница выбирается по ключу последней показанной строки (keyset), а не через
+# OFFSET: запрос читает из индекса только PAGE_SIZE + 1 строк, поэтому любая
+# страница списка из 50 000 рейсов стоит столько же, сколько список из 10.
+# Курсор хранится прямо в callback_data кнопок "◀️"/"▶️":
+#   pg:<список>:<фильтр>:<ключ 1>:<ключ 2>:<n|p>
+
+PAGE_SIZE = 10
+PAGE_PREFIX = "pg"
+CALLBACK_DATA_LIMIT = 64  # Лимит Telegram на callback_data, байт
+
+# Зарегистрированные списки по имени (заполняется при создании PagedList)
+PAGED_LISTS = {}
+
+class Page:
+    def __init__(self, rows, arg, has_prev, has_next, first_key, last_key):
+        self.rows = rows
+        self.arg = arg
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.first_key = first_key
+        self.last_key = last_key
+
+    @property
+    def is_first(self):
+        return not self.has_prev
+
+# Описание списка:
+#   columns, tables, where - части запроса; ключ сортировки добавляется сам
+#   key      - два выражения, однозначно задающих порядок, например ('t.created_at', 't.id')
+#   filters  - {фильтр из callback_data: (условие, параметры)}, например периоды истории,
+#              или функция(фильтр) -> (условие, параметры), например рейсы одного водителя
+#   render   - async render(page) -> (текст, [кнопки строк]) для одной страницы
+#   footer   - кнопки под навигацией: [(текст, callback_data)]
+#   cached   - отдавать страницы из кэша отчетов, пока данные не менялись
+class PagedList:
+    def __init__(self, name, columns, tables, render, where='', key=('created_at', 'id'),
+                 filters=None, descending=True, page_size=PAGE_SIZE, footer=(), required_role=2,
+                 cached=False):
+        self.name = name
+        self.columns = columns
+        self.tables = tables
+        self.render = render
+        self.where = where
+        self.key = key
+        self.filters = filters or {}
+        self.descending = descending
+        self.page_size = page_size
+        self.footer = list(footer)
+        self.required_role = required_role
+        self.cached = cached
+        PAGED_LISTS[name] = self
+
+    def _query(self, arg, cursor, backwards):
+        conditions = []
+        params = []
+        if self.where:
+            conditions.append(self.where)
+        if callable(self.filters):
+            condition, filter_params = self.filters(arg)
+            conditions.append(condition)
+            params.extend(filter_params)
+        elif arg in self.filters:
+            condition, filter_params = self.filters[arg]
+            conditions.append(condition)
+            params.extend(filter_params)
+
+        # Назад по списку - тот же индекс в обратную сторону
+        ascending = self.descending == backwards
+        if cursor is not None:
+            conditions.append(f"({self.key[0]}, {self.key[1]}) {'>' if ascending else '<'} (?, ?)")
+            params.extend(cursor)
+
+        order = 'ASC' if ascending else 'DESC'
+        sql = f"SELECT {self.key[0]}, {self.key[1]}, {self.columns} FROM {self.tables}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {self.key[0]} {order}, {self.key[1]} {order} LIMIT ?"
+        params.append(self.page_size + 1)
+        return sql, tuple(params)
+
+    # Страница после cursor (или перед ним при backwards); cursor=None - первая страница
+    async def fetch(self, arg='', cursor=None, backwards=False):
+        sql, params = self._query(arg, cursor, backwards)
+        rows = await db.fetchall(sql, params)
+
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+
+        keys = [tuple(row[:2]) for row in rows]
+        return Page(
+            rows=[row[2:] for row in rows],
+            arg=arg,
+            has_prev=more if backwards else cursor is not None,
+            has_next=True if backwards else more,
+            first_key=keys[0] if keys else None,
+            last_key=keys[-1] if keys else None,
+        )
+
+    def _callback(self, arg, key, direction):
+        data = ":".join([PAGE_PREFIX, self.name, arg, encode_key(key[0]), encode_key(key[1]), direction])
+        # Обрезанный курсор листал бы не с того места - лучше ошибка
+        if len(data.encode()) > CALLBACK_DATA_LIMIT:
+            raise ValueError(f"Ключ страницы списка {self.name} не помещается в callback_data: {key}")
+        return data
+
+    # Текст и клавиатура страницы; None, если список пуст
+    async def render_page(self, arg='', cursor=None, backwards=False):
+        if self.cached:
+            return await cached_report(
+                'page', (self.name, arg, cursor, backwards),
+                lambda: self._render_page(arg, cursor, backwards)
+            )
+        return await self._render_page(arg, cursor, backwards)
+
+    async def _render_page(self, arg, cursor, backwards):
+        page = await self.fetch(arg, cursor, backwards)
+        if not page.rows:
+            return None, None
+
+        text, buttons = await self.render(page)
+
+        keyboard = InlineKeyboardMarkup(row_width=2)
+        for button in buttons:
+            keyboard.row(button)
+
+        navigation = []
+        if page.has_prev:
+            navigation.append(InlineKeyboardButton("◀️", callback_data=self._callback(arg, page.first_key, 'p')))
+        if page.has_next:
+            navigation.append(InlineKeyboardButton("▶️", callback_data=self._callback(arg, page.last_key, 'n')))
+        if navigation:
+            keyboard.row(*navigation)
+
+        for label, callback_data in self.footer:
+            keyboard.row(InlineKeyboardButton(label, callback_data=callback_data))
+        return text, keyboard
+
+# Значение ключа в callback_data (лимит Telegram - 64 байта). Даты в формате
+# CURRENT_TIMESTAMP ('2024-05-01 12:30:00') сжимаются до цифр '20240501123000',
+# прочие строки (имена, номера) - 's' + base64, чтобы ключ восстанавливался точно
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+
+def encode_key(value):
+    if isinstance(value, str):
+        if _TIMESTAMP.fullmatch(value):
+            return ''.join(ch for ch in value if ch.isdigit())
+        return 's' + base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+    return repr(value)
+
+def decode_key(text):
+    if text.startswith('s'):
+        encoded = text[1:]
+        return base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode()
+    if len(text) == 14 and text.isdigit():
+        return f"{text[0:4]}-{text[4:6]}-{text[6:8]} {text[8:10]}:{text[10:12]}:{text[12:14]}"
+    if text.lstrip('-').isdigit():
+        return int(text)
+    return float(text)
+
+# Обработчик кнопок "◀️"/"▶️" всех постраничных списков
+@dp.callback_query_handler(lambda c: c.data.startswith(PAGE_PREFIX + ":"))
+async def page_navigation(callback_query: types.CallbackQuery, role):
+    try:
+        _, name, arg, first, second, direction = callback_query.data.split(":")
+        paged = PAGED_LISTS[name]
+        cursor = (decode_key(first), decode_key(second))
+    except (ValueError, KeyError):
+        await bot.answer_callback_query(callback_query.id, text="Список устарел, откройте его заново.")
+        return
+
+    if not has_access(role, paged.required_role):
+        await bot.answer_callback_query(callback_query.id, text=ACCESS_DENIED_TEXT, show_alert=True)
+        return
+
+    try:
+        text, keyboard = await paged.render_page(arg, cursor, backwards=(direction == 'p'))
+    except Exception as e:
+        logging.error(f"Ошибка при получении страницы списка {name}: {str(e)}")
+        await bot.answer_callback_query(callback_query.id, text=f"❌ Ошибка: {str(e)}")
+        return
+
+    if text is None:
+        await bot.answer_callback_query(callback_query.id, text="Больше записей нет.")
+        return
+
+    await bot.answer_callback_query(callback_query.id)
+    await bot.edit_message_text(
+        chat_id=callback_query.message.chat.id,
+        message_id=callback_query.message.message_id,
+        text=text,
+        reply_markup=keyboard
+    )
@@ -0,0 +1,315 @@
+# Журнал выплат (таблица payments): каждая выплата по рейсу - отдельная строка,
+# которая никогда не меняется и не удаляется. trips.paid_amount - сумма выплат
+# по рейсу, она обновляется в той же транзакции, что и запись в журнал.
+# Отчеты "сколько выплачено за неделю" и выплаты водителя читают журнал
+# по индексам (paid_at) и (driver_id, paid_at), а не таблицу logs.
+#   trip_id   - рейс
+#   driver_id - водитель рейса на момент выплаты
+#   amount    - выплаченная сумма
+#   paid_at   - время выплаты (UTC, как и все даты в базе)
+#   user_id   - кто провел выплату (NULL - перенесено из старых данных)
+#   batch_id  - пакет выплат (payout_batches), если рейсы оплачены разом
+#
+# Пакет выплат - одна запись на "оплатить все рейсы водителя" (или рейсы
+# за период) с итогами: сколько рейсов, сколько выплачено, за какие даты.
+
+from ledger import apply_trip_change, remove_from_balance, trip_snapshot
+
+# Допустимое расхождение сумм при проверке (накопление ошибок округления)
+PAYMENTS_TOLERANCE = 0.01
+
+def create_payments(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        trip_id INTEGER NOT NULL,
+        driver_id INTEGER,
+        amount REAL NOT NULL,
+        paid_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        user_id INTEGER,
+        batch_id INTEGER,
+        FOREIGN KEY (trip_id) REFERENCES trips (id)
+    )
+    ''')
+    # Выплаты за период (покрывающий)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_paid_at ON payments (paid_at, amount, driver_id)"
+    )
+    # Выплаты водителю за период (покрывающий)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_driver ON payments (driver_id, paid_at, amount)"
+    )
+    # Выплаты по рейсу (сверка с trips.paid_amount)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_trip ON payments (trip_id)")
+
+    # Уже выплаченное по старым рейсам переносится одной строкой на рейс.
+    # Когда платили на самом деле, неизвестно - берется дата рейса.
+    cursor.execute("UPDATE trips SET paid_amount = total_payment WHERE paid = 1")
+    cursor.execute("""
+    INSERT INTO payments (trip_id, driver_id, amount, paid_at)
+    SELECT id, driver_id, paid_amount, created_at
+    FROM trips
+    WHERE paid_amount > 0
+      AND NOT EXISTS (SELECT 1 FROM payments p WHERE p.trip_id = trips.id)
+    """)
+
+def _insert_payment(cursor, trip_id, driver_id, amount, user_id, batch_id):
+    cursor.execute(
+        """
+        INSERT INTO payments (trip_id, driver_id, amount, user_id, batch_id)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (trip_id, driver_id, amount, user_id, batch_id)
+    )
+
+# Выплата amount по рейсу: запись в журнал, paid_amount и сводка долгов.
+# Рейс считается оплаченным, когда выплачено не меньше total_payment.
+# Возвращает trip_snapshot рейса после выплаты (None - рейса нет)
+def record_payment(cursor, trip_id, amount, user_id, batch_id=None):
+    before = trip_snapshot(cursor, trip_id)
+    if before is None:
+        return None
+
+    driver_id = before[0]
+    _insert_payment(cursor, trip_id, driver_id, amount, user_id, batch_id)
+    cursor.execute(
+        """
+        UPDATE trips
+        SET paid_amount = paid_amount + ?,
+            paid = CASE WHEN paid_amount + ? >= total_payment THEN 1 ELSE paid END
+        WHERE id = ?
+        """,
+        (amount, amount, trip_id)
+    )
+    after = trip_snapshot(cursor, trip_id)
+    apply_trip_change(cursor, before, after)
+    return after
+
+# Оплатить остаток по рейсу полностью; возвращает выплаченную сумму
+# (0 - рейс уже оплачен, None - рейса нет)
+def settle_trip(cursor, trip_id, user_id, batch_id=None):
+    before = trip_snapshot(cursor, trip_id)
+    if before is None:
+        return None
+
+    driver_id, paid, total_payment, paid_amount = before
+    if paid:
+        return 0
+    remaining = max((total_payment or 0) - (paid_amount or 0), 0)
+    if remaining > 0:
+        _insert_payment(cursor, trip_id, driver_id, remaining, user_id, batch_id)
+    cursor.execute(
+        "UPDATE trips SET paid = 1, paid_amount = MAX(total_payment, paid_amount) WHERE id = ?",
+        (trip_id,)
+    )
+    apply_trip_change(cursor, before, trip_snapshot(cursor, trip_id))
+    return remaining
+
+def create_payout_batches(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS payout_batches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        driver_id INTEGER NOT NULL,
+        trips_count INTEGER NOT NULL,
+        amount REAL NOT NULL,  -- Выплачено этим пакетом
+        partial_amount REAL NOT NULL,  -- Выплачено по этим рейсам раньше
+        first_trip_at TIMESTAMP,
+        last_trip_at TIMESTAMP,
+        period_start TEXT,  -- Выбранный период (YYYY-MM-DD), NULL - все рейсы
+        period_end TEXT,
+        user_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (driver_id) REFERENCES drivers (id)
+    )
+    ''')
+    # Пакеты водителя по дате
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payout_batches_driver ON payout_batches (driver_id, created_at)"
+    )
+
+# Неоплаченные рейсы водителя, при заданных днях - только за [start_day, end_day]
+def _open_trips_filter(driver_id, start_day, end_day):
+    condition = "driver_id = ? AND paid = 0"
+    params = [driver_id]
+    if start_day is not None:
+        condition += " AND created_at >= ?"
+        params.append(start_day)
+    if end_day is not None:
+        condition += " AND created_at < date(?, '+1 day')"
+        params.append(end_day)
+    return condition, params
+
+# Оплатить разом все неоплаченные рейсы водителя (или только за дни
+# [start_day, end_day], строки 'YYYY-MM-DD'): остатки пишутся в журнал
+# одним INSERT ... SELECT, рейсы закрываются одним UPDATE, итоги - в пакет.
+# Возвращает квитанцию (id пакета, рейсов, выплачено, выплачено раньше,
+# первый рейс, последний рейс) или None, если оплачивать нечего
+def pay_driver_batch(cursor, driver_id, user_id, start_day=None, end_day=None):
+    condition, params = _open_trips_filter(driver_id, start_day, end_day)
+
+    # Итоги - по частичному индексу неоплаченных рейсов водителя
+    cursor.execute(f"""
+    SELECT COUNT(*), COALESCE(SUM(MAX(total_payment - paid_amount, 0)), 0),
+           COALESCE(SUM(total_payment - paid_amount), 0), COALESCE(SUM(paid_amount), 0),
+           MIN(created_at), MAX(created_at)
+    FROM trips
+    WHERE {condition}
+    """, params)
+    count, amount, balance, partial, first_trip_at, last_trip_at = cursor.fetchone()
+    if not count:
+        return None
+
+    cursor.execute(
+        """
+        INSERT INTO payout_batches
+        (driver_id, trips_count, amount, partial_amount, first_trip_at, last_trip_at,
+         period_start, period_end, user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (driver_id, count, amount, partial, first_trip_at, last_trip_at, start_day, end_day, user_id)
+    )
+    batch_id = cursor.lastrowid
+
+    cursor.execute(f"""
+    INSERT INTO payments (trip_id, driver_id, amount, user_id, batch_id)
+    SELECT id, driver_id, total_payment - paid_amount, ?, ?
+    FROM trips
+    WHERE {condition} AND total_payment > paid_amount
+    """, [user_id, batch_id] + params)
+    cursor.execute(
+        f"UPDATE trips SET paid = 1, paid_amount = MAX(total_payment, paid_amount) WHERE {condition}",
+        params
+    )
+    remove_from_balance(cursor, driver_id, count, balance, partial)
+
+    return batch_id, count, amount, partial, first_trip_at, last_trip_at
+
+# Сумма водителю распределяется по его неоплаченным рейсам от старых к новым
+# (нарастающий итог остатков по индексу idx_trips_unpaid_driver): рейсы
+# закрываются целиком, последний оплачивается частично
+_ALLOCATION = """
+WITH open_trips AS (
+    SELECT id, created_at, paid_amount, total_payment - paid_amount AS remaining,
+           SUM(total_payment - paid_amount) OVER (ORDER BY created_at, id) AS running
+    FROM trips
+    WHERE driver_id = :driver_id AND paid = 0 AND total_payment > paid_amount
+),
+allocation AS (
+    SELECT id, created_at, paid_amount, remaining,
+           MIN(remaining, :amount - (running - remaining)) AS amount
+    FROM open_trips
+    WHERE running - remaining < :amount
+)
+"""
+
+def create_payment_allocation(cursor):
+    # Выплаты пакета (квитанция и распределение суммы по рейсам)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_batch ON payments (batch_id, trip_id, amount) "
+        "WHERE batch_id IS NOT NULL"
+    )
+    # Сумма, которую водителю выплатили одним платежом (NULL - оплата рейсов целиком)
+    cursor.execute("PRAGMA table_info(payout_batches)")
+    if 'requested_amount' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE payout_batches ADD COLUMN requested_amount REAL")
+
+# Выплатить водителю сумму amount одним пакетом: журнал и рейсы обновляются
+# тремя запросами по распределению _ALLOCATION. Возвращает квитанцию
+# (id пакета, рейсов, выплачено, выплачено раньше, первый рейс, последний рейс,
+# закрыто рейсов, не распределено) или None, если у водителя нет долгов
+def allocate_driver_payment(cursor, driver_id, amount, user_id):
+    params = {'driver_id': driver_id, 'amount': amount}
+    cursor.execute(_ALLOCATION + """
+    SELECT COUNT(*), COALESCE(SUM(amount), 0), COALESCE(SUM(paid_amount), 0),
+           MIN(created_at), MAX(created_at),
+           COALESCE(SUM(amount >= remaining), 0),
+           COALESCE(SUM(CASE WHEN amount >= remaining THEN paid_amount ELSE 0 END), 0),
+           COALESCE(SUM(CASE WHEN amount < remaining THEN amount ELSE 0 END), 0)
+    FROM allocation
+    """, params)
+    (count, allocated, partial, first_trip_at, last_trip_at,
+     closed, closed_partial, open_amount) = cursor.fetchone()
+    if not count:
+        return None
+
+    cursor.execute(
+        """
+        INSERT INTO payout_batches
+        (driver_id, trips_count, amount, partial_amount, first_trip_at, last_trip_at,
+         requested_amount, user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (driver_id, count, allocated, partial, first_trip_at, last_trip_at, amount, user_id)
+    )
+    batch_id = cursor.lastrowid
+
+    cursor.execute(_ALLOCATION + """
+    INSERT INTO payments (trip_id, driver_id, amount, user_id, batch_id)
+    SELECT id, :driver_id, amount, :user_id, :batch_id FROM allocation
+    """, dict(params, user_id=user_id, batch_id=batch_id))
+
+    # Рейс закрыт, если на него пришел весь остаток
+    paid_now = "(SELECT amount FROM payments WHERE batch_id = :batch_id AND trip_id = trips.id)"
+    cursor.execute(f"""
+    UPDATE trips
+    SET paid = CASE WHEN {paid_now} >= total_payment - paid_amount THEN 1 ELSE 0 END,
+        paid_amount = CASE WHEN {paid_now} >= total_payment - paid_amount
+                           THEN total_payment ELSE paid_amount + {paid_now} END
+    WHERE id IN (SELECT trip_id FROM payments WHERE batch_id = :batch_id)
+    """, {'batch_id': batch_id})
+
+    # Закрытые рейсы уходят из сводки, у частично оплаченного растет partial_amount
+    remove_from_balance(cursor, driver_id, closed, allocated, closed_partial - open_amount)
+
+    return (batch_id, count, allocated, partial, first_trip_at, last_trip_at,
+            closed, amount - allocated)
+
+# Выплачено за период [start, end): (выплат, сумма)
+PAYOUTS_FOR_RANGE = """
+SELECT COUNT(*), COALESCE(SUM(amount), 0)
+FROM payments
+WHERE paid_at >= ? AND paid_at < ?
+"""
+
+# Выплаты по водителям за период [start, end): [(имя, выплат, сумма)]
+DRIVER_PAYOUTS_FOR_RANGE = """
+SELECT d.name, p.payments, p.amount
+FROM (
+    SELECT driver_id, COUNT(*) AS payments, SUM(amount) AS amount
+    FROM payments
+    WHERE paid_at >= ? AND paid_at < ?
+    GROUP BY driver_id
+) p
+JOIN drivers d ON d.id = p.driver_id
+ORDER BY p.amount DESC
+"""
+
+# Расхождения trips.paid_amount с журналом: [(trip_id, paid_amount, сумма выплат)]
+def verify_payments(cursor):
+    cursor.execute("""
+    SELECT t.id, COALESCE(t.paid_amount, 0), COALESCE(p.amount, 0)
+    FROM trips t
+    LEFT JOIN (SELECT trip_id, SUM(amount) AS amount FROM payments GROUP BY trip_id) p
+        ON p.trip_id = t.id
+    """)
+    return [
+        (trip_id, paid_amount, amount)
+        for trip_id, paid_amount, amount in cursor.fetchall()
+        if abs(paid_amount - amount) > PAYMENTS_TOLERANCE
+    ]
+
+# Проверка из командной строки: python payments.py [путь к БД].
+# Журнал не пересобирается - он первичен, расхождения разбираются вручную
+if __name__ == '__main__':
+    import sqlite3
+    import sys
+    from database import DB_PATH
+
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    mismatches = verify_payments(conn.cursor())
+    conn.close()
+
+    for trip_id, paid_amount, amount in mismatches[:50]:
+        print(f"Рейс #{trip_id}: paid_amount {paid_amount}, по журналу {amount}")
+    print(f"Расхождений: {len(mismatches)}")
+    sys.exit(1 if mismatches else 0)
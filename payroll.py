@@ -0,0 +1,96 @@
+# Расчет оплаты рейса по ставкам водителя. Модуль без зависимостей от бота:
+# им пользуются и обработчики, и импорт рейсов из 1С.
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Функция расчета стоимости рейса
+def calculate_trip_payment(driver_data, distance, side_loading, roof_loading, reg_downtime=0, forced_downtime=0):
+    # Расчет за километры
+    km_payment = distance * driver_data['km_rate']
+    
+    # Расчет за погрузку/разгрузку
+    side_loading_payment = side_loading * driver_data['side_loading_rate']
+    roof_loading_payment = roof_loading * driver_data['roof_loading_rate']
+    
+    # Расчет за простои
+    regular_downtime_payment = reg_downtime * driver_data['regular_downtime_rate']
+    forced_downtime_payment = forced_downtime * driver_data['forced_downtime_rate']
+    
+    # Общая сумма
+    total = km_payment + side_loading_payment + roof_loading_payment + regular_downtime_payment + forced_downtime_payment
+    
+    return {
+        'km_payment': km_payment,
+        'side_loading_payment': side_loading_payment,
+        'roof_loading_payment': roof_loading_payment,
+        'regular_downtime_payment': regular_downtime_payment,
+        'forced_downtime_payment': forced_downtime_payment,
+        'total': total
+    }
+
+# Ставки водителя - те же ключи, что и в driver_data для calculate_trip_payment
+RATE_FIELDS = ['km_rate', 'side_loading_rate', 'roof_loading_rate',
+               'regular_downtime_rate', 'forced_downtime_rate']
+
+PAYMENT_FIELDS = ['km_payment', 'side_loading_payment', 'roof_loading_payment',
+                  'regular_downtime_payment', 'forced_downtime_payment', 'total']
+
+# Пакетный расчет: те же формулы сразу для массивов рейсов (пересчет,
+# импорт, "что если"). С NumPy calculate_trip_payment получает массивы
+# целиком и считает поэлементно в float64, поэтому результат совпадает
+# с расчетом по одному рейсу до бита. Без NumPy - тот же расчет в цикле.
+#   rates    - {ставка: массив ставок по рейсам}, см. trip_rates
+#   остальное - массивы по рейсам одинаковой длины
+# Возвращает словарь с теми же ключами, что calculate_trip_payment, но с массивами
+def calculate_trip_payments(rates, distance, side_loading, roof_loading,
+                            reg_downtime=None, forced_downtime=None):
+    count = len(distance)
+    if reg_downtime is None:
+        reg_downtime = [0] * count
+    if forced_downtime is None:
+        forced_downtime = [0] * count
+
+    if np is not None:
+        return calculate_trip_payment(
+            {field: np.asarray(rates[field], dtype=np.float64) for field in RATE_FIELDS},
+            np.asarray(distance, dtype=np.float64),
+            np.asarray(side_loading),
+            np.asarray(roof_loading),
+            np.asarray(reg_downtime),
+            np.asarray(forced_downtime),
+        )
+
+    results = [
+        calculate_trip_payment(
+            {field: rates[field][i] for field in RATE_FIELDS},
+            distance[i], side_loading[i], roof_loading[i], reg_downtime[i], forced_downtime[i]
+        )
+        for i in range(count)
+    ]
+    return {key: [result[key] for result in results] for key in PAYMENT_FIELDS}
+
+# Ставки по рейсам из ставок водителей: driver_rates - {driver_id: driver_data},
+# driver_ids - водитель каждого рейса
+def trip_rates(driver_rates, driver_ids):
+    if np is not None:
+        ids = sorted(driver_rates)
+        ids_arr = np.asarray(ids)
+        driver_ids = np.asarray(driver_ids)
+        positions = np.searchsorted(ids_arr, driver_ids)
+        # searchsorted возвращает место вставки и для отсутствующих водителей -
+        # проверяем совпадение, чтобы не взять ставки соседнего (как KeyError ниже)
+        if ids:
+            found = ids_arr[np.minimum(positions, len(ids) - 1)] == driver_ids
+        else:
+            found = np.zeros(len(driver_ids), dtype=bool)
+        if not found.all():
+            raise KeyError(driver_ids[~found][0].item())
+        return {
+            field: np.asarray([driver_rates[driver_id][field] for driver_id in ids],
+                              dtype=np.float64)[positions]
+            for field in RATE_FIELDS
+        }
+    return {field: [driver_rates[driver_id][field] for driver_id in driver_ids] for field in RATE_FIELDS}
@@ -0,0 +1,117 @@
+from aiogram import types
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from bot import dp, bot, has_access, ACCESS_DENIED_TEXT
+from database import db
+from directory import directory
+from aiogram.utils.exceptions import MessageNotModified
+import logging
+
+# Клавиатуры выбора водителя или автопоезда из справочника в памяти
+# (directory.py). Небольшой справочник показывается списком, как раньше;
+# большой - сначала кнопками букв, затем записями выбранной буквы по
+# PICKER_PAGE_SIZE на страницу, поэтому клавиатура укладывается в лимиты
+# Telegram при любом размере парка. Состояние - прямо в callback_data:
+#   pk:<клавиатура>:<аргумент>:<буква>:<страница>
+# Выбор записи отправляет callback_data из шаблона select, как и старые
+# клавиатуры, поэтому обработчики выбора не меняются.
+
+PICKER_PREFIX = "pk"
+PICKER_PAGE_SIZE = 20
+LETTERS_PER_ROW = 6
+
+# Зарегистрированные клавиатуры по имени (заполняется при создании Picker)
+PICKERS = {}
+
+def _directory_snapshot(conn):
+    return directory.snapshot(conn.cursor())
+
+async def get_directory():
+    return await db.run(_directory_snapshot)
+
+# Описание клавиатуры выбора:
+#   kind   - справочник: 'drivers' или 'vehicles'
+#   select - callback_data записи, шаблон с {id} и {arg}, например "driver_{id}"
+#   footer - кнопки под списком: [(текст, шаблон callback_data с {arg})]
+class Picker:
+    def __init__(self, name, kind, select, footer=(), page_size=PICKER_PAGE_SIZE, required_role=1):
+        self.name = name
+        self.kind = kind
+        self.select = select
+        self.footer = list(footer)
+        self.page_size = page_size
+        self.required_role = required_role
+        PICKERS[name] = self
+
+    def _callback(self, arg, letter, page):
+        return ":".join([PICKER_PREFIX, self.name, str(arg), letter, str(page)])
+
+    # Клавиатура из снимка справочника: letter=None - весь список или буквы
+    def keyboard(self, snapshot, arg='', letter=None, page=0):
+        keyboard = InlineKeyboardMarkup(row_width=1)
+        items = snapshot.section(self.kind, letter)
+
+        if letter is None and len(items) > self.page_size:
+            buttons = [
+                InlineKeyboardButton(f"{bucket} ({end - start})", callback_data=self._callback(arg, bucket, 0))
+                for bucket, (start, end) in snapshot.buckets[self.kind].items()
+            ]
+            for start in range(0, len(buttons), LETTERS_PER_ROW):
+                keyboard.row(*buttons[start:start + LETTERS_PER_ROW])
+        else:
+            pages = max((len(items) - 1) // self.page_size + 1, 1)
+            page = min(max(page, 0), pages - 1)
+            for item_id, label in items[page * self.page_size:(page + 1) * self.page_size]:
+                keyboard.row(InlineKeyboardButton(
+                    label, callback_data=self.select.format(id=item_id, arg=arg)
+                ))
+
+            if letter is not None:
+                navigation = []
+                if page > 0:
+                    navigation.append(InlineKeyboardButton("◀️", callback_data=self._callback(arg, letter, page - 1)))
+                if page < pages - 1:
+                    navigation.append(InlineKeyboardButton("▶️", callback_data=self._callback(arg, letter, page + 1)))
+                if navigation:
+                    keyboard.row(*navigation)
+                keyboard.row(InlineKeyboardButton("🔤 Все буквы", callback_data=self._callback(arg, '', 0)))
+
+        footer = [
+            InlineKeyboardButton(label, callback_data=callback_data.format(arg=arg))
+            for label, callback_data in self.footer
+        ]
+        if footer:
+            keyboard.row(*footer)
+        return keyboard
+
+    # Первая клавиатура выбора и число записей в справочнике
+    async def markup(self, arg=''):
+        snapshot = await get_directory()
+        return self.keyboard(snapshot, arg), snapshot.count(self.kind)
+
+# Обработчик кнопок букв и страниц всех клавиатур выбора
+@dp.callback_query_handler(lambda c: c.data.startswith(PICKER_PREFIX + ":"), state="*")
+async def picker_navigation(callback_query: types.CallbackQuery, role):
+    try:
+        _, name, arg, letter, page = callback_query.data.split(":")
+        picker = PICKERS[name]
+        page = int(page)
+    except (ValueError, KeyError):
+        await bot.answer_callback_query(callback_query.id, text="Список устарел, откройте его заново.")
+        return
+
+    if not has_access(role, picker.required_role):
+        await bot.answer_callback_query(callback_query.id, text=ACCESS_DENIED_TEXT, show_alert=True)
+        return
+
+    snapshot = await get_directory()
+    await bot.answer_callback_query(callback_query.id)
+    try:
+        await bot.edit_message_reply_markup(
+            chat_id=callback_query.message.chat.id,
+            message_id=callback_query.message.message_id,
+            reply_markup=picker.keyboard(snapshot, arg, letter or None, page)
+        )
+    except MessageNotModified:
+        pass
+    except Exception as e:
+        logging.error(f"Ошибка при переключении клавиатуры {name}: {str(e)}")
@@ -0,0 +1,219 @@
+# История ставок водителей (таблица driver_rates): каждая строка - ставки,
+# действовавшие в дни [valid_from, valid_to) (строки 'YYYY-MM-DD', по UTC,
+# как и даты рейсов); у действующей строки valid_to = NULL. Оплата рейса
+# считается по ставкам на день рейса, поэтому правка старого рейса или простоя
+# не пересчитывает его по новым ставкам. В drivers остаются копии действующих
+# ставок (карточка водителя, ввод нового рейса).
+#
+# Для расчетов история держится в памяти: по водителю - отсортированные начала
+# периодов, ставки на день находятся bisect за O(log n). Индекс перечитывается,
+# только когда меняется driver_rates_version (ее увеличивают триггеры на
+# driver_rates), поэтому проверка актуальности - один запрос по первичному ключу.
+
+import threading
+from bisect import bisect_right
+from datetime import datetime
+
+from payroll import RATE_FIELDS
+
+# Начало первого периода: ставки, с которыми водитель заведен, действуют "всегда"
+RATES_EPOCH = '0001-01-01'
+
+_RATE_COLUMNS = ", ".join(RATE_FIELDS)
+
+def create_driver_rates(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS driver_rates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        driver_id INTEGER NOT NULL,
+        valid_from TEXT NOT NULL,  -- YYYY-MM-DD, включительно
+        valid_to TEXT,  -- YYYY-MM-DD, не включительно; NULL - действует сейчас
+        km_rate REAL NOT NULL,
+        side_loading_rate REAL NOT NULL,
+        roof_loading_rate REAL NOT NULL,
+        regular_downtime_rate REAL NOT NULL,
+        forced_downtime_rate REAL NOT NULL,
+        FOREIGN KEY (driver_id) REFERENCES drivers (id)
+    )
+    ''')
+    # Ставки водителя на день: последний период с valid_from <= дня
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_driver_rates_driver_from ON driver_rates (driver_id, valid_from)"
+    )
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS driver_rates_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO driver_rates_version (id, version) VALUES (1, 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_driver_rates_{event.lower()}_version
+        AFTER {event} ON driver_rates
+        BEGIN
+            UPDATE driver_rates_version SET version = version + 1 WHERE id = 1;
+        END
+        """)
+
+    # Новый водитель получает один бессрочный период со своими ставками,
+    # удаленный - теряет историю (в том числе при вставке из dataset.py)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_drivers_insert_rates
+    AFTER INSERT ON drivers
+    BEGIN
+        INSERT INTO driver_rates (driver_id, valid_from, {_RATE_COLUMNS})
+        VALUES (NEW.id, '{RATES_EPOCH}', {", ".join(f"NEW.{field}" for field in RATE_FIELDS)});
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_drivers_delete_rates
+    AFTER DELETE ON drivers
+    BEGIN
+        DELETE FROM driver_rates WHERE driver_id = OLD.id;
+    END
+    """)
+
+    # Уже заведенные водители: их текущие ставки действуют с начала
+    cursor.execute(f"""
+    INSERT INTO driver_rates (driver_id, valid_from, {_RATE_COLUMNS})
+    SELECT id, ?, {_RATE_COLUMNS}
+    FROM drivers
+    WHERE id NOT IN (SELECT driver_id FROM driver_rates)
+    """, (RATES_EPOCH,))
+
+# День ('YYYY-MM-DD') из даты рейса ('YYYY-MM-DD HH:MM:SS'); None - сегодня по UTC
+def rate_day(timestamp=None):
+    if timestamp is None:
+        return datetime.utcnow().strftime('%Y-%m-%d')
+    return str(timestamp)[:10]
+
+# Установить ставку field = value с дня from_day (через db.transaction).
+# Период, в который попадает from_day, делится на два. Новая ставка действует
+# до следующего изменения этой же ставки: более поздние периоды с другим
+# значением field не трогаются. Возвращает день, до которого действует
+# новая ставка, или None - если она действует и сейчас (тогда она же
+# записывается в drivers). Будущие даты не поддерживаются
+def set_driver_rate(cursor, driver_id, field, value, from_day):
+    if field not in RATE_FIELDS:
+        raise ValueError(f"Неизвестная ставка: {field}")
+
+    cursor.execute("""
+    SELECT id, valid_from
+    FROM driver_rates
+    WHERE driver_id = ? AND valid_from <= ?
+    ORDER BY valid_from DESC
+    LIMIT 1
+    """, (driver_id, from_day))
+    period = cursor.fetchone()
+    if period is not None and period[1] < from_day:
+        cursor.execute(f"""
+        INSERT INTO driver_rates (driver_id, valid_from, valid_to, {_RATE_COLUMNS})
+        SELECT driver_id, ?, valid_to, {_RATE_COLUMNS}
+        FROM driver_rates
+        WHERE id = ?
+        """, (from_day, period[0]))
+        cursor.execute("UPDATE driver_rates SET valid_to = ? WHERE id = ?", (from_day, period[0]))
+
+    # Периоды с from_day, пока ставка в них та же, что и в первом из них
+    cursor.execute(f"""
+    SELECT id, valid_to, {field}
+    FROM driver_rates
+    WHERE driver_id = ? AND valid_from >= ?
+    ORDER BY valid_from
+    """, (driver_id, from_day))
+    periods = cursor.fetchall()
+    changed = []
+    for period_id, valid_to, current in periods:
+        if current != periods[0][2]:
+            break
+        changed.append((period_id, valid_to))
+
+    cursor.executemany(
+        f"UPDATE driver_rates SET {field} = ? WHERE id = ?",
+        [(value, period_id) for period_id, _ in changed]
+    )
+    until = changed[-1][1] if changed else None
+    if until is None:
+        cursor.execute(f"UPDATE drivers SET {field} = ? WHERE id = ?", (value, driver_id))
+    return until
+
+# Периоды ставок водителя: [(действует с, действует до, {ставка: значение})]
+def driver_rate_history(cursor, driver_id):
+    cursor.execute(f"""
+    SELECT valid_from, valid_to, {_RATE_COLUMNS}
+    FROM driver_rates
+    WHERE driver_id = ?
+    ORDER BY valid_from
+    """, (driver_id,))
+    return [(row[0], row[1], dict(zip(RATE_FIELDS, row[2:]))) for row in cursor.fetchall()]
+
+# Снимок истории ставок всех водителей
+class RateSnapshot:
+    def __init__(self, periods):
+        # driver_id -> (начала периодов по возрастанию, ставки периодов)
+        self._starts = {}
+        self._rates = {}
+        for driver_id, valid_from, rates in periods:
+            self._starts.setdefault(driver_id, []).append(valid_from)
+            self._rates.setdefault(driver_id, []).append(rates)
+
+    # Ставки водителя на день (как driver_data для calculate_trip_payment);
+    # None - водителя нет или день раньше первого периода
+    def rates_on(self, driver_id, day):
+        starts = self._starts.get(driver_id)
+        if not starts:
+            return None
+        position = bisect_right(starts, day) - 1
+        if position < 0:
+            return None
+        return self._rates[driver_id][position]
+
+class RateIndex:
+    def __init__(self):
+        self._version = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'loads': 0,
+            'hits': 0,
+        }
+
+    def _load(self, cursor):
+        # Периоды идут подряд без пропусков, поэтому valid_to для поиска не нужен
+        cursor.execute(f"SELECT driver_id, valid_from, {_RATE_COLUMNS} FROM driver_rates ORDER BY driver_id, valid_from")
+        return RateSnapshot(
+            (row[0], row[1], dict(zip(RATE_FIELDS, row[2:]))) for row in cursor.fetchall()
+        )
+
+    # Актуальный снимок для курсора: версия читается в той же транзакции,
+    # что и последующие записи, поэтому снимок не отстает от ее данных
+    def snapshot(self, cursor):
+        cursor.execute("SELECT version FROM driver_rates_version WHERE id = 1")
+        version = cursor.fetchone()[0]
+        with self._lock:
+            if self._snapshot is not None and self._version == version:
+                self.stats['hits'] += 1
+                return self._snapshot
+        snapshot = self._load(cursor)
+        # В транзакции с записями снимок может содержать еще не сохраненные
+        # ставки - такой снимок не кэшируется (транзакцию могут откатить)
+        if cursor.connection.in_transaction:
+            return snapshot
+        with self._lock:
+            self._version = version
+            self._snapshot = snapshot
+            self.stats['loads'] += 1
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._snapshot = None
+
+rate_index = RateIndex()
+
+# Ставки водителя на дату рейса (timestamp из trips.created_at; None - сегодня)
+def driver_rates_on(cursor, driver_id, timestamp=None):
+    return rate_index.snapshot(cursor).rates_on(driver_id, rate_day(timestamp))
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+from database import db
+
+# Кэш готовых отчетов в памяти. Ключ - тип отчета и его параметры, каждая
+# запись помечена версией данных (таблица data_version, ее увеличивают
+# триггеры на trips, downtimes, drivers и vehicles). Пока между просмотрами
+# не было записей, отчет отдается из памяти; после любой записи версия
+# меняется и отчет строится заново. TTL нужен отчетам за скользящий период
+# ("последние 30 дней"), которые устаревают и без записей.
+
+REPORT_CACHE_SIZE = 256  # Максимум отчетов в кэше; самые старые вытесняются
+REPORT_CACHE_TTL = 300  # Сколько секунд отчет живет даже без изменений данных
+
+class ReportCache:
+    def __init__(self, max_entries=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (версия данных, истекает, значение)
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'evictions': 0,
+        }
+
+    # (True, значение) - отчет построен по этой же версии данных
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return False, None
+            entry_version, expires, value = entry
+            if entry_version != version or expires < time.monotonic():
+                del self._entries[key]
+                self.stats['stale'] += 1
+                self.stats['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return True, value
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+            **self.stats,
+        }
+
+report_cache = ReportCache()
+
+async def get_data_version():
+    return (await db.fetchone("SELECT version FROM data_version WHERE id = 1"))[0]
+
+# Отчет из кэша или build() с сохранением в кэш. Версия читается до построения:
+# если данные изменятся во время build(), следующий просмотр построит отчет заново
+async def cached_report(kind, params, build):
+    key = (kind,) + tuple(params)
+    version = await get_data_version()
+
+    found, value = report_cache.get(key, version)
+    if found:
+        return value
+
+    value = await build()
+    report_cache.put(key, version, value)
+    return value
@@ -0,0 +1,198 @@
+# Дневная статистика по водителям (таблица daily_driver_stats): одна строка
+# на водителя и день рейса. Статистика за любой период (неделя, месяц, квартал,
+# свои даты) суммирует несколько сотен строк вместо всех рейсов за период.
+#   trips_count    - рейсов
+#   distance       - километров
+#   side_loadings  - погрузок/разгрузок бокового тента
+#   roof_loadings  - погрузок/разгрузок через крышу
+#   downtime_hours - часов простоя
+#   accrued        - начислено (total_payment рейсов)
+#   paid_amount    - выплачено (полностью оплаченные рейсы + частичные оплаты)
+# День - date(created_at) рейса, как и все даты в базе - по UTC.
+#
+# Таблица поддерживается триггерами на trips и downtimes в тех же транзакциях,
+# что и записи (в том числе массовые UPDATE при оплате всех рейсов водителя).
+# Пересобрать ее по рейсам: python rollup.py [--check] [путь к БД]
+
+# Допустимое расхождение сумм при проверке (накопление ошибок округления)
+ROLLUP_TOLERANCE = 0.01
+
+STAT_COLUMNS = ['trips_count', 'distance', 'side_loadings', 'roof_loadings',
+                'downtime_hours', 'accrued', 'paid_amount']
+
+# Вклад рейса r (NEW или OLD в триггере) со знаком sign: значения для VALUES
+def _trip_values(r, sign):
+    return (
+        f"{r}.driver_id, date({r}.created_at), {sign} 1, {sign} {r}.distance, "
+        f"{sign} COALESCE({r}.side_loading_count, 0), {sign} COALESCE({r}.roof_loading_count, 0), "
+        f"{sign} (SELECT COALESCE(SUM(hours), 0) FROM downtimes WHERE trip_id = {r}.id), "
+        f"{sign} {r}.total_payment, "
+        f"{sign} (CASE WHEN {r}.paid THEN {r}.total_payment ELSE COALESCE({r}.paid_amount, 0) END)"
+    )
+
+_UPSERT = (
+    "INSERT INTO daily_driver_stats (driver_id, day, " + ", ".join(STAT_COLUMNS) + ") "
+    "{source} "
+    "ON CONFLICT(driver_id, day) DO UPDATE SET "
+    + ", ".join(f"{column} = {column} + excluded.{column}" for column in STAT_COLUMNS)
+    + ";"
+)
+
+# Строка с driver_id = NULL (рейс без водителя) в статистику не попадает
+def _trip_upsert(r, sign):
+    return _UPSERT.format(source=f"SELECT {_trip_values(r, sign)} WHERE {r}.driver_id IS NOT NULL")
+
+# Простой относится к дню и водителю своего рейса
+def _downtime_upsert(r, sign):
+    zeros = "0, 0, 0, 0"
+    source = (
+        f"SELECT driver_id, date(created_at), {zeros}, {sign} {r}.hours, 0, 0 "
+        f"FROM trips WHERE id = {r}.trip_id AND driver_id IS NOT NULL"
+    )
+    return _UPSERT.format(source=source)
+
+TRIP_STAT_FIELDS = ("driver_id, created_at, distance, side_loading_count, roof_loading_count, "
+                    "total_payment, paid, paid_amount")
+
+# Изменились поля, от которых зависят водитель, день или объем работы рейса
+_TRIP_MOVED = " OR ".join(
+    f"OLD.{field} IS NOT NEW.{field}"
+    for field in ['driver_id', 'created_at', 'distance', 'side_loading_count', 'roof_loading_count']
+)
+
+# Изменились только суммы (оплата, пересчет): одна поправка начислено/выплачено
+# в той же строке, без пересчета простоев
+def _trip_money_upsert():
+    paid = "(CASE WHEN {r}.paid THEN {r}.total_payment ELSE COALESCE({r}.paid_amount, 0) END)"
+    source = (
+        "SELECT NEW.driver_id, date(NEW.created_at), 0, 0, 0, 0, 0, "
+        "NEW.total_payment - OLD.total_payment, "
+        f"{paid.format(r='NEW')} - {paid.format(r='OLD')} "
+        "WHERE NEW.driver_id IS NOT NULL"
+    )
+    return _UPSERT.format(source=source)
+
+def _create_triggers(cursor):
+    triggers = {
+        'trg_trips_insert_daily_stats':
+            f"AFTER INSERT ON trips BEGIN {_trip_upsert('NEW', '+')} END",
+        'trg_trips_delete_daily_stats':
+            f"AFTER DELETE ON trips BEGIN {_trip_upsert('OLD', '-')} END",
+        'trg_trips_update_daily_stats':
+            f"AFTER UPDATE OF {TRIP_STAT_FIELDS} ON trips WHEN {_TRIP_MOVED} BEGIN "
+            f"{_trip_upsert('OLD', '-')} {_trip_upsert('NEW', '+')} END",
+        'trg_trips_payment_daily_stats':
+            f"AFTER UPDATE OF total_payment, paid, paid_amount ON trips WHEN NOT ({_TRIP_MOVED}) BEGIN "
+            f"{_trip_money_upsert()} END",
+        'trg_downtimes_insert_daily_stats':
+            f"AFTER INSERT ON downtimes BEGIN {_downtime_upsert('NEW', '+')} END",
+        'trg_downtimes_delete_daily_stats':
+            f"AFTER DELETE ON downtimes BEGIN {_downtime_upsert('OLD', '-')} END",
+        'trg_downtimes_update_daily_stats':
+            f"AFTER UPDATE OF trip_id, hours ON downtimes BEGIN "
+            f"{_downtime_upsert('OLD', '-')} {_downtime_upsert('NEW', '+')} END",
+    }
+    for name, body in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+# Триггер изменения рейса разделен на общий и на изменение только сумм
+def split_trip_update_trigger(cursor):
+    cursor.execute("DROP TRIGGER IF EXISTS trg_trips_update_daily_stats")
+    _create_triggers(cursor)
+
+def create_daily_driver_stats(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_driver_stats (
+        driver_id INTEGER NOT NULL,
+        day TEXT NOT NULL,  -- YYYY-MM-DD
+        trips_count INTEGER NOT NULL DEFAULT 0,
+        distance REAL NOT NULL DEFAULT 0,
+        side_loadings INTEGER NOT NULL DEFAULT 0,
+        roof_loadings INTEGER NOT NULL DEFAULT 0,
+        downtime_hours REAL NOT NULL DEFAULT 0,
+        accrued REAL NOT NULL DEFAULT 0,
+        paid_amount REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (driver_id, day)
+    ) WITHOUT ROWID
+    ''')
+    # Статистика за период по всем водителям
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_driver_stats_day ON daily_driver_stats (day)")
+    _create_triggers(cursor)
+    rebuild_daily_driver_stats(cursor)
+
+# Статистика, посчитанная заново по trips и downtimes
+_ACTUAL_STATS = """
+SELECT t.driver_id, date(t.created_at), COUNT(*), SUM(t.distance),
+       SUM(COALESCE(t.side_loading_count, 0)), SUM(COALESCE(t.roof_loading_count, 0)),
+       COALESCE(SUM(dt.hours), 0), SUM(t.total_payment),
+       SUM(CASE WHEN t.paid THEN t.total_payment ELSE COALESCE(t.paid_amount, 0) END)
+FROM trips t
+LEFT JOIN (SELECT trip_id, SUM(hours) AS hours FROM downtimes GROUP BY trip_id) dt ON dt.trip_id = t.id
+WHERE t.driver_id IS NOT NULL
+GROUP BY t.driver_id, date(t.created_at)
+"""
+
+# Расхождения с рейсами: [((driver_id, day), в таблице, по рейсам)]
+def verify_daily_driver_stats(cursor):
+    cursor.execute(_ACTUAL_STATS)
+    actual = {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
+    cursor.execute("SELECT driver_id, day, " + ", ".join(STAT_COLUMNS) + " FROM daily_driver_stats")
+    stored = {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
+    empty = (0,) * len(STAT_COLUMNS)
+
+    mismatches = []
+    for key in sorted(set(actual) | set(stored)):
+        have = stored.get(key, empty)
+        want = actual.get(key, empty)
+        if any(abs((a or 0) - (b or 0)) > ROLLUP_TOLERANCE for a, b in zip(have, want)):
+            mismatches.append((key, have, want))
+    return mismatches
+
+# Пересобрать таблицу по рейсам; возвращает найденные до пересборки расхождения
+def rebuild_daily_driver_stats(cursor):
+    mismatches = verify_daily_driver_stats(cursor)
+    cursor.execute("DELETE FROM daily_driver_stats")
+    cursor.execute(
+        "INSERT INTO daily_driver_stats (driver_id, day, " + ", ".join(STAT_COLUMNS) + ") "
+        + _ACTUAL_STATS
+    )
+    return mismatches
+
+# Статистика водителей за дни [start_day, end_day] (строки 'YYYY-MM-DD'):
+# (имя, рейсов, км, боковой тент, крыша, часы простоя, начислено, выплачено)
+DRIVER_STATS_FOR_RANGE = """
+SELECT d.name, COALESCE(SUM(s.trips_count), 0), COALESCE(SUM(s.distance), 0),
+       COALESCE(SUM(s.side_loadings), 0), COALESCE(SUM(s.roof_loadings), 0),
+       COALESCE(SUM(s.downtime_hours), 0), COALESCE(SUM(s.accrued), 0),
+       COALESCE(SUM(s.paid_amount), 0)
+FROM drivers d
+LEFT JOIN daily_driver_stats s ON s.driver_id = d.id AND s.day BETWEEN ? AND ?
+GROUP BY d.id
+ORDER BY 7 DESC, d.name
+"""
+
+def driver_stats_for_range(cursor, start_day, end_day):
+    cursor.execute(DRIVER_STATS_FOR_RANGE, (start_day, end_day))
+    return cursor.fetchall()
+
+if __name__ == '__main__':
+    import sqlite3
+    import sys
+    from database import DB_PATH
+
+    args = [arg for arg in sys.argv[1:] if arg != '--check']
+    check_only = '--check' in sys.argv[1:]
+    conn = sqlite3.connect(args[0] if args else DB_PATH)
+    cursor = conn.cursor()
+
+    if check_only:
+        mismatches = verify_daily_driver_stats(cursor)
+    else:
+        mismatches = rebuild_daily_driver_stats(cursor)
+        conn.commit()
+    conn.close()
+
+    for key, have, want in mismatches[:50]:
+        print(f"Водитель #{key[0]}, {key[1]}: в таблице {have}, по рейсам {want}")
+    print(f"Расхождений: {len(mismatches)}" + ("" if check_only else ", таблица пересобрана"))
+    sys.exit(1 if check_only and mismatches else 0)
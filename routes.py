@@ -0,0 +1,146 @@
+# Справочник маршрутов (таблица routes): по паре городов погрузки и разгрузки
+# (ключи как в подсказках городов, cities.city_key) - число рейсов, медиана
+# и последнее расстояние. Медиана считается по последним ROUTE_SAMPLE рейсам
+# маршрута, поэтому обновление при сохранении рейса - одна строка, без чтения
+# рейсов. Расстояние маршрута предлагается при вводе рейса, а сильно
+# отличающееся от медианы значение переспрашивается.
+
+from collections import defaultdict, deque
+from statistics import median
+
+from cities import city_key
+
+ROUTE_SAMPLE = 15  # По скольким последним рейсам маршрута считается медиана
+ROUTE_MIN_TRIPS = 3  # С какого числа рейсов предупреждать о необычном расстоянии
+ROUTE_OUTLIER = 0.3  # Отклонение от медианы (доля), после которого нужно подтверждение
+
+# (рейсов, медиана, последнее расстояние) маршрута по ключам городов
+ROUTE_QUERY = """
+SELECT trips_count, median_distance, last_distance
+FROM routes
+WHERE loading_key = ? AND unloading_key = ?
+"""
+
+def route_key(loading_city, unloading_city):
+    return city_key(loading_city or ''), city_key(unloading_city or '')
+
+def create_routes(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS routes (
+        loading_key TEXT NOT NULL,
+        unloading_key TEXT NOT NULL,
+        trips_count INTEGER NOT NULL,
+        median_distance REAL NOT NULL,
+        last_distance REAL NOT NULL,
+        recent_distances TEXT NOT NULL,  -- последние расстояния через запятую, новые в конце
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (loading_key, unloading_key)
+    ) WITHOUT ROWID
+    ''')
+    rebuild_routes(cursor)
+
+def _format_distances(distances):
+    return ",".join(repr(float(distance)) for distance in distances)
+
+def _upsert_route(cursor, key, count, distances):
+    cursor.execute("""
+    INSERT INTO routes (loading_key, unloading_key, trips_count, median_distance, last_distance, recent_distances)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(loading_key, unloading_key) DO UPDATE SET
+        trips_count = excluded.trips_count,
+        median_distance = excluded.median_distance,
+        last_distance = excluded.last_distance,
+        recent_distances = excluded.recent_distances,
+        updated_at = CURRENT_TIMESTAMP
+    """, key + (count, median(distances), distances[-1], _format_distances(distances)))
+
+# Маршруты по рейсам: {ключ: (рейсов, последние расстояния)}; keys - только эти
+def _collect_routes(cursor, keys=None):
+    cursor.execute("""
+    SELECT loading_city, unloading_city, distance
+    FROM trips
+    WHERE distance > 0
+    ORDER BY created_at, id
+    """)
+    counts = defaultdict(int)
+    recent = defaultdict(lambda: deque(maxlen=ROUTE_SAMPLE))
+    for loading_city, unloading_city, distance in cursor.fetchall():
+        key = route_key(loading_city, unloading_city)
+        if keys is None or key in keys:
+            counts[key] += 1
+            recent[key].append(distance)
+    return {key: (counts[key], list(distances)) for key, distances in recent.items()}
+
+# Пересобрать справочник по всем рейсам (миграция)
+def rebuild_routes(cursor):
+    cursor.execute("DELETE FROM routes")
+    for key, (count, distances) in _collect_routes(cursor).items():
+        _upsert_route(cursor, key, count, distances)
+
+def _route_row(cursor, key):
+    cursor.execute(
+        "SELECT trips_count, recent_distances FROM routes WHERE loading_key = ? AND unloading_key = ?", key
+    )
+    row = cursor.fetchone()
+    return (row[0], [float(value) for value in row[1].split(",")]) if row else (0, [])
+
+# Учесть сохраненные рейсы (через db.transaction): [(погрузка, разгрузка, км)] по порядку
+def record_routes(cursor, trips):
+    new = defaultdict(list)
+    for loading_city, unloading_city, distance in trips:
+        if distance and distance > 0:
+            new[route_key(loading_city, unloading_city)].append(distance)
+
+    for key, distances in new.items():
+        count, recent = _route_row(cursor, key)
+        recent = (recent + distances)[-ROUTE_SAMPLE:]
+        _upsert_route(cursor, key, count + len(distances), recent)
+
+def record_route(cursor, loading_city, unloading_city, distance):
+    record_routes(cursor, [(loading_city, unloading_city, distance)])
+
+# Исправление рейса (через db.transaction, после UPDATE): old и new -
+# (погрузка, разгрузка, км) до и после. Рейс уходит из старого маршрута
+# (его расстояние - из выборки, если оно там есть) и учитывается в новом;
+# на том же маршруте новое расстояние встает на место старого
+def replace_route_trip(cursor, old, new):
+    old_key = route_key(old[0], old[1])
+    new_key = route_key(new[0], new[1])
+    old_counted = bool(old[2] and old[2] > 0)
+    new_counted = bool(new[2] and new[2] > 0)
+    if old_key == new_key and old[2] == new[2] and old_counted == new_counted:
+        return
+
+    count, recent = _route_row(cursor, old_key)
+    position = None
+    if old_counted and count:
+        count -= 1
+        if old[2] in recent:
+            position = len(recent) - 1 - recent[::-1].index(old[2])
+            del recent[position]
+
+    if new_key == old_key and new_counted:
+        count += 1
+        # Рейс старше выборки в нее и не попадает
+        if position is not None:
+            recent.insert(position, float(new[2]))
+        elif not old_counted:
+            recent = (recent + [float(new[2])])[-ROUTE_SAMPLE:]
+
+    if count <= 0:
+        cursor.execute("DELETE FROM routes WHERE loading_key = ? AND unloading_key = ?", old_key)
+    elif recent:
+        _upsert_route(cursor, old_key, count, recent)
+    else:
+        # Из выборки ушли все расстояния - пересобираем маршрут по рейсам
+        for key, (route_count, distances) in _collect_routes(cursor, {old_key}).items():
+            _upsert_route(cursor, key, route_count, distances)
+
+    if new_key != old_key:
+        record_route(cursor, *new)
+
+# Сильно ли distance отличается от обычного для маршрута (route - строка ROUTE_QUERY)
+def is_unusual_distance(route, distance):
+    if route is None or route[0] < ROUTE_MIN_TRIPS or route[1] <= 0:
+        return False
+    return abs(distance - route[1]) > ROUTE_OUTLIER * route[1]
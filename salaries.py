@@ -3,11 +3,14 @@ from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from bot import dp, bot, check_user_access
-import sqlite3
+from bot import dp, bot, requires_role, has_access, parse_period, PERIOD_FORMAT_HINT
+from audit import audit
+from database import db
+from export_jobs import submit_export
+from ledger import BALANCE_TOLERANCE
+from payments import PAYOUTS_FOR_RANGE, allocate_driver_payment, pay_driver_batch, record_payment, settle_trip
+from paging import PagedList
 from datetime import datetime, timedelta
-import io
-import csv
 import logging
 
 # Класс состояний для ввода ID рейса, который нужно отметить оплаченным
@@ -19,56 +22,23 @@ class PaymentAmountStates(StatesGroup):
     waiting_for_trip_id = State()
     waiting_for_amount = State()
 
-# Проверяем и обновляем структуру базы данных
-def check_db_structure():
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Проверяем существующие колонки в таблице trips
-    cursor.execute("PRAGMA table_info(trips)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    # Проверяем и добавляем колонку paid, если ее нет
-    if 'paid' not in columns:
-        try:
-            cursor.execute("ALTER TABLE trips ADD COLUMN paid INTEGER DEFAULT 0")
-            conn.commit()
-            logging.info("База данных обновлена: добавлена колонка 'paid' в таблицу 'trips'")
-        except sqlite3.OperationalError as e:
-            logging.error(f"Ошибка обновления структуры БД: {e}")
-    
-    # Проверяем и добавляем колонку paid_amount, если ее нет
-    if 'paid_amount' not in columns:
-        try:
-            cursor.execute("ALTER TABLE trips ADD COLUMN paid_amount REAL DEFAULT 0")
-            conn.commit()
-            logging.info("База данных обновлена: добавлена колонка 'paid_amount' в таблицу 'trips'")
-        except sqlite3.OperationalError as e:
-            logging.error(f"Ошибка обновления структуры БД: {e}")
-    
-    conn.close()
+# Класс состояний для оплаты рейсов водителя за период
+class PayoutPeriodStates(StatesGroup):
+    waiting_for_period = State()
 
-# Вызываем функцию проверки структуры БД при импорте модуля
-check_db_structure()
+# Класс состояний для выплаты водителю суммы одним платежом
+class DriverPaymentStates(StatesGroup):
+    waiting_for_amount = State()
 
 # Обработчик для показа актуальных данных
 @dp.message_handler(lambda message: message.text == "📊 Актуальные данные")
+@requires_role(2)
 async def show_current_data(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=2):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
-    # Получаем количество неоплаченных рейсов
-    cursor.execute("SELECT COUNT(*) FROM trips WHERE paid = 0")
-    unpaid_count = cursor.fetchone()[0]
-    
-    # Получаем общую сумму задолженности с учетом частичной оплаты
-    cursor.execute("SELECT SUM(total_payment - paid_amount) FROM trips WHERE paid = 0")
-    total_debt = cursor.fetchone()[0] or 0
+    # Получаем количество неоплаченных рейсов и общую сумму задолженности с учетом частичной оплаты
+    unpaid_count, total_debt = await db.fetchone(
+        "SELECT COALESCE(SUM(unpaid_count), 0), SUM(unpaid_amount) FROM driver_balances"
+    )
+    total_debt = total_debt or 0
     
     # Создаем клавиатуру для отображения задолженностей
     keyboard = InlineKeyboardMarkup(row_width=1)
@@ -85,68 +55,63 @@ async def show_current_data(message: types.Message):
         f"Общая сумма задолженности: {int(total_debt)} ₽",
         reply_markup=keyboard
     )
+
+# Страница списка неоплаченных рейсов (полностью или частично)
+async def render_debts_page(page):
+    text = "💰 Неоплаченные рейсы:\n\n"
+    
+    for trip_id, driver_name, load_city, unload_city, distance, payment, paid_amount, date in page.rows:
+        trip_date = date.split(' ')[0]  # Берем только дату без времени
+        remaining = payment - paid_amount
+        payment_status = f"Частично оплачено: {int(paid_amount)} ₽" if paid_amount > 0 else "Не оплачено"
+        
+        text += (
+            f"🔹 Рейс #{trip_id} ({trip_date})\n"
+            f"👤 Водитель: {driver_name}\n"
+            f"🚚 Маршрут: {load_city} → {unload_city}\n"
+            f"💵 Сумма: {int(payment)} ₽ ({payment_status})\n"
+            f"💸 Осталось: {int(remaining)} ₽\n\n"
+        )
     
-    conn.close()
+    # Итог по всем рейсам, а не только по странице - из сводки по водителям
+    unpaid_count, total_debt = await db.fetchone(
+        "SELECT COALESCE(SUM(unpaid_count), 0), SUM(unpaid_amount) FROM driver_balances"
+    )
+    text += f"Итого задолженность: {int(total_debt or 0)} ₽ ({unpaid_count} рейсов)"
+    return text, []
+
+debts_list = PagedList(
+    'debts',
+    columns="""t.id, d.name, t.loading_city, t.unloading_city,
+               t.distance, t.total_payment, t.paid_amount, t.created_at""",
+    tables="trips t JOIN drivers d ON t.driver_id = d.id",
+    where="t.paid = 0",
+    key=('t.created_at', 't.id'),
+    render=render_debts_page,
+    footer=[
+        ("✅ Отметить рейс как полностью оплаченный", "mark_paid"),
+        ("💵 Внести частичную оплату", "partial_payment"),
+        ("📋 Экспорт в CSV", "export_debts"),
+        ("◀️ Назад", "back_to_main"),
+    ]
+)
 
 # Обработчик для просмотра всех задолженностей
 @dp.callback_query_handler(lambda c: c.data == "view_debts")
 async def view_debts(callback_query: types.CallbackQuery):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Получаем неоплаченные рейсы (полностью или частично)
-        cursor.execute("""
-        SELECT t.id, d.name, t.loading_city, t.unloading_city, 
-               t.distance, t.total_payment, t.paid_amount, t.created_at
-        FROM trips t
-        JOIN drivers d ON t.driver_id = d.id
-        WHERE t.paid = 0
-        ORDER BY t.created_at DESC
-        """)
+        # Первая страница неоплаченных рейсов, остальные - по кнопкам навигации
+        text, keyboard = await debts_list.render_page()
         
-        unpaid_trips = cursor.fetchall()
-        
-        if not unpaid_trips:
+        if text is None:
             await bot.answer_callback_query(callback_query.id)
             await bot.edit_message_text(
                 chat_id=callback_query.message.chat.id,
                 message_id=callback_query.message.message_id,
                 text="Нет неоплаченных рейсов."
             )
-            conn.close()
             return
         
-        # Формируем сообщение с задолженностями
-        text = "💰 Неоплаченные рейсы:\n\n"
-        
-        total_debt = 0
-        for trip_id, driver_name, load_city, unload_city, distance, payment, paid_amount, date in unpaid_trips:
-            trip_date = date.split(' ')[0]  # Берем только дату без времени
-            remaining = payment - paid_amount
-            payment_status = f"Частично оплачено: {int(paid_amount)} ₽" if paid_amount > 0 else "Не оплачено"
-            
-            text += (
-                f"🔹 Рейс #{trip_id} ({trip_date})\n"
-                f"👤 Водитель: {driver_name}\n"
-                f"🚚 Маршрут: {load_city} → {unload_city}\n"
-                f"💵 Сумма: {int(payment)} ₽ ({payment_status})\n"
-                f"💸 Осталось: {int(remaining)} ₽\n\n"
-            )
-            total_debt += remaining
-        
-        # Добавляем итоговую сумму
-        text += f"Итого задолженность: {int(total_debt)} ₽"
-        
-        # Создаем клавиатуру с действиями
-        keyboard = InlineKeyboardMarkup(row_width=1)
-        keyboard.add(
-            InlineKeyboardButton("✅ Отметить рейс как полностью оплаченный", callback_data="mark_paid"),
-            InlineKeyboardButton("💵 Внести частичную оплату", callback_data="partial_payment"),
-            InlineKeyboardButton("📋 Экспорт в CSV", callback_data="export_debts"),
-            InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")
-        )
-        
         await bot.answer_callback_query(callback_query.id)
         await bot.edit_message_text(
             chat_id=callback_query.message.chat.id,
@@ -162,30 +127,21 @@ async def view_debts(callback_query: types.CallbackQuery):
             callback_query.message.chat.id,
             f"❌ Ошибка при получении данных: {str(e)}"
         )
-    
-    finally:
-        conn.close()
 
 # Обработчик для отображения задолженностей по водителям
 @dp.callback_query_handler(lambda c: c.data == "view_debts_by_driver")
 async def view_debts_by_driver(callback_query: types.CallbackQuery):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
         # Получаем задолженности по водителям
-        cursor.execute("""
-        SELECT d.id, d.name, COUNT(t.id) as trips_count, 
-               SUM(t.total_payment - t.paid_amount) as total_debt
-        FROM drivers d
-        LEFT JOIN trips t ON d.id = t.driver_id AND t.paid = 0
-        GROUP BY d.id
-        HAVING trips_count > 0
+        driver_debts = await db.fetchall("""
+        SELECT d.id, d.name, b.unpaid_count as trips_count, 
+               b.unpaid_amount as total_debt
+        FROM driver_balances b
+        JOIN drivers d ON d.id = b.driver_id
+        WHERE b.unpaid_count > 0
         ORDER BY total_debt DESC
         """)
         
-        driver_debts = cursor.fetchall()
-        
         if not driver_debts:
             await bot.answer_callback_query(callback_query.id)
             await bot.edit_message_text(
@@ -193,7 +149,6 @@ async def view_debts_by_driver(callback_query: types.CallbackQuery):
                 message_id=callback_query.message.message_id,
                 text="Нет задолженностей по водителям."
             )
-            conn.close()
             return
         
         # Формируем сообщение с задолженностями по водителям
@@ -230,77 +185,104 @@ async def view_debts_by_driver(callback_query: types.CallbackQuery):
             callback_query.message.chat.id,
             f"❌ Ошибка при получении данных: {str(e)}"
         )
+
+# Рейсы одного водителя: фильтр списка - id водителя
+def _driver_filter(arg):
+    return "t.driver_id = ?", (int(arg),)
+
+# Страница неоплаченных рейсов водителя; с can_pay - с кнопками оплаты
+async def _render_driver_trips_page(page, can_pay):
+    driver_id = int(page.arg)
+    driver_name = (await db.fetchone("SELECT name FROM drivers WHERE id = ?", (driver_id,)))[0]
+    
+    text = f"👤 Неоплаченные рейсы водителя {driver_name}:\n\n"
+    for trip_id, load_city, unload_city, distance, payment, date in page.rows:
+        trip_date = date.split(' ')[0]
+        text += (
+            f"🔹 Рейс #{trip_id} ({trip_date})\n"
+            f"🚚 Маршрут: {load_city} → {unload_city}\n"
+            f"📏 Расстояние: {distance} км\n"
+            f"💵 Сумма: {int(payment)} руб.\n\n"
+        )
     
-    finally:
-        conn.close()
+    # Итог по всем рейсам водителя, а не только по странице - из сводки
+    row = await db.fetchone(
+        "SELECT unpaid_count, unpaid_amount FROM driver_balances WHERE driver_id = ?", (driver_id,)
+    )
+    unpaid_count, total_debt = row if row else (0, 0)
+    text += f"Итого: {int(total_debt or 0)} руб. ({unpaid_count} рейсов)"
+    
+    if not can_pay:
+        return text, []
+    
+    # Кнопки отметки - только для рейсов этой страницы
+    buttons = [
+        InlineKeyboardButton(
+            f"✅ Отметить рейс #{trip_id} как оплаченный ({int(payment)} руб.)",
+            callback_data=f"pay_trip_{trip_id}"
+        )
+        for trip_id, _, _, _, payment, _ in page.rows
+    ]
+    # Выплаты пакетом и суммой - только для редакторов и администраторов
+    buttons += [
+        InlineKeyboardButton(
+            f"✅ Отметить ВСЕ рейсы водителя как оплаченные", 
+            callback_data=f"pay_all_driver_{driver_id}"
+        ),
+        InlineKeyboardButton(
+            "📅 Оплатить рейсы водителя за период",
+            callback_data=f"pay_period_driver_{driver_id}"
+        ),
+        InlineKeyboardButton(
+            "💰 Выплатить сумму водителю",
+            callback_data=f"pay_amount_driver_{driver_id}"
+        ),
+    ]
+    return text, buttons
+
+async def render_driver_trips_page(page):
+    return await _render_driver_trips_page(page, can_pay=False)
+
+async def render_driver_trips_pay_page(page):
+    return await _render_driver_trips_page(page, can_pay=True)
+
+_DRIVER_TRIPS = dict(
+    columns="t.id, t.loading_city, t.unloading_city, t.distance, t.total_payment, t.created_at",
+    tables="trips t",
+    where="t.paid = 0",
+    key=('t.created_at', 't.id'),
+    filters=_driver_filter,
+    footer=[("◀️ Назад", "view_debts_by_driver")],
+)
+
+# Просмотр для всех ролей и тот же список с кнопками оплаты для редакторов
+driver_trips_list = PagedList('driver_trips', render=render_driver_trips_page, **_DRIVER_TRIPS)
+driver_trips_pay_list = PagedList(
+    'driver_trips_pay', render=render_driver_trips_pay_page, required_role=1, **_DRIVER_TRIPS
+)
 
 # Обработчик для отображения неоплаченных рейсов конкретного водителя
 @dp.callback_query_handler(lambda c: c.data.startswith("driver_trips_"))
-async def view_driver_trips(callback_query: types.CallbackQuery):
+async def view_driver_trips(callback_query: types.CallbackQuery, role):
     driver_id = int(callback_query.data.split("_")[2])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Получаем имя водителя
-        cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
-        driver_name = cursor.fetchone()[0]
+        paged = driver_trips_pay_list if has_access(role, 1) else driver_trips_list
+        text, keyboard = await paged.render_page(str(driver_id))
         
-        # Получаем неоплаченные рейсы водителя
-        cursor.execute("""
-        SELECT id, loading_city, unloading_city, 
-               distance, total_payment, created_at
-        FROM trips
-        WHERE driver_id = ? AND paid = 0
-        ORDER BY created_at DESC
-        """, (driver_id,))
-        
-        trips = cursor.fetchall()
-        
-        if not trips:
+        if text is None:
+            driver = await db.fetchone("SELECT name FROM drivers WHERE id = ?", (driver_id,))
             await bot.answer_callback_query(callback_query.id)
             await bot.edit_message_text(
                 chat_id=callback_query.message.chat.id,
                 message_id=callback_query.message.message_id,
-                text=f"У водителя {driver_name} нет неоплаченных рейсов.",
+                text=f"У водителя {driver[0] if driver else ''} нет неоплаченных рейсов.",
                 reply_markup=InlineKeyboardMarkup().add(
                     InlineKeyboardButton("◀️ Назад", callback_data="view_debts_by_driver")
                 )
             )
-            conn.close()
             return
         
-        # Формируем сообщение с рейсами водителя
-        text = f"👤 Неоплаченные рейсы водителя {driver_name}:\n\n"
-        
-        total_debt = 0
-        for trip_id, load_city, unload_city, distance, payment, date in trips:
-            trip_date = date.split(' ')[0]
-            text += (
-                f"🔹 Рейс #{trip_id} ({trip_date})\n"
-                f"🚚 Маршрут: {load_city} → {unload_city}\n"
-                f"📏 Расстояние: {distance} км\n"
-                f"💵 Сумма: {int(payment)} руб.\n\n"
-            )
-            total_debt += payment
-        
-        text += f"Итого: {int(total_debt)} руб."
-        
-        # Создаем клавиатуру с рейсами для отметки как оплаченных
-        keyboard = InlineKeyboardMarkup(row_width=1)
-        for trip_id, _, _, _, payment, _ in trips:
-            keyboard.add(InlineKeyboardButton(
-                f"✅ Отметить рейс #{trip_id} как оплаченный ({int(payment)} руб.)", 
-                callback_data=f"pay_trip_{trip_id}"
-            ))
-        
-        keyboard.add(InlineKeyboardButton(
-            f"✅ Отметить ВСЕ рейсы водителя как оплаченные", 
-            callback_data=f"pay_all_driver_{driver_id}"
-        ))
-        keyboard.add(InlineKeyboardButton("◀️ Назад", callback_data="view_debts_by_driver"))
-        
         await bot.answer_callback_query(callback_query.id)
         await bot.edit_message_text(
             chat_id=callback_query.message.chat.id,
@@ -316,51 +298,47 @@ async def view_driver_trips(callback_query: types.CallbackQuery):
             callback_query.message.chat.id,
             f"❌ Ошибка при получении данных: {str(e)}"
         )
+
+# Отметка рейса как оплаченного
+def _mark_trip_paid(cursor, trip_id, user_id):
+    # Получаем информацию о рейсе
+    cursor.execute("""
+    SELECT t.id, d.name, t.loading_city, t.unloading_city, t.total_payment
+    FROM trips t
+    JOIN drivers d ON t.driver_id = d.id
+    WHERE t.id = ?
+    """, (trip_id,))
     
-    finally:
-        conn.close()
+    trip = cursor.fetchone()
+    
+    if not trip:
+        return None
+    
+    # Выплачиваем остаток и отмечаем рейс как оплаченный
+    settle_trip(cursor, trip_id, user_id)
+    
+    return trip
 
 # Обработчик для отметки рейса как оплаченного
 @dp.callback_query_handler(lambda c: c.data.startswith("pay_trip_"))
 async def mark_trip_paid(callback_query: types.CallbackQuery):
     trip_id = int(callback_query.data.split("_")[2])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Получаем информацию о рейсе
-        cursor.execute("""
-        SELECT t.id, d.name, t.loading_city, t.unloading_city, t.total_payment
-        FROM trips t
-        JOIN drivers d ON t.driver_id = d.id
-        WHERE t.id = ?
-        """, (trip_id,))
-        
-        trip = cursor.fetchone()
+        trip = await db.transaction(_mark_trip_paid, trip_id, callback_query.from_user.id)
         
         if not trip:
             await bot.answer_callback_query(callback_query.id, text="Рейс не найден!")
-            conn.close()
             return
         
-        trip_id, driver_name, load_city, unload_city, payment = trip
-        
-        # Отмечаем рейс как оплаченный
-        cursor.execute("UPDATE trips SET paid = 1 WHERE id = ?", (trip_id,))
-        
         # Логируем действие
-        cursor.execute(
-            "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-            (
-                callback_query.from_user.id,
-                "Отметка рейса как оплаченного",
-                f"Рейс #{trip_id}: {driver_name}, {load_city}-{unload_city}, {payment} руб."
-            )
+        _, driver_name, load_city, unload_city, payment = trip
+        await audit(
+            callback_query.from_user.id,
+            "Отметка рейса как оплаченного",
+            f"Рейс #{trip_id}: {driver_name}, {load_city}-{unload_city}, {payment} руб."
         )
         
-        conn.commit()
-        
         await bot.answer_callback_query(callback_query.id, text="✅ Рейс отмечен как оплаченный!")
         
         # Возвращаемся к списку задолженностей по водителям
@@ -373,53 +351,46 @@ async def mark_trip_paid(callback_query: types.CallbackQuery):
             callback_query.message.chat.id,
             f"❌ Ошибка при отметке рейса: {str(e)}"
         )
-    
-    finally:
-        conn.close()
+
+# Страница выбора рейса для частичной оплаты: кнопки только рейсов страницы
+async def render_partial_payment_page(page):
+    buttons = []
+    for trip_id, driver, load, unload, payment, paid_amount in page.rows:
+        remaining = payment - paid_amount
+        status = f"(уже оплачено: {int(paid_amount)} ₽)" if paid_amount > 0 else ""
+        buttons.append(InlineKeyboardButton(
+            f"#{trip_id}: {driver}, {load}-{unload}, долг: {int(remaining)} ₽ {status}",
+            callback_data=f"partial_pay_trip_{trip_id}"
+        ))
+    return "Выберите рейс для внесения частичной оплаты:", buttons
+
+partial_payment_list = PagedList(
+    'partial_payment',
+    columns="t.id, d.name, t.loading_city, t.unloading_city, t.total_payment, t.paid_amount",
+    tables="trips t JOIN drivers d ON t.driver_id = d.id",
+    where="t.paid = 0",
+    key=('t.created_at', 't.id'),
+    render=render_partial_payment_page,
+    footer=[("◀️ Назад", "view_debts")]
+)
 
 # Обработчик для выбора рейса для частичной оплаты
 @dp.callback_query_handler(lambda c: c.data == "partial_payment")
 async def select_trip_for_partial_payment(callback_query: types.CallbackQuery):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Получаем неоплаченные рейсы
-        cursor.execute("""
-        SELECT t.id, d.name, t.loading_city, t.unloading_city, 
-               t.total_payment, t.paid_amount
-        FROM trips t
-        JOIN drivers d ON t.driver_id = d.id
-        WHERE t.paid = 0
-        ORDER BY t.created_at DESC
-        """)
-        
-        trips = cursor.fetchall()
+        # Первая страница неоплаченных рейсов, остальные - по кнопкам навигации
+        text, keyboard = await partial_payment_list.render_page()
         
-        if not trips:
+        if text is None:
             await bot.answer_callback_query(callback_query.id, text="Нет неоплаченных рейсов!")
             await view_debts(callback_query)
-            conn.close()
             return
         
-        # Создаем клавиатуру для выбора рейса
-        keyboard = InlineKeyboardMarkup(row_width=1)
-        
-        for trip_id, driver, load, unload, payment, paid_amount in trips:
-            remaining = payment - paid_amount
-            status = f"(уже оплачено: {int(paid_amount)} ₽)" if paid_amount > 0 else ""
-            keyboard.add(InlineKeyboardButton(
-                f"#{trip_id}: {driver}, {load}-{unload}, долг: {int(remaining)} ₽ {status}",
-                callback_data=f"partial_pay_trip_{trip_id}"
-            ))
-        
-        keyboard.add(InlineKeyboardButton("◀️ Назад", callback_data="view_debts"))
-        
         await bot.answer_callback_query(callback_query.id)
         await bot.edit_message_text(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
-            text="Выберите рейс для внесения частичной оплаты:",
+            text=text,
             reply_markup=keyboard
         )
     
@@ -430,21 +401,15 @@ async def select_trip_for_partial_payment(callback_query: types.CallbackQuery):
             callback_query.message.chat.id,
             f"❌ Ошибка: {str(e)}"
         )
-    
-    finally:
-        conn.close()
 
 # Обработчик для выбора рейса для частичной оплаты
 @dp.callback_query_handler(lambda c: c.data.startswith("partial_pay_trip_"))
 async def enter_partial_payment_amount(callback_query: types.CallbackQuery, state: FSMContext):
     trip_id = int(callback_query.data.split("_")[3])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
         # Получаем информацию о рейсе
-        cursor.execute("""
+        trip = await db.fetchone("""
         SELECT t.id, d.name, t.loading_city, t.unloading_city, 
                t.total_payment, t.paid_amount
         FROM trips t
@@ -452,11 +417,8 @@ async def enter_partial_payment_amount(callback_query: types.CallbackQuery, stat
         WHERE t.id = ?
         """, (trip_id,))
         
-        trip = cursor.fetchone()
-        
         if not trip:
             await bot.answer_callback_query(callback_query.id, text="Рейс не найден!")
-            conn.close()
             return
         
         _, driver_name, load_city, unload_city, total_payment, paid_amount = trip
@@ -494,9 +456,11 @@ async def enter_partial_payment_amount(callback_query: types.CallbackQuery, stat
             f"❌ Ошибка: {str(e)}"
         )
         await state.finish()
-    
-    finally:
-        conn.close()
+
+# Внесение частичной оплаты
+def _apply_partial_payment(cursor, data, amount, user_id):
+    # Если выплачена вся сумма, рейс отмечается как оплаченный
+    record_payment(cursor, data['trip_id'], amount, user_id)
 
 # Обработчик ввода суммы частичной оплаты
 @dp.message_handler(state=PaymentAmountStates.waiting_for_amount)
@@ -527,39 +491,23 @@ async def process_payment_amount(message: types.Message, state: FSMContext):
             await state.finish()
             return
         
-        conn = sqlite3.connect('salary_bot.db')
-        cursor = conn.cursor()
-        
         # Обновляем сумму оплаты
         new_paid_amount = paid_amount + amount
         is_fully_paid = (new_paid_amount >= total_payment)
         
-        # Если рейс полностью оплачен, отмечаем его как оплаченный
-        if is_fully_paid:
-            cursor.execute(
-                "UPDATE trips SET paid = 1, paid_amount = ? WHERE id = ?", 
-                (total_payment, trip_id)
-            )
-            status_text = "полностью оплачен"
-        else:
-            cursor.execute(
-                "UPDATE trips SET paid_amount = ? WHERE id = ?", 
-                (new_paid_amount, trip_id)
-            )
-            status_text = f"частично оплачен (внесено {int(new_paid_amount)} ₽ из {int(total_payment)} ₽)"
+        await db.transaction(_apply_partial_payment, data, amount, message.from_user.id)
         
         # Логируем действие
-        cursor.execute(
-            "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-            (
-                message.from_user.id,
-                "Частичная оплата рейса" if not is_fully_paid else "Полная оплата рейса",
-                f"Рейс #{trip_id}: {driver_name}, {load_city}-{unload_city}, внесено {amount} ₽"
-            )
+        await audit(
+            message.from_user.id,
+            "Частичная оплата рейса" if not is_fully_paid else "Полная оплата рейса",
+            f"Рейс #{trip_id}: {driver_name}, {load_city}-{unload_city}, внесено {amount} ₽"
         )
         
-        conn.commit()
-        conn.close()
+        if is_fully_paid:
+            status_text = "полностью оплачен"
+        else:
+            status_text = f"частично оплачен (внесено {int(new_paid_amount)} ₽ из {int(total_payment)} ₽)"
         
         await message.answer(
             f"✅ Оплата в размере {amount} ₽ внесена для рейса #{trip_id}!\n\n"
@@ -581,50 +529,47 @@ async def process_payment_amount(message: types.Message, state: FSMContext):
     finally:
         await state.finish()
 
+# Полная оплата рейса
+def _confirm_full_payment(cursor, trip_id, user_id):
+    # Получаем информацию о рейсе
+    cursor.execute("""
+    SELECT t.id, d.name, t.loading_city, t.unloading_city, t.total_payment
+    FROM trips t
+    JOIN drivers d ON t.driver_id = d.id
+    WHERE t.id = ?
+    """, (trip_id,))
+    
+    trip = cursor.fetchone()
+    
+    if not trip:
+        return None
+    
+    # Выплачиваем остаток и отмечаем рейс как полностью оплаченный
+    settle_trip(cursor, trip_id, user_id)
+    
+    return trip
+
 # Обработчик для подтверждения полной оплаты
 @dp.callback_query_handler(lambda c: c.data.startswith("confirm_full_payment_"))
 async def confirm_full_payment(callback_query: types.CallbackQuery):
     trip_id = int(callback_query.data.split("_")[3])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Получаем информацию о рейсе
-        cursor.execute("""
-        SELECT t.id, d.name, t.loading_city, t.unloading_city, t.total_payment
-        FROM trips t
-        JOIN drivers d ON t.driver_id = d.id
-        WHERE t.id = ?
-        """, (trip_id,))
-        
-        trip = cursor.fetchone()
+        trip = await db.transaction(_confirm_full_payment, trip_id, callback_query.from_user.id)
         
         if not trip:
             await bot.answer_callback_query(callback_query.id, text="Рейс не найден!")
-            conn.close()
             return
         
         trip_id, driver_name, load_city, unload_city, total_payment = trip
         
-        # Отмечаем рейс как полностью оплаченный
-        cursor.execute(
-            "UPDATE trips SET paid = 1, paid_amount = ? WHERE id = ?", 
-            (total_payment, trip_id)
-        )
-        
         # Логируем действие
-        cursor.execute(
-            "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-            (
-                callback_query.from_user.id,
-                "Полная оплата рейса",
-                f"Рейс #{trip_id}: {driver_name}, {load_city}-{unload_city}, {total_payment} руб."
-            )
+        await audit(
+            callback_query.from_user.id,
+            "Полная оплата рейса",
+            f"Рейс #{trip_id}: {driver_name}, {load_city}-{unload_city}, {total_payment} руб."
         )
         
-        conn.commit()
-        
         await bot.answer_callback_query(callback_query.id, text="✅ Рейс отмечен как полностью оплаченный!")
         await bot.send_message(
             callback_query.message.chat.id,
@@ -641,9 +586,6 @@ async def confirm_full_payment(callback_query: types.CallbackQuery):
             callback_query.message.chat.id,
             f"❌ Ошибка при отметке рейса: {str(e)}"
         )
-    
-    finally:
-        conn.close()
 
 # Обработчик для отмены оплаты
 @dp.callback_query_handler(lambda c: c.data == "cancel_payment")
@@ -654,55 +596,67 @@ async def cancel_payment(callback_query: types.CallbackQuery):
         "🚫 Оплата отменена."
     )
 
+# Оплата рейсов водителя одним пакетом: все неоплаченные или за период
+def _pay_driver_batch(cursor, driver_id, user_id, start_day=None, end_day=None):
+    # Получаем имя водителя
+    cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
+    driver_name = cursor.fetchone()[0]
+    
+    return driver_name, pay_driver_batch(cursor, driver_id, user_id, start_day, end_day)
+
+# Квитанция о выплате пакетом
+def format_payout_receipt(driver_name, receipt, period=None):
+    batch_id, count, amount, partial, first_trip_at, last_trip_at = receipt
+    text = (
+        f"🧾 Выплата #{batch_id}\n\n"
+        f"👤 Водитель: {driver_name}\n"
+    )
+    if period:
+        text += f"📅 Период: {period[0].strftime('%d.%m.%Y')} - {period[1].strftime('%d.%m.%Y')}\n"
+    text += (
+        f"🚚 Рейсов: {count} ({first_trip_at.split(' ')[0]} - {last_trip_at.split(' ')[0]})\n"
+        f"💵 Выплачено: {int(amount)} ₽\n"
+    )
+    if partial:
+        text += f"💳 Было выплачено ранее: {int(partial)} ₽\n"
+    return text
+
+# Провести выплату пакетом и отправить квитанцию; False - оплачивать нечего
+async def pay_driver_trips(chat_id, user_id, driver_id, period=None):
+    days = (period[0].isoformat(), period[1].isoformat()) if period else ()
+    driver_name, receipt = await db.transaction(_pay_driver_batch, driver_id, user_id, *days)
+    
+    if receipt is None:
+        return False
+    
+    batch_id, count, amount = receipt[:3]
+    
+    # Логируем действие
+    await audit(
+        user_id,
+        "Отметка всех рейсов водителя как оплаченных",
+        f"Водитель: {driver_name}, Пакет #{batch_id}, Рейсов: {count}, Выплачено: {amount} руб."
+    )
+    
+    await bot.send_message(chat_id, format_payout_receipt(driver_name, receipt, period))
+    return True
+
 # Обработчик для отметки всех рейсов водителя как оплаченных
 @dp.callback_query_handler(lambda c: c.data.startswith("pay_all_driver_"))
+@requires_role(1)
 async def mark_all_driver_trips_paid(callback_query: types.CallbackQuery):
     driver_id = int(callback_query.data.split("_")[3])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Получаем имя водителя
-        cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
-        driver_name = cursor.fetchone()[0]
-        
-        # Получаем количество и общую сумму неоплаченных рейсов
-        cursor.execute("""
-        SELECT COUNT(*), SUM(total_payment)
-        FROM trips
-        WHERE driver_id = ? AND paid = 0
-        """, (driver_id,))
-        
-        count, total = cursor.fetchone()
+        paid = await pay_driver_trips(
+            callback_query.message.chat.id, callback_query.from_user.id, driver_id
+        )
         
-        if not count or count == 0:
+        if not paid:
             await bot.answer_callback_query(callback_query.id, text="Нет неоплаченных рейсов!")
-            conn.close()
             return
         
-        # Отмечаем все рейсы водителя как оплаченные
-        cursor.execute("UPDATE trips SET paid = 1 WHERE driver_id = ? AND paid = 0", (driver_id,))
-        
-        # Логируем действие
-        cursor.execute(
-            "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-            (
-                callback_query.from_user.id,
-                "Отметка всех рейсов водителя как оплаченных",
-                f"Водитель: {driver_name}, Рейсов: {count}, Сумма: {total} руб."
-            )
-        )
-        
-        conn.commit()
-        
         await bot.answer_callback_query(callback_query.id)
-        await bot.send_message(
-            callback_query.message.chat.id,
-            f"✅ Все рейсы водителя {driver_name} отмечены как оплаченные!\n"
-            f"Количество рейсов: {count}\n"
-            f"Общая сумма: {int(total)} руб."
-        )
         
         # Возвращаемся к списку задолженностей по водителям
         await view_debts_by_driver(callback_query)
@@ -714,50 +668,167 @@ async def mark_all_driver_trips_paid(callback_query: types.CallbackQuery):
             callback_query.message.chat.id,
             f"❌ Ошибка при отметке рейсов: {str(e)}"
         )
+
+# Обработчик для оплаты рейсов водителя за период
+@dp.callback_query_handler(lambda c: c.data.startswith("pay_period_driver_"))
+@requires_role(1)
+async def ask_payout_period(callback_query: types.CallbackQuery, state: FSMContext):
+    driver_id = int(callback_query.data.split("_")[3])
+    
+    await state.update_data(driver_id=driver_id)
+    await PayoutPeriodStates.waiting_for_period.set()
+    
+    await bot.answer_callback_query(callback_query.id)
+    await bot.send_message(
+        callback_query.message.chat.id,
+        f"Введите период рейсов для оплаты в формате {PERIOD_FORMAT_HINT}\n"
+        f"Например: 01.03.2024-31.03.2024"
+    )
+
+# Обработчик ввода периода для оплаты рейсов водителя
+@dp.message_handler(state=PayoutPeriodStates.waiting_for_period)
+@requires_role(1)
+async def process_payout_period(message: types.Message, state: FSMContext):
+    try:
+        period = parse_period(message.text)
+    except ValueError:
+        await message.answer(f"Неверный период. Введите его в формате {PERIOD_FORMAT_HINT}")
+        return
+    
+    data = await state.get_data()
+    
+    try:
+        paid = await pay_driver_trips(message.chat.id, message.from_user.id, data['driver_id'], period)
+        
+        if not paid:
+            await message.answer("За этот период у водителя нет неоплаченных рейсов.")
+    
+    except Exception as e:
+        logging.error(f"Ошибка при оплате рейсов водителя за период: {str(e)}")
+        await message.answer(f"❌ Ошибка при оплате рейсов: {str(e)}")
     
     finally:
-        conn.close()
+        await state.finish()
+
+# Обработчик для выплаты водителю суммы одним платежом
+@dp.callback_query_handler(lambda c: c.data.startswith("pay_amount_driver_"))
+@requires_role(1)
+async def ask_driver_payment_amount(callback_query: types.CallbackQuery, state: FSMContext):
+    driver_id = int(callback_query.data.split("_")[3])
+    
+    await state.update_data(driver_id=driver_id)
+    await DriverPaymentStates.waiting_for_amount.set()
+    
+    await bot.answer_callback_query(callback_query.id)
+    await bot.send_message(
+        callback_query.message.chat.id,
+        "Введите сумму, выплаченную водителю (в рублях).\n"
+        "Она будет распределена по неоплаченным рейсам, начиная с самых старых."
+    )
+
+# Выплата суммы водителю: распределение по рейсам от старых к новым
+def _allocate_driver_payment(cursor, driver_id, amount, user_id):
+    cursor.execute("SELECT name FROM drivers WHERE id = ?", (driver_id,))
+    driver_name = cursor.fetchone()[0]
+    
+    # Долг водителя из сводки; больше долга выплатить нельзя
+    cursor.execute("SELECT unpaid_amount FROM driver_balances WHERE driver_id = ?", (driver_id,))
+    row = cursor.fetchone()
+    debt = row[0] if row else 0
+    if amount > debt + BALANCE_TOLERANCE:
+        return driver_name, debt, None
+    
+    return driver_name, debt, allocate_driver_payment(cursor, driver_id, amount, user_id)
+
+# Обработчик ввода суммы выплаты водителю
+@dp.message_handler(state=DriverPaymentStates.waiting_for_amount)
+@requires_role(1)
+async def process_driver_payment_amount(message: types.Message, state: FSMContext):
+    try:
+        amount = int(message.text.strip().replace(" ", ""))
+    except ValueError:
+        await message.answer("Некорректная сумма. Пожалуйста, введите целое число.")
+        return
+    
+    if amount <= 0:
+        await message.answer("Сумма оплаты должна быть положительным числом.")
+        return
+    
+    data = await state.get_data()
+    
+    try:
+        driver_name, debt, receipt = await db.transaction(
+            _allocate_driver_payment, data['driver_id'], amount, message.from_user.id
+        )
+        
+        if receipt is None:
+            await message.answer(
+                f"Сумма ({amount} ₽) превышает долг водителя {driver_name} ({int(debt)} ₽). "
+                f"Введите сумму не больше долга."
+            )
+            return
+        
+        batch_id, count, allocated = receipt[:3]
+        closed = receipt[6]
+        
+        # Логируем действие
+        await audit(
+            message.from_user.id,
+            "Выплата суммы водителю",
+            f"Водитель: {driver_name}, Пакет #{batch_id}, Рейсов: {count}, Выплачено: {allocated} руб."
+        )
+        
+        text = format_payout_receipt(driver_name, receipt[:6])
+        text += f"✅ Закрыто рейсов: {closed} из {count}\n"
+        if closed < count:
+            text += "💳 Последний рейс оплачен частично\n"
+        text += f"💸 Остаток долга: {int(debt - allocated)} ₽"
+        await message.answer(text)
+        await state.finish()
+    
+    except Exception as e:
+        logging.error(f"Ошибка при выплате суммы водителю: {str(e)}")
+        await message.answer(f"❌ Ошибка при выплате: {str(e)}")
+        await state.finish()
+
+# Страница выбора рейса для отметки оплаты: кнопки только рейсов страницы
+async def render_mark_paid_page(page):
+    buttons = [
+        InlineKeyboardButton(
+            f"#{trip_id}: {driver}, {load}-{unload}, {int(payment)} руб.",
+            callback_data=f"pay_trip_{trip_id}"
+        )
+        for trip_id, driver, load, unload, payment in page.rows
+    ]
+    return "Выберите рейс, который нужно отметить как оплаченный:", buttons
+
+mark_paid_list = PagedList(
+    'mark_paid',
+    columns="t.id, d.name, t.loading_city, t.unloading_city, t.total_payment",
+    tables="trips t JOIN drivers d ON t.driver_id = d.id",
+    where="t.paid = 0",
+    key=('t.created_at', 't.id'),
+    render=render_mark_paid_page,
+    footer=[("◀️ Назад", "view_debts")]
+)
 
 # Обработчик для выбора рейса, который нужно отметить как оплаченный
 @dp.callback_query_handler(lambda c: c.data == "mark_paid")
 async def select_trip_to_mark_paid(callback_query: types.CallbackQuery):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Получаем неоплаченные рейсы
-        cursor.execute("""
-        SELECT t.id, d.name, t.loading_city, t.unloading_city, t.total_payment
-        FROM trips t
-        JOIN drivers d ON t.driver_id = d.id
-        WHERE t.paid = 0
-        ORDER BY t.created_at DESC
-        """)
-        
-        trips = cursor.fetchall()
+        # Первая страница неоплаченных рейсов, остальные - по кнопкам навигации
+        text, keyboard = await mark_paid_list.render_page()
         
-        if not trips:
+        if text is None:
             await bot.answer_callback_query(callback_query.id, text="Нет неоплаченных рейсов!")
             await view_debts(callback_query)
-            conn.close()
             return
         
-        # Создаем клавиатуру для выбора рейса
-        keyboard = InlineKeyboardMarkup(row_width=1)
-        
-        for trip_id, driver, load, unload, payment in trips:
-            keyboard.add(InlineKeyboardButton(
-                f"#{trip_id}: {driver}, {load}-{unload}, {int(payment)} руб.",
-                callback_data=f"pay_trip_{trip_id}"
-            ))
-        
-        keyboard.add(InlineKeyboardButton("◀️ Назад", callback_data="view_debts"))
-        
         await bot.answer_callback_query(callback_query.id)
         await bot.edit_message_text(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
-            text="Выберите рейс, который нужно отметить как оплаченный:",
+            text=text,
             reply_markup=keyboard
         )
     
@@ -768,66 +839,33 @@ async def select_trip_to_mark_paid(callback_query: types.CallbackQuery):
             callback_query.message.chat.id,
             f"❌ Ошибка: {str(e)}"
         )
-    
-    finally:
-        conn.close()
 
 # Обработчик для экспорта задолженностей в CSV
 @dp.callback_query_handler(lambda c: c.data == "export_debts")
 async def export_debts(callback_query: types.CallbackQuery):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Получаем неоплаченные рейсы
-        cursor.execute("""
-        SELECT t.id, d.name, v.truck_number, v.trailer_number,
-               t.loading_city, t.unloading_city, t.distance,
-               t.side_loading_count, t.roof_loading_count,
-               t.total_payment, t.paid_amount, (t.total_payment - t.paid_amount) as remaining, t.created_at
-        FROM trips t
-        JOIN drivers d ON t.driver_id = d.id
-        JOIN vehicles v ON t.vehicle_id = v.id
-        WHERE t.paid = 0
-        ORDER BY d.name, t.created_at
-        """)
-        
-        trips = cursor.fetchall()
-        
-        if not trips:
-            await bot.answer_callback_query(callback_query.id)
-            await bot.send_message(
-                callback_query.message.chat.id,
-                "Нет данных для экспорта."
-            )
-            conn.close()
-            return
-        
-        # Создаем CSV в памяти
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter=';', quotechar='"')
-        
-        # Заголовки
-        writer.writerow([
-            "ID", "Водитель", "Тягач", "Прицеп", "Город погрузки", 
-            "Город разгрузки", "Расстояние (км)", "Боковой тент", 
-            "Крыша", "Общая сумма (руб)", "Оплачено (руб)", "Осталось (руб)", "Дата"
-        ])
-        
-        # Данные
-        for trip in trips:
-            writer.writerow(trip)
-        
-        # Конвертируем в байты
-        csv_bytes = output.getvalue().encode('utf-8-sig')
-        
-        # Отправляем файл
-        filename = f"unpaid_trips_{datetime.now().strftime('%Y-%m-%d')}.csv"
-        
-        await bot.answer_callback_query(callback_query.id)
-        await bot.send_document(
-            callback_query.message.chat.id,
-            (filename, io.BytesIO(csv_bytes)),
+        # Файл собирается в фоне, обработчик отвечает сразу
+        await submit_export(
+            callback_query,
+            title="Неоплаченные рейсы",
+            sql="""
+            SELECT t.id, d.name, v.truck_number, v.trailer_number,
+                   t.loading_city, t.unloading_city, t.distance,
+                   t.side_loading_count, t.roof_loading_count,
+                   t.total_payment, t.paid_amount, (t.total_payment - t.paid_amount) as remaining, t.created_at
+            FROM trips t
+            JOIN drivers d ON t.driver_id = d.id
+            JOIN vehicles v ON t.vehicle_id = v.id
+            WHERE t.paid = 0
+            ORDER BY d.name, t.created_at
+            """,
+            params=(),
+            header=[
+                "ID", "Водитель", "Тягач", "Прицеп", "Город погрузки", 
+                "Город разгрузки", "Расстояние (км)", "Боковой тент", 
+                "Крыша", "Общая сумма (руб)", "Оплачено (руб)", "Осталось (руб)", "Дата"
+            ],
+            filename=f"unpaid_trips_{datetime.now().strftime('%Y-%m-%d')}",
             caption="Отчет по неоплаченным рейсам"
         )
     
@@ -838,9 +876,6 @@ async def export_debts(callback_query: types.CallbackQuery):
             callback_query.message.chat.id,
             f"❌ Ошибка при экспорте: {str(e)}"
         )
-    
-    finally:
-        conn.close()
 
 # Обработчик для возврата к главному меню
 @dp.callback_query_handler(lambda c: c.data == "back_to_main")
@@ -861,108 +896,106 @@ async def back_to_main_menu(callback_query: types.CallbackQuery):
     )
     await show_current_data(message)
 
-# Обработчик для отображения детального отчета
-@dp.callback_query_handler(lambda c: c.data == "detailed_report")
-async def show_detailed_report(callback_query: types.CallbackQuery):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
+# Общая статистика детального отчета
+async def get_detailed_report_totals():
+    # Неоплаченное - из сводки по водителям, всего - по индексу рейсов
+    unpaid_trips, unpaid_amount, partially_paid_amount = await db.fetchone("""
+    SELECT COALESCE(SUM(unpaid_count), 0), COALESCE(SUM(unpaid_amount), 0),
+           COALESCE(SUM(partial_amount), 0)
+    FROM driver_balances
+    """)
+    total_trips, total_amount = await db.fetchone(
+        "SELECT COUNT(*), COALESCE(SUM(total_payment), 0) FROM trips"
+    )
+    paid_trips = total_trips - unpaid_trips
+    paid_amount = total_amount - unpaid_amount - partially_paid_amount
+    
+    # Выплаты за неделю и месяц - по журналу выплат (диапазон индекса по paid_at)
+    now = datetime.utcnow()
+    end = (now + timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S')
+    _, week_paid = await db.fetchone(
+        PAYOUTS_FOR_RANGE, ((now - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S'), end)
+    )
+    _, month_paid = await db.fetchone(
+        PAYOUTS_FOR_RANGE, ((now - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S'), end)
+    )
     
-    try:
-        # Получаем статистику по водителям с учетом частичной оплаты
-        cursor.execute("""
-        SELECT d.name, 
-               COUNT(CASE WHEN t.paid = 0 THEN 1 ELSE NULL END) as unpaid_trips,
-               SUM(CASE WHEN t.paid = 0 THEN (t.total_payment - t.paid_amount) ELSE 0 END) as unpaid_amount,
-               SUM(CASE WHEN t.paid = 0 THEN t.paid_amount ELSE 0 END) as partially_paid_amount,
-               COUNT(CASE WHEN t.paid = 1 THEN 1 ELSE NULL END) as paid_trips,
-               SUM(CASE WHEN t.paid = 1 THEN t.total_payment ELSE 0 END) as paid_amount,
-               COUNT(t.id) as total_trips,
-               SUM(t.total_payment) as total_amount
-        FROM drivers d
-        LEFT JOIN trips t ON d.id = t.driver_id
-        GROUP BY d.id
-        ORDER BY unpaid_amount DESC
-        """)
-        
-        driver_stats = cursor.fetchall()
-        
-        if not driver_stats:
-            await bot.answer_callback_query(callback_query.id)
-            await bot.edit_message_text(
-                chat_id=callback_query.message.chat.id,
-                message_id=callback_query.message.message_id,
-                text="Нет данных для отчета."
-            )
-            conn.close()
-            return
-        
-        # Получаем общую статистику с учетом частичной оплаты
-        cursor.execute("""
-        SELECT COUNT(CASE WHEN paid = 0 THEN 1 ELSE NULL END) as unpaid_trips,
-               SUM(CASE WHEN paid = 0 THEN (total_payment - paid_amount) ELSE 0 END) as unpaid_amount,
-               SUM(CASE WHEN paid = 0 THEN paid_amount ELSE 0 END) as partially_paid_amount,
-               COUNT(CASE WHEN paid = 1 THEN 1 ELSE NULL END) as paid_trips,
-               SUM(CASE WHEN paid = 1 THEN total_payment ELSE 0 END) as paid_amount,
-               COUNT(id) as total_trips,
-               SUM(total_payment) as total_amount
+    return (
+        "📈 Общая статистика:\n"
+        f"• Всего рейсов: {total_trips}\n"
+        f"• Неоплаченных: {unpaid_trips} (долг: {int(unpaid_amount)} ₽)\n"
+        f"• Частично оплачено: {int(partially_paid_amount)} ₽\n"
+        f"• Полностью оплаченных: {paid_trips} ({int(paid_amount)} ₽)\n"
+        f"• Общая сумма: {int(total_amount)} ₽\n"
+        f"• Выплачено за 7 дней: {int(week_paid)} ₽, за 30 дней: {int(month_paid)} ₽\n\n"
+    )
+
+# Страница детального отчета: общая статистика (на первой странице) и водители с долгами
+async def render_detailed_page(page):
+    text = "📊 Детальный отчет по рейсам:\n\n"
+    
+    if page.is_first:
+        text += await get_detailed_report_totals()
+    
+    # Всего рейсов по водителям страницы; оплаченное = всего - неоплаченное
+    driver_ids = [row[0] for row in page.rows]
+    placeholders = ", ".join("?" * len(driver_ids))
+    totals = {
+        driver_id: (count, amount or 0)
+        for driver_id, count, amount in await db.fetchall(f"""
+        SELECT driver_id, COUNT(*), SUM(total_payment)
         FROM trips
-        """)
-        
-        total_stats = cursor.fetchone()
-        
-        # Формируем сообщение с отчетом
-        text = "📊 Детальный отчет по рейсам:\n\n"
-        
-        # Общая статистика
-        unpaid_trips, unpaid_amount, partially_paid_amount, paid_trips, paid_amount, total_trips, total_amount = total_stats
-        
-        if unpaid_amount is None:
-            unpaid_amount = 0
-        if partially_paid_amount is None:
-            partially_paid_amount = 0
-        if paid_amount is None:
-            paid_amount = 0
-        if total_amount is None:
-            total_amount = 0
+        WHERE driver_id IN ({placeholders})
+        GROUP BY driver_id
+        """, tuple(driver_ids))
+    }
+    
+    # Статистика по водителям
+    text += "👤 Статистика по водителям:\n\n"
+    
+    for driver_id, driver, unp_trips, unp_amount, part_paid in page.rows:
+        t_trips, t_amount = totals.get(driver_id, (0, 0))
+        p_trips = t_trips - unp_trips
+        p_amount = t_amount - unp_amount - part_paid
         
         text += (
-            "📈 Общая статистика:\n"
-            f"• Всего рейсов: {total_trips}\n"
-            f"• Неоплаченных: {unpaid_trips} (долг: {int(unpaid_amount)} ₽)\n"
-            f"• Частично оплачено: {int(partially_paid_amount)} ₽\n"
-            f"• Полностью оплаченных: {paid_trips} ({int(paid_amount)} ₽)\n"
-            f"• Общая сумма: {int(total_amount)} ₽\n\n"
-        )
-        
-        # Статистика по водителям
-        text += "👤 Статистика по водителям:\n\n"
-        
-        for driver, unp_trips, unp_amount, part_paid, p_trips, p_amount, t_trips, t_amount in driver_stats:
-            if unp_amount is None:
-                unp_amount = 0
-            if part_paid is None:
-                part_paid = 0
-            if p_amount is None:
-                p_amount = 0
-            if t_amount is None:
-                t_amount = 0
-            
-            if unp_trips and unp_trips > 0:
-                text += (
-                    f"🔹 {driver}:\n"
-                    f"• Неоплачено: {unp_trips} рейсов (долг: {int(unp_amount)} ₽)\n"
-                    f"• Частично оплачено: {int(part_paid)} ₽\n"
-                    f"• Полностью оплачено: {p_trips or 0} рейсов ({int(p_amount)} ₽)\n"
-                    f"• Всего: {t_trips} рейсов ({int(t_amount)} ₽)\n\n"
-                )
-        
-        # Разбиваем сообщение, если оно слишком длинное
-        if len(text) > 4096:
-            text = text[:4000] + "\n\n... (сообщение сокращено из-за лимитов Telegram)"
-        
-        keyboard = InlineKeyboardMarkup().add(
-            InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")
+            f"🔹 {driver}:\n"
+            f"• Неоплачено: {unp_trips} рейсов (долг: {int(unp_amount)} ₽)\n"
+            f"• Частично оплачено: {int(part_paid)} ₽\n"
+            f"• Полностью оплачено: {p_trips} рейсов ({int(p_amount)} ₽)\n"
+            f"• Всего: {t_trips} рейсов ({int(t_amount)} ₽)\n\n"
         )
+    return text, []
+
+# Водители с долгами по убыванию суммы долга
+detailed_report_list = PagedList(
+    'detailed',
+    columns="d.id, d.name, b.unpaid_count, b.unpaid_amount, b.partial_amount",
+    tables="driver_balances b JOIN drivers d ON d.id = b.driver_id",
+    where="b.unpaid_count > 0",
+    key=('b.unpaid_amount', 'b.driver_id'),
+    render=render_detailed_page,
+    page_size=5,
+    cached=True,
+    footer=[("◀️ Назад", "back_to_main")]
+)
+
+# Обработчик для отображения детального отчета
+@dp.callback_query_handler(lambda c: c.data == "detailed_report")
+async def show_detailed_report(callback_query: types.CallbackQuery):
+    try:
+        text, keyboard = await detailed_report_list.render_page()
+        
+        if text is None:
+            # Долгов нет - только общая статистика
+            text = (
+                "📊 Детальный отчет по рейсам:\n\n"
+                + await get_detailed_report_totals()
+                + "Задолженностей по водителям нет."
+            )
+            keyboard = InlineKeyboardMarkup().add(
+                InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")
+            )
         
         await bot.answer_callback_query(callback_query.id)
         await bot.edit_message_text(
@@ -979,25 +1012,38 @@ async def show_detailed_report(callback_query: types.CallbackQuery):
             callback_query.message.chat.id,
             f"❌ Ошибка при формировании отчета: {str(e)}"
         )
-    
-    finally:
-        conn.close()
 
 # Обработчик для ручного ввода ID рейса для оплаты
 @dp.message_handler(lambda message: message.text == "✅ Отметить рейс оплаченным")
+@requires_role(1)
 async def mark_trip_paid_cmd(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     await message.answer("Введите ID рейса, который нужно отметить как оплаченный:")
     await PaymentStates.waiting_for_trip_id.set()
+
+# Отметка рейса по ID как оплаченного
+def _mark_trip_paid_by_id(cursor, trip_id, user_id):
+    # Проверяем существование рейса
+    cursor.execute("""
+    SELECT t.id, d.name, t.loading_city, t.unloading_city, t.total_payment, t.paid
+    FROM trips t
+    JOIN drivers d ON t.driver_id = d.id
+    WHERE t.id = ?
+    """, (trip_id,))
+    
+    trip = cursor.fetchone()
+    
+    if not trip:
+        return None
     
-    conn.close()
+    _, driver_name, load_city, unload_city, payment, paid = trip
+    
+    if paid == 1:
+        return trip
+    
+    # Выплачиваем остаток и отмечаем рейс как оплаченный
+    settle_trip(cursor, trip_id, user_id)
+    
+    return trip
 
 # Обработчик ввода ID рейса
 @dp.message_handler(state=PaymentStates.waiting_for_trip_id)
@@ -1008,23 +1054,11 @@ async def process_trip_id(message: types.Message, state: FSMContext):
         await message.answer("Некорректный ID рейса. Пожалуйста, введите число.")
         return
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Проверяем существование рейса
-    cursor.execute("""
-    SELECT t.id, d.name, t.loading_city, t.unloading_city, t.total_payment, t.paid
-    FROM trips t
-    JOIN drivers d ON t.driver_id = d.id
-    WHERE t.id = ?
-    """, (trip_id,))
-    
-    trip = cursor.fetchone()
+    trip = await db.transaction(_mark_trip_paid_by_id, trip_id, message.from_user.id)
     
     if not trip:
         await message.answer(f"Рейс с ID {trip_id} не найден.")
         await state.finish()
-        conn.close()
         return
     
     _, driver_name, load_city, unload_city, payment, paid = trip
@@ -1032,25 +1066,15 @@ async def process_trip_id(message: types.Message, state: FSMContext):
     if paid == 1:
         await message.answer(f"Рейс #{trip_id} уже отмечен как оплаченный.")
         await state.finish()
-        conn.close()
         return
     
-    # Отмечаем рейс как оплаченный
-    cursor.execute("UPDATE trips SET paid = 1 WHERE id = ?", (trip_id,))
-    
     # Логируем действие
-    cursor.execute(
-        "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-        (
-            message.from_user.id,
-            "Отметка рейса как оплаченного",
-            f"Рейс #{trip_id}: {driver_name}, {load_city}-{unload_city}, {payment} руб."
-        )
+    await audit(
+        message.from_user.id,
+        "Отметка рейса как оплаченного",
+        f"Рейс #{trip_id}: {driver_name}, {load_city}-{unload_city}, {payment} руб."
     )
     
-    conn.commit()
-    conn.close()
-    
     await message.answer(
         f"✅ Рейс #{trip_id} отмечен как оплаченный!\n\n"
         f"👤 Водитель: {driver_name}\n"
@@ -0,0 +1,283 @@
+import csv
+import io
+from collections import defaultdict
+from datetime import datetime
+
+from ledger import add_trips_to_balance
+from payroll import calculate_trip_payment
+from rates import rate_day, rate_index
+from routes import record_routes
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Импорт рейсов из выгрузки 1С (CSV или XLSX). Файл читается построчно,
+# водители и автопоезда сверяются со справочниками в памяти, оплата считается
+# той же формулой, что и при вводе рейса вручную, по ставкам водителя на дату
+# рейса (история ставок, rates.py). Корректные строки
+# записываются разом (executemany) в одной транзакции вместе с простоями,
+# строки с ошибками пропускаются и попадают в отчет.
+
+IMPORT_MAX_ROWS = 20000  # Строк в одном файле
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024  # Лимит Telegram на скачивание файла ботом
+
+# Колонки файла: поле -> допустимые заголовки (без учета регистра)
+IMPORT_COLUMNS = {
+    'trip_1c_number': ['номер рейса', 'номер', 'рейс', 'номер 1с', 'номер рейса 1с'],
+    'date': ['дата', 'дата рейса'],
+    'driver': ['водитель', 'фио водителя'],
+    'truck': ['тягач', 'автопоезд', 'номер тягача', 'госномер'],
+    'loading_city': ['погрузка', 'город погрузки', 'пункт погрузки'],
+    'unloading_city': ['разгрузка', 'город разгрузки', 'пункт разгрузки'],
+    'distance': ['расстояние', 'км', 'пробег'],
+    'side_loading': ['боковой тент', 'боковые погрузки', 'погрузки бокового тента'],
+    'roof_loading': ['крыша', 'погрузки через крышу'],
+    'regular_downtime': ['простой', 'обычный простой'],
+    'forced_downtime': ['вынужденный простой'],
+}
+REQUIRED_COLUMNS = ['driver', 'loading_city', 'unloading_city', 'distance']
+
+DATE_FORMATS = ['%d.%m.%Y', '%d.%m.%Y %H:%M', '%d.%m.%Y %H:%M:%S', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S']
+
+# Ошибка всего файла (формат, заголовки) - импорт не начинается
+class ImportFileError(Exception):
+    pass
+
+def _normalize_name(value):
+    return " ".join(str(value).lower().replace('ё', 'е').split())
+
+def _normalize_truck(value):
+    return "".join(str(value).upper().split())
+
+def _header_map(header):
+    aliases = {alias: field for field, names in IMPORT_COLUMNS.items() for alias in names}
+    columns = {}
+    for index, title in enumerate(header):
+        field = aliases.get(_normalize_name(title or ''))
+        if field and field not in columns:
+            columns[field] = index
+
+    missing = [IMPORT_COLUMNS[field][0] for field in REQUIRED_COLUMNS if field not in columns]
+    if missing:
+        raise ImportFileError("Нет обязательных колонок: " + ", ".join(missing))
+    return columns
+
+def _csv_rows(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    try:
+        sample = text.readline()
+        dialect = csv.Sniffer().sniff(sample, delimiters=';,\t')
+    except (csv.Error, UnicodeDecodeError):
+        raise ImportFileError("Не удалось прочитать CSV: нужен файл в UTF-8 с разделителем ';' или ','")
+    yield next(csv.reader([sample], dialect))
+    for row in csv.reader(text, dialect):
+        yield row
+
+def _xlsx_rows(fileobj):
+    if openpyxl is None:
+        raise ImportFileError("Импорт XLSX недоступен (не установлен openpyxl), загрузите CSV")
+    try:
+        workbook = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    except Exception:
+        raise ImportFileError("Не удалось открыть XLSX файл")
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield row
+    finally:
+        workbook.close()
+
+# Строки файла по порядку: (номер строки в файле, {поле: значение})
+def read_import_rows(fileobj, filename):
+    if filename.lower().endswith('.xlsx'):
+        rows = _xlsx_rows(fileobj)
+    elif filename.lower().endswith('.csv'):
+        rows = _csv_rows(fileobj)
+    else:
+        raise ImportFileError("Поддерживаются только файлы .csv и .xlsx")
+
+    header = next(rows, None)
+    if header is None:
+        raise ImportFileError("Файл пуст")
+    columns = _header_map(header)
+
+    for line, row in enumerate(rows, start=2):
+        if not any(value not in (None, '') for value in row):
+            continue
+        yield line, {
+            field: row[index] if index < len(row) else None
+            for field, index in columns.items()
+        }
+
+def _number(value, name, integer=False):
+    if value is None or value == '':
+        return 0
+    if isinstance(value, (int, float)):
+        number = value
+    else:
+        try:
+            number = float(str(value).replace('\xa0', '').replace(' ', '').replace(',', '.'))
+        except ValueError:
+            raise ValueError(f"{name}: не число ({value})")
+    if number < 0:
+        raise ValueError(f"{name}: отрицательное значение")
+    if integer:
+        if number != int(number):
+            raise ValueError(f"{name}: должно быть целым")
+        return int(number)
+    return number
+
+def _timestamp(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), date_format).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f"дата: неизвестный формат ({value})")
+
+def _load_drivers(cursor):
+    cursor.execute("SELECT id, name, vehicle_id FROM drivers")
+    drivers = {}
+    for row in cursor.fetchall():
+        key = _normalize_name(row[1])
+        # Однофамильцы с одинаковым ФИО - строку нельзя отнести к водителю
+        drivers[key] = None if key in drivers else {
+            'id': row[0],
+            'vehicle_id': row[2],
+        }
+    return drivers
+
+def _load_vehicles(cursor):
+    cursor.execute("SELECT id, truck_number FROM vehicles")
+    return {_normalize_truck(truck): vehicle_id for vehicle_id, truck in cursor.fetchall()}
+
+# Проверить строку и посчитать оплату: (рейс, простои) для вставки
+def _prepare_trip(values, drivers, vehicles, rates):
+    driver_name = _normalize_name(values.get('driver') or '')
+    if not driver_name:
+        raise ValueError("не указан водитель")
+    if driver_name not in drivers:
+        raise ValueError(f"водитель не найден ({values['driver']})")
+    driver = drivers[driver_name]
+    if driver is None:
+        raise ValueError(f"несколько водителей с именем {values['driver']}")
+
+    vehicle_id = driver['vehicle_id']
+    if values.get('truck'):
+        vehicle_id = vehicles.get(_normalize_truck(values['truck']))
+        if vehicle_id is None:
+            raise ValueError(f"автопоезд не найден ({values['truck']})")
+    if vehicle_id is None:
+        raise ValueError("не указан автопоезд, и к водителю он не привязан")
+
+    loading_city = str(values.get('loading_city') or '').strip()
+    unloading_city = str(values.get('unloading_city') or '').strip()
+    if not loading_city or not unloading_city:
+        raise ValueError("не указан город погрузки или разгрузки")
+
+    distance = _number(values.get('distance'), "расстояние")
+    if distance <= 0:
+        raise ValueError("расстояние должно быть больше нуля")
+    side_loading = _number(values.get('side_loading'), "боковой тент", integer=True)
+    roof_loading = _number(values.get('roof_loading'), "крыша", integer=True)
+    regular_downtime = _number(values.get('regular_downtime'), "простой")
+    forced_downtime = _number(values.get('forced_downtime'), "вынужденный простой")
+
+    created_at = _timestamp(values.get('date'))
+    driver_rates = rates.rates_on(driver['id'], rate_day(created_at))
+    if driver_rates is None:
+        raise ValueError("нет ставок водителя на дату рейса")
+
+    payment = calculate_trip_payment(
+        driver_rates, distance, side_loading, roof_loading, regular_downtime, forced_downtime
+    )
+    number = values.get('trip_1c_number')
+    trip = (
+        driver['id'], vehicle_id, loading_city, unloading_city, distance,
+        side_loading, roof_loading, payment['total'],
+        str(number).strip() if number not in (None, '') else '',
+        created_at,
+    )
+    downtimes = []
+    if regular_downtime > 0:
+        downtimes.append((1, regular_downtime, payment['regular_downtime_payment']))
+    if forced_downtime > 0:
+        downtimes.append((2, forced_downtime, payment['forced_downtime_payment']))
+    return trip, downtimes
+
+def _insert_trips(cursor, trips):
+    insert = """
+    INSERT INTO trips
+    (driver_id, vehicle_id, loading_city, unloading_city, distance,
+     side_loading_count, roof_loading_count, total_payment, trip_1c_number, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+    """
+    # Первая вставка берет блокировку записи, поэтому остальные рейсы
+    # получают id подряд (AUTOINCREMENT) и простои можно связать без lastrowid
+    cursor.execute(insert, trips[0][0])
+    first_id = cursor.lastrowid
+    cursor.executemany(insert, [trip for trip, _ in trips[1:]])
+    cursor.execute("SELECT MAX(id) FROM trips")
+    if cursor.fetchone()[0] != first_id + len(trips) - 1:
+        raise RuntimeError("Рейсы получили id не подряд, импорт отменен")
+
+    cursor.executemany(
+        "INSERT INTO downtimes (trip_id, type, hours, payment, created_at) "
+        "VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+        [
+            (first_id + offset, downtime_type, hours, payment, trip[9])
+            for offset, (trip, downtimes) in enumerate(trips)
+            for downtime_type, hours, payment in downtimes
+        ]
+    )
+
+    # Новые рейсы не оплачены - сводка долгов растет на их суммы
+    balances = defaultdict(lambda: [0, 0.0])
+    for trip, _ in trips:
+        balances[trip[0]][0] += 1
+        balances[trip[0]][1] += trip[7]
+    for driver_id, (count, amount) in balances.items():
+        add_trips_to_balance(cursor, driver_id, count, amount)
+
+    # Расстояния новых рейсов - в справочник маршрутов
+    record_routes(cursor, [(trip[2], trip[3], trip[4]) for trip, _ in trips])
+    return first_id
+
+# Импорт в потоке БД (через db.transaction). Строки с номером 1С, который уже
+# есть в базе или выше в файле, пропускаются - файл можно загрузить повторно.
+# Возвращает (добавлено рейсов, пропущено дублей, [(строка, ошибка)])
+def import_trips(cursor, rows):
+    drivers = _load_drivers(cursor)
+    vehicles = _load_vehicles(cursor)
+    rates = rate_index.snapshot(cursor)
+    cursor.execute("SELECT trip_1c_number FROM trips WHERE trip_1c_number IS NOT NULL AND trip_1c_number != ''")
+    known_numbers = {row[0] for row in cursor.fetchall()}
+
+    trips = []
+    errors = []
+    duplicates = 0
+    for line, values in rows:
+        if len(trips) + len(errors) + duplicates >= IMPORT_MAX_ROWS:
+            raise ImportFileError(f"В файле больше {IMPORT_MAX_ROWS} строк, разделите его на части")
+        try:
+            trip, downtimes = _prepare_trip(values, drivers, vehicles, rates)
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+
+        number = trip[8]
+        if number:
+            if number in known_numbers:
+                duplicates += 1
+                continue
+            known_numbers.add(number)
+        trips.append((trip, downtimes))
+
+    if trips:
+        _insert_trips(cursor, trips)
+    return len(trips), duplicates, errors
@@ -2,12 +2,24 @@ from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from bot import dp, bot, check_user_access, get_editor_keyboard, get_viewer_keyboard, get_admin_keyboard
-import sqlite3
+from bot import dp, bot, requires_role, get_main_keyboard, get_editor_keyboard, get_viewer_keyboard, parse_period, PERIOD_FORMAT_HINT
+from audit import audit
+from database import db
+from export import EXPORT_SPOOL_SIZE
+from export_jobs import submit_export
+from ledger import apply_trip_change, trip_snapshot
+from paging import PagedList
+from pickers import Picker, get_directory
+from cities import city_index, load_city_index
+from payroll import calculate_trip_payment
+from rates import driver_rates_on
+from routes import ROUTE_QUERY, is_unusual_distance, record_route, replace_route_trip, route_key
+from report_cache import cached_report
+from trip_import import IMPORT_MAX_FILE_SIZE, ImportFileError, import_trips, read_import_rows
+from rollup import DRIVER_STATS_FOR_RANGE
 from datetime import datetime, timedelta
-import io
-import csv
 import logging
+import tempfile
 
 
 # Настройка расширенного логирования
@@ -32,7 +44,8 @@ def get_trips_menu():
         types.KeyboardButton("🗂️ История рейсов")
     )
     keyboard.add(
-        types.KeyboardButton("📊 Статистика водителей")
+        types.KeyboardButton("📊 Статистика водителей"),
+        types.KeyboardButton("📥 Импорт из 1С")
     )
     keyboard.add(types.KeyboardButton("↩️ Назад в главное меню"))
     return keyboard
@@ -44,20 +57,8 @@ async def show_trips_menu(message: types.Message):
 
 # Обработчик для кнопки "Назад в главное меню"
 @dp.message_handler(lambda message: message.text == "↩️ Назад в главное меню")
-async def back_to_main_menu(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (message.from_user.id,))
-    user_role = cursor.fetchone()
-    conn.close()
-    
-    if user_role and user_role[0] == 0:  # Администратор
-        await message.answer("Главное меню:", reply_markup=get_admin_keyboard())
-    elif user_role and user_role[0] == 1:  # Редактор
-        await message.answer("Главное меню:", reply_markup=get_editor_keyboard())
-    else:  # Просмотрщик
-        await message.answer("Главное меню:", reply_markup=get_viewer_keyboard())
+async def back_to_main_menu(message: types.Message, role):
+    await message.answer("Главное меню:", reply_markup=get_main_keyboard(role))
 
 
 
@@ -89,31 +90,6 @@ class DowntimeStates(StatesGroup):
     waiting_for_hours = State()
     waiting_for_confirmation = State()
 
-# Функция расчета стоимости рейса
-def calculate_trip_payment(driver_data, distance, side_loading, roof_loading, reg_downtime=0, forced_downtime=0):
-    # Расчет за километры
-    km_payment = distance * driver_data['km_rate']
-    
-    # Расчет за погрузку/разгрузку
-    side_loading_payment = side_loading * driver_data['side_loading_rate']
-    roof_loading_payment = roof_loading * driver_data['roof_loading_rate']
-    
-    # Расчет за простои
-    regular_downtime_payment = reg_downtime * driver_data['regular_downtime_rate']
-    forced_downtime_payment = forced_downtime * driver_data['forced_downtime_rate']
-    
-    # Общая сумма
-    total = km_payment + side_loading_payment + roof_loading_payment + regular_downtime_payment + forced_downtime_payment
-    
-    return {
-        'km_payment': km_payment,
-        'side_loading_payment': side_loading_payment,
-        'roof_loading_payment': roof_loading_payment,
-        'regular_downtime_payment': regular_downtime_payment,
-        'forced_downtime_payment': forced_downtime_payment,
-        'total': total
-    }
-
 # Функция для создания навигационных кнопок (Назад/Отмена)
 def get_navigation_keyboard():
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -123,23 +99,24 @@ def get_navigation_keyboard():
     )
     return keyboard
 
+# Клавиатуры выбора водителя и автопоезда (справочники в памяти, по буквам и страницам)
+trip_driver_picker = Picker(
+    'trip_driver', 'drivers', "driver_{id}",
+    footer=[("❌ Отмена", "trip_cancel")]  # Только отмена, т.к. это первый шаг
+)
+trip_vehicle_picker = Picker(
+    'trip_vehicle', 'vehicles', "vehicle_{id}",
+    footer=[("⬅️ Назад", "trip_back"), ("❌ Отмена", "trip_cancel")]
+)
+
 # Обработчик для добавления рейса
 @dp.message_handler(lambda message: message.text == "➕ Добавить рейс")
+@requires_role(1)
 async def add_trip(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     # Проверяем наличие водителей и автопоездов
-    cursor.execute("SELECT COUNT(*) FROM drivers")
-    drivers_count = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM vehicles")
-    vehicles_count = cursor.fetchone()[0]
+    snapshot = await get_directory()
+    drivers_count = snapshot.count('drivers')
+    vehicles_count = snapshot.count('vehicles')
     
     if drivers_count == 0 or vehicles_count == 0:
         missing = []
@@ -149,37 +126,19 @@ async def add_trip(message: types.Message):
             missing.append("автопоезда")
         
         await message.answer(f"Невозможно создать рейс. Отсутствуют: {', '.join(missing)}.")
-        conn.close()
         return
     
     # Создаем клавиатуру с водителями и навигационными кнопками
-    cursor.execute("SELECT id, name FROM drivers ORDER BY name")
-    drivers = cursor.fetchall()
-    
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    for driver_id, name in drivers:
-        keyboard.add(InlineKeyboardButton(f"{name}", callback_data=f"driver_{driver_id}"))
-    
-    # Добавляем только кнопку отмены, т.к. это первый шаг
-    keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data="trip_cancel"))
+    keyboard = trip_driver_picker.keyboard(snapshot)
     
     await message.answer("Выберите водителя:", reply_markup=keyboard)
     await TripStates.waiting_for_driver.set()
-    
-    conn.close()
 
 # Обработчик для кнопок навигации
 @dp.callback_query_handler(lambda c: c.data in ["trip_back", "trip_cancel"], state="*")
-async def process_navigation(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_navigation(callback_query: types.CallbackQuery, state: FSMContext, role):
     current_state = await state.get_state()
     
-    # Проверяем роль пользователя и показываем соответствующую клавиатуру
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (callback_query.from_user.id,))
-    user_role = cursor.fetchone()
-    
     if callback_query.data == "trip_cancel":
         # Отмена и возврат в главное меню
         await state.finish()
@@ -190,44 +149,20 @@ async def process_navigation(callback_query: types.CallbackQuery, state: FSMCont
             reply_markup=None
         )
         
-        # Определяем, какую клавиатуру показать
-        if user_role and user_role[0] == 0:  # Администратор
-            await bot.send_message(
-                callback_query.message.chat.id,
-                "Главное меню:",
-                reply_markup=get_admin_keyboard()
-            )
-        elif user_role and user_role[0] == 1:  # Редактор
-            await bot.send_message(
-                callback_query.message.chat.id,
-                "Главное меню:",
-                reply_markup=get_editor_keyboard()
-            )
-        else:  # Просмотрщик
-            await bot.send_message(
-                callback_query.message.chat.id,
-                "Главное меню:", 
-                reply_markup=get_viewer_keyboard()
-            )
+        # Показываем клавиатуру по роли пользователя
+        await bot.send_message(
+            callback_query.message.chat.id,
+            "Главное меню:",
+            reply_markup=get_main_keyboard(role)
+        )
         
-        conn.close()
         return
     
     elif callback_query.data == "trip_back":
         # Возврат на предыдущий шаг
         if current_state == "TripStates:waiting_for_vehicle":
             # Возврат к выбору водителя
-            conn = sqlite3.connect('salary_bot.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT id, name FROM drivers ORDER BY name")
-            drivers = cursor.fetchall()
-            
-            keyboard = InlineKeyboardMarkup(row_width=1)
-            for driver_id, name in drivers:
-                keyboard.add(InlineKeyboardButton(f"{name}", callback_data=f"driver_{driver_id}"))
-            
-            keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data="trip_cancel"))
+            keyboard, _ = await trip_driver_picker.markup()
             
             await bot.edit_message_text(
                 chat_id=callback_query.message.chat.id,
@@ -237,26 +172,12 @@ async def process_navigation(callback_query: types.CallbackQuery, state: FSMCont
             )
             
             await TripStates.waiting_for_driver.set()
-            conn.close()
             
         elif current_state == "TripStates:waiting_for_trip_1c_number":
             # Возврат к выбору автопоезда
-            conn = sqlite3.connect('salary_bot.db')
-            cursor = conn.cursor()
-            
             data = await state.get_data()
             
-            cursor.execute("SELECT id, truck_number, trailer_number FROM vehicles ORDER BY truck_number")
-            vehicles = cursor.fetchall()
-            
-            keyboard = InlineKeyboardMarkup(row_width=1)
-            for vehicle_id, truck, trailer in vehicles:
-                keyboard.add(InlineKeyboardButton(f"{truck} / {trailer}", callback_data=f"vehicle_{vehicle_id}"))
-            
-            keyboard.add(
-                InlineKeyboardButton("⬅️ Назад", callback_data="trip_back"),
-                InlineKeyboardButton("❌ Отмена", callback_data="trip_cancel")
-            )
+            keyboard, _ = await trip_vehicle_picker.markup()
             
             await bot.edit_message_text(
                 chat_id=callback_query.message.chat.id,
@@ -266,7 +187,6 @@ async def process_navigation(callback_query: types.CallbackQuery, state: FSMCont
             )
             
             await TripStates.waiting_for_vehicle.set()
-            conn.close()
             
         elif current_state == "TripStates:waiting_for_loading_city":
             # Возврат к вводу номера рейса из 1С
@@ -310,12 +230,13 @@ async def process_navigation(callback_query: types.CallbackQuery, state: FSMCont
         elif current_state == "TripStates:waiting_for_side_loading":
             # Возврат к вводу расстояния
             data = await state.get_data()
+            text, keyboard = await _distance_prompt(state, data)
             
             await bot.edit_message_text(
                 chat_id=callback_query.message.chat.id,
                 message_id=callback_query.message.message_id,
-                text=f"Город разгрузки: {data.get('unloading_city', '')}\nВведите расстояние в километрах (только число):",
-                reply_markup=get_navigation_keyboard()
+                text=text,
+                reply_markup=keyboard
             )
             
             await TripStates.waiting_for_distance.set()
@@ -371,8 +292,6 @@ async def process_navigation(callback_query: types.CallbackQuery, state: FSMCont
             )
             
             await TripStates.waiting_for_forced_downtime.set()
-    
-    conn.close()
         
 # Обработчик выбора водителя
 @dp.callback_query_handler(lambda c: c.data.startswith('driver_'), state=TripStates.waiting_for_driver)
@@ -380,11 +299,8 @@ async def process_driver_selection(callback_query: types.CallbackQuery, state: F
     logging.info(f"Обработка выбора водителя: {callback_query.data}")
     driver_id = int(callback_query.data.split('_')[1])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     # Получаем данные о водителе
-    cursor.execute(
+    driver_data = await db.fetchone(
         """
         SELECT name, km_rate, side_loading_rate, roof_loading_rate, 
                regular_downtime_rate, forced_downtime_rate
@@ -392,7 +308,6 @@ async def process_driver_selection(callback_query: types.CallbackQuery, state: F
         """, 
         (driver_id,)
     )
-    driver_data = cursor.fetchone()
     
     await state.update_data(
         driver_id=driver_id,
@@ -405,18 +320,7 @@ async def process_driver_selection(callback_query: types.CallbackQuery, state: F
     )
     
     # Создаем клавиатуру с автопоездами и навигационными кнопками
-    cursor.execute("SELECT id, truck_number, trailer_number FROM vehicles ORDER BY truck_number")
-    vehicles = cursor.fetchall()
-    
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    for vehicle_id, truck, trailer in vehicles:
-        keyboard.add(InlineKeyboardButton(f"{truck} / {trailer}", callback_data=f"vehicle_{vehicle_id}"))
-    
-    # Добавляем навигационные кнопки
-    keyboard.add(
-        InlineKeyboardButton("⬅️ Назад", callback_data="trip_back"),
-        InlineKeyboardButton("❌ Отмена", callback_data="trip_cancel")
-    )
+    keyboard, _ = await trip_vehicle_picker.markup()
     
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
@@ -426,20 +330,16 @@ async def process_driver_selection(callback_query: types.CallbackQuery, state: F
     )
     
     await TripStates.waiting_for_vehicle.set()
-    conn.close()
 
 # Обработчик выбора автопоезда
 @dp.callback_query_handler(lambda c: c.data.startswith('vehicle_'), state=TripStates.waiting_for_vehicle)
 async def process_vehicle_selection(callback_query: types.CallbackQuery, state: FSMContext):
     vehicle_id = int(callback_query.data.split('_')[1])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     # Получаем данные об автопоезде
-    cursor.execute("SELECT truck_number, trailer_number FROM vehicles WHERE id = ?", (vehicle_id,))
-    truck_number, trailer_number = cursor.fetchone()
-    conn.close()
+    truck_number, trailer_number = await db.fetchone(
+        "SELECT truck_number, trailer_number FROM vehicles WHERE id = ?", (vehicle_id,)
+    )
     
     await state.update_data(
         vehicle_id=vehicle_id,
@@ -466,43 +366,141 @@ async def process_trip_1c_number(message: types.Message, state: FSMContext):
     
         # Отправляем новое сообщение с кнопками навигации
     keyboard = get_navigation_keyboard()
-    sent_message = await message.answer(f"Номер рейса из 1С: {trip_1c_number}\nВведите город погрузки:", reply_markup=keyboard)
+    sent_message = await message.answer(
+        f"Номер рейса из 1С: {trip_1c_number}\nВведите город погрузки (достаточно первых букв):",
+        reply_markup=keyboard
+    )
     
     await TripStates.waiting_for_loading_city.set()
 
-# Обработчик ввода города погрузки
-@dp.message_handler(state=TripStates.waiting_for_loading_city)
-async def process_loading_city(message: types.Message, state: FSMContext):
-    loading_city = message.text.strip()
-    
-    if not loading_city:
-        await message.answer("Пожалуйста, введите корректное название города погрузки.")
-        return
-    
+# Город из введенного текста: известный город - в принятом написании;
+# иначе подсказки кнопками (первые буквы, опечатки). Возвращает город или
+# None, если отправлены подсказки
+async def _resolve_city(message, state):
+    if not city_index.loaded:
+        await db.run(load_city_index)
+    
+    text = message.text.strip()
+    canonical = city_index.canonical(text)
+    if canonical:
+        return canonical
+    
+    suggestions = city_index.suggest(text)
+    if not suggestions:
+        return text
+    
+    await state.update_data(city_text=text, city_suggestions=suggestions)
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.add(*[
+        InlineKeyboardButton(city, callback_data=f"city_pick_{index}")
+        for index, city in enumerate(suggestions)
+    ])
+    keyboard.row(InlineKeyboardButton(f"✏️ Оставить «{text}»", callback_data="city_pick_keep"))
+    keyboard.row(
+        InlineKeyboardButton("⬅️ Назад", callback_data="trip_back"),
+        InlineKeyboardButton("❌ Отмена", callback_data="trip_cancel")
+    )
+    await message.answer("Выберите город из уже встречавшихся в рейсах:", reply_markup=keyboard)
+    return None
+
+async def _accept_loading_city(chat_id, state, loading_city):
     await state.update_data(loading_city=loading_city)
     
     # Отправляем новое сообщение с кнопками навигации
     keyboard = get_navigation_keyboard()
-    await message.answer(f"Город погрузки: {loading_city}\nВведите город разгрузки:", reply_markup=keyboard)
+    await bot.send_message(chat_id, f"Город погрузки: {loading_city}\nВведите город разгрузки:", reply_markup=keyboard)
     
     await TripStates.waiting_for_unloading_city.set()
 
+# Кнопки навигации под кнопками расстояний
+def _distance_keyboard(buttons):
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.row(*buttons)
+    keyboard.row(
+        InlineKeyboardButton("⬅️ Назад", callback_data="trip_back"),
+        InlineKeyboardButton("❌ Отмена", callback_data="trip_cancel")
+    )
+    return keyboard
+
+# Запрос расстояния: для известного маршрута обычное и последнее расстояние
+# предлагаются кнопками, а сам маршрут запоминается для проверки ввода
+async def _distance_prompt(state, data):
+    route = await db.fetchone(ROUTE_QUERY, route_key(data.get('loading_city'), data.get('unloading_city')))
+    await state.update_data(route=list(route) if route else None, unusual_distance=None)
+    
+    text = f"Город разгрузки: {data.get('unloading_city', '')}\nВведите расстояние в километрах (только число):"
+    if not route:
+        return text, get_navigation_keyboard()
+    
+    trips_count, median_distance, last_distance = route
+    text += f"\n\n📏 Обычно на этом маршруте {median_distance:g} км (рейсов: {trips_count}, последний раз {last_distance:g} км)."
+    buttons = [InlineKeyboardButton(f"✅ {median_distance:g} км", callback_data=f"route_distance_{median_distance}")]
+    if last_distance != median_distance:
+        buttons.append(InlineKeyboardButton(f"🕘 {last_distance:g} км", callback_data=f"route_distance_{last_distance}"))
+    return text, _distance_keyboard(buttons)
+
+async def _accept_unloading_city(chat_id, state, unloading_city):
+    await state.update_data(unloading_city=unloading_city)
+    text, keyboard = await _distance_prompt(state, await state.get_data())
+    
+    # Отправляем новое сообщение с кнопками навигации
+    await bot.send_message(chat_id, text, reply_markup=keyboard)
+    
+    await TripStates.waiting_for_distance.set()
+
+# Обработчик ввода города погрузки
+@dp.message_handler(state=TripStates.waiting_for_loading_city)
+async def process_loading_city(message: types.Message, state: FSMContext):
+    if not message.text.strip():
+        await message.answer("Пожалуйста, введите корректное название города погрузки.")
+        return
+    
+    loading_city = await _resolve_city(message, state)
+    if loading_city:
+        await _accept_loading_city(message.chat.id, state, loading_city)
+
 # Обработчик ввода города разгрузки
 @dp.message_handler(state=TripStates.waiting_for_unloading_city)
 async def process_unloading_city(message: types.Message, state: FSMContext):
-    unloading_city = message.text.strip()
-    
-    if not unloading_city:
+    if not message.text.strip():
         await message.answer("Пожалуйста, введите корректное название города разгрузки.")
         return
     
-    await state.update_data(unloading_city=unloading_city)
-        
-    # Отправляем новое сообщение с кнопками навигации
-    keyboard = get_navigation_keyboard()
-    await message.answer(f"Город разгрузки: {unloading_city}\nВведите расстояние в километрах (только число):", reply_markup=keyboard)
+    unloading_city = await _resolve_city(message, state)
+    if unloading_city:
+        await _accept_unloading_city(message.chat.id, state, unloading_city)
+
+# Обработчик выбора города из подсказок
+@dp.callback_query_handler(
+    lambda c: c.data.startswith('city_pick_'),
+    state=[TripStates.waiting_for_loading_city, TripStates.waiting_for_unloading_city]
+)
+async def process_city_pick(callback_query: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    choice = callback_query.data.split('_')[2]
+    suggestions = data.get('city_suggestions', [])
     
-    await TripStates.waiting_for_distance.set()
+    if choice == 'keep':
+        city = data.get('city_text')
+    elif int(choice) < len(suggestions):
+        city = suggestions[int(choice)]
+    else:
+        city = None
+    
+    await bot.answer_callback_query(callback_query.id)
+    if not city:
+        await bot.send_message(callback_query.message.chat.id, "Подсказки устарели, введите город снова.")
+        return
+    
+    await bot.edit_message_reply_markup(
+        chat_id=callback_query.message.chat.id,
+        message_id=callback_query.message.message_id,
+        reply_markup=None
+    )
+    if await state.get_state() == "TripStates:waiting_for_loading_city":
+        await _accept_loading_city(callback_query.message.chat.id, state, city)
+    else:
+        await _accept_unloading_city(callback_query.message.chat.id, state, city)
 
 # Обработчик ввода расстояния
 @dp.message_handler(state=TripStates.waiting_for_distance)
@@ -519,14 +517,56 @@ async def process_distance(message: types.Message, state: FSMContext):
         await message.answer("Пожалуйста, введите корректное число. Введите расстояние снова.")
         return
     
-    await state.update_data(distance=distance)
+    # Расстояние, далекое от обычного для маршрута, переспрашиваем;
+    # повторный ввод того же числа - подтверждение
+    data = await state.get_data()
+    route = data.get('route')
+    if is_unusual_distance(route, distance) and data.get('unusual_distance') != distance:
+        await state.update_data(unusual_distance=distance)
+        keyboard = _distance_keyboard([
+            InlineKeyboardButton(f"✅ Оставить {distance:g} км", callback_data="route_distance_keep"),
+            InlineKeyboardButton(f"📏 {route[1]:g} км", callback_data=f"route_distance_{route[1]}")
+        ])
+        await message.answer(
+            f"⚠️ {distance:g} км заметно отличается от обычного для маршрута "
+            f"({route[1]:g} км, рейсов: {route[0]}).\n"
+            f"Подтвердите расстояние, выберите обычное или введите другое:",
+            reply_markup=keyboard
+        )
+        return
+    
+    await _accept_distance(message.chat.id, state, distance)
+
+async def _accept_distance(chat_id, state, distance):
+    await state.update_data(distance=distance, unusual_distance=None)
     
     # Отправляем новое сообщение с кнопками навигации
     keyboard = get_navigation_keyboard()
-    await message.answer(f"Расстояние: {distance} км\nВведите количество боковых загрузок (число от 0):", reply_markup=keyboard)
+    await bot.send_message(chat_id, f"Расстояние: {distance} км\nВведите количество боковых загрузок (число от 0):", reply_markup=keyboard)
     
     await TripStates.waiting_for_side_loading.set()
 
+# Обработчик кнопок расстояния маршрута (обычное, последнее, подтверждение введенного)
+@dp.callback_query_handler(lambda c: c.data.startswith('route_distance_'), state=TripStates.waiting_for_distance)
+async def process_route_distance(callback_query: types.CallbackQuery, state: FSMContext):
+    choice = callback_query.data[len('route_distance_'):]
+    if choice == 'keep':
+        distance = (await state.get_data()).get('unusual_distance')
+    else:
+        distance = float(choice)
+    
+    await bot.answer_callback_query(callback_query.id)
+    if not distance:
+        await bot.send_message(callback_query.message.chat.id, "Введите расстояние в километрах (только число):")
+        return
+    
+    await bot.edit_message_reply_markup(
+        chat_id=callback_query.message.chat.id,
+        message_id=callback_query.message.message_id,
+        reply_markup=None
+    )
+    await _accept_distance(callback_query.message.chat.id, state, distance)
+
 # Обработчик ввода боковых загрузок
 @dp.message_handler(state=TripStates.waiting_for_side_loading)
 async def process_side_loading(message: types.Message, state: FSMContext):
@@ -663,6 +703,57 @@ async def process_forced_downtime(message: types.Message, state: FSMContext):
     await message.answer(summary, reply_markup=keyboard)
     await TripStates.waiting_for_confirmation.set()
     
+# Сохранение рейса с простоями
+def _save_trip(cursor, data):
+    # Сохраняем рейс с номером из 1С
+    cursor.execute(
+        """
+        INSERT INTO trips 
+        (driver_id, vehicle_id, loading_city, unloading_city, distance,
+         side_loading_count, roof_loading_count, total_payment, trip_1c_number)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            data.get('driver_id'),
+            data.get('vehicle_id'),
+            data.get('loading_city'),
+            data.get('unloading_city'),
+            data.get('distance'),
+            data.get('side_loading', 0),
+            data.get('roof_loading', 0),
+            data.get('total_payment'),
+            data.get('trip_1c_number', '')
+        )
+    )
+    trip_id = cursor.lastrowid
+    record_route(cursor, data.get('loading_city'), data.get('unloading_city'), data.get('distance'))
+    
+    # Если есть простои, добавляем их
+    if data.get('regular_downtime', 0) > 0:
+        reg_payment = data.get('regular_downtime', 0) * data.get('regular_downtime_rate', 0)
+        cursor.execute(
+            """
+            INSERT INTO downtimes (trip_id, type, hours, payment)
+            VALUES (?, 1, ?, ?)
+            """,
+            (trip_id, data.get('regular_downtime'), reg_payment)
+        )
+    
+    if data.get('forced_downtime', 0) > 0:
+        forced_payment = data.get('forced_downtime', 0) * data.get('forced_downtime_rate', 0)
+        cursor.execute(
+            """
+            INSERT INTO downtimes (trip_id, type, hours, payment)
+            VALUES (?, 2, ?, ?)
+            """,
+            (trip_id, data.get('forced_downtime'), forced_payment)
+        )
+    
+    # Новый рейс попадает в сводку задолженности водителя
+    apply_trip_change(cursor, None, trip_snapshot(cursor, trip_id))
+    
+    return trip_id
+
 # Финальный обработчик для подтверждения и сохранения рейса
 @dp.message_handler(state=TripStates.waiting_for_confirmation)
 async def confirm_trip(message: types.Message, state: FSMContext):
@@ -674,74 +765,17 @@ async def confirm_trip(message: types.Message, state: FSMContext):
     # Получаем все введенные данные
     data = await state.get_data()
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Проверяем, существует ли уже колонка trip_1c_number в таблице trips
-        cursor.execute("PRAGMA table_info(trips)")
-        columns = cursor.fetchall()
-        columns_names = [column[1] for column in columns]
-        
-        # Если колонки нет, добавляем ее
-        if 'trip_1c_number' not in columns_names:
-            cursor.execute("ALTER TABLE trips ADD COLUMN trip_1c_number TEXT")
-        
-        # Сохраняем рейс с номером из 1С
-        cursor.execute(
-            """
-            INSERT INTO trips 
-            (driver_id, vehicle_id, loading_city, unloading_city, distance,
-             side_loading_count, roof_loading_count, total_payment, trip_1c_number)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                data.get('driver_id'),
-                data.get('vehicle_id'),
-                data.get('loading_city'),
-                data.get('unloading_city'),
-                data.get('distance'),
-                data.get('side_loading', 0),
-                data.get('roof_loading', 0),
-                data.get('total_payment'),
-                data.get('trip_1c_number', '')
-            )
-        )
-        trip_id = cursor.lastrowid
-        
-        # Если есть простои, добавляем их
-        if data.get('regular_downtime', 0) > 0:
-            reg_payment = data.get('regular_downtime', 0) * data.get('regular_downtime_rate', 0)
-            cursor.execute(
-                """
-                INSERT INTO downtimes (trip_id, type, hours, payment)
-                VALUES (?, 1, ?, ?)
-                """,
-                (trip_id, data.get('regular_downtime'), reg_payment)
-            )
-        
-        if data.get('forced_downtime', 0) > 0:
-            forced_payment = data.get('forced_downtime', 0) * data.get('forced_downtime_rate', 0)
-            cursor.execute(
-                """
-                INSERT INTO downtimes (trip_id, type, hours, payment)
-                VALUES (?, 2, ?, ?)
-                """,
-                (trip_id, data.get('forced_downtime'), forced_payment)
-            )
+        trip_id = await db.transaction(_save_trip, data)
+        city_index.add(data.get('loading_city'), data.get('unloading_city'))
         
         # Логируем действие
-        cursor.execute(
-            "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-            (
-                message.from_user.id, 
-                "Добавление рейса", 
-                f"Рейс #{trip_id}: {data.get('loading_city')} - {data.get('unloading_city')}, {data.get('distance')} км"
-            )
+        await audit(
+            message.from_user.id,
+            "Добавление рейса",
+            f"Рейс #{trip_id}: {data.get('loading_city')} - {data.get('unloading_city')}, {data.get('distance')} км"
         )
         
-        conn.commit()
-        
         await message.answer(
             f"✅ Рейс успешно сохранен!\n"
             f"№ рейса: {trip_id}\n"
@@ -751,34 +785,23 @@ async def confirm_trip(message: types.Message, state: FSMContext):
         )
     
     except Exception as e:
-        conn.rollback()
         await message.answer(
             f"❌ Ошибка при сохранении рейса: {str(e)}",
             reply_markup=get_trips_menu()  # Заменяем на меню рейсов
         )
     
     finally:
-        conn.close()
         await state.finish()
         
 # Обработчик для редактирования рейса
 @dp.message_handler(lambda message: message.text == "✏️ Редактировать рейс")
+@requires_role(1)
 async def edit_trip(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     # Проверяем наличие рейсов
-    cursor.execute("SELECT COUNT(*) FROM trips")
-    trips_count = cursor.fetchone()[0]
+    trips_count = (await db.fetchone("SELECT COUNT(*) FROM trips"))[0]
     
     if trips_count == 0:
         await message.answer("В базе данных нет рейсов для редактирования.")
-        conn.close()
         return
     
     # Добавляем клавиатуру с кнопкой отмены
@@ -791,7 +814,6 @@ async def edit_trip(message: types.Message):
     )
     
     await EditTripStates.waiting_for_trip_id.set()
-    conn.close()
 
 # Обработчик для кнопки отмены редактирования
 @dp.callback_query_handler(lambda c: c.data == "cancel_edit", state=EditTripStates.waiting_for_trip_id)
@@ -818,11 +840,8 @@ async def process_edit_trip_id(message: types.Message, state: FSMContext):
         await message.answer("Пожалуйста, введите корректный ID рейса (целое число).")
         return
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     # Проверяем существование рейса и получаем его данные
-    cursor.execute("""
+    trip_data = await db.fetchone("""
     SELECT t.id, d.name, v.truck_number, v.trailer_number, 
            t.trip_1c_number, t.loading_city, t.unloading_city, 
            t.distance, t.side_loading_count, t.roof_loading_count,
@@ -833,11 +852,8 @@ async def process_edit_trip_id(message: types.Message, state: FSMContext):
     WHERE t.id = ?
     """, (trip_id,))
     
-    trip_data = cursor.fetchone()
-    
     if not trip_data:
         await message.answer("Рейс с таким ID не найден. Проверьте номер и попробуйте снова.")
-        conn.close()
         return
     
     # Сохраняем ID рейса в состоянии
@@ -874,7 +890,6 @@ async def process_edit_trip_id(message: types.Message, state: FSMContext):
     )
     await message.answer(trip_info, reply_markup=keyboard)
     await EditTripStates.waiting_for_field.set()
-    conn.close()
 
 # Обработчик для кнопки удаления рейса
 @dp.callback_query_handler(lambda c: c.data == "delete_trip", state=EditTripStates.waiting_for_field)
@@ -896,33 +911,36 @@ async def process_delete_trip(callback_query: types.CallbackQuery, state: FSMCon
         reply_markup=keyboard
     )
 
+# Удаление рейса вместе с простоями; возвращает города рейса (для подсказок)
+def _delete_trip(cursor, trip_id):
+    before = trip_snapshot(cursor, trip_id)
+    cursor.execute("SELECT loading_city, unloading_city FROM trips WHERE id = ?", (trip_id,))
+    cities = cursor.fetchone() or ()
+    
+    # Удаляем сначала простои, связанные с рейсом
+    cursor.execute("DELETE FROM downtimes WHERE trip_id = ?", (trip_id,))
+    
+    # Затем удаляем сам рейс
+    cursor.execute("DELETE FROM trips WHERE id = ?", (trip_id,))
+    apply_trip_change(cursor, before, None)
+    return cities
+
 # Обработчик для подтверждения удаления рейса
 @dp.callback_query_handler(lambda c: c.data.startswith("confirm_delete_"), state="*")
 async def confirm_delete_trip(callback_query: types.CallbackQuery, state: FSMContext):
     trip_id = int(callback_query.data.split("_")[2])
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Удаляем сначала простои, связанные с рейсом
-        cursor.execute("DELETE FROM downtimes WHERE trip_id = ?", (trip_id,))
-        
-        # Затем удаляем сам рейс
-        cursor.execute("DELETE FROM trips WHERE id = ?", (trip_id,))
+        cities = await db.transaction(_delete_trip, trip_id)
+        city_index.remove(*cities)
         
         # Логируем действие
-        cursor.execute(
-            "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-            (
-                callback_query.from_user.id, 
-                "Удаление рейса", 
-                f"Рейс #{trip_id} удален"
-            )
+        await audit(
+            callback_query.from_user.id,
+            "Удаление рейса",
+            f"Рейс #{trip_id} удален"
         )
         
-        conn.commit()
-        
         await bot.edit_message_text(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
@@ -940,7 +958,6 @@ async def confirm_delete_trip(callback_query: types.CallbackQuery, state: FSMCon
         await state.finish()
         
     except Exception as e:
-        conn.rollback()
         await bot.edit_message_text(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
@@ -956,9 +973,6 @@ async def confirm_delete_trip(callback_query: types.CallbackQuery, state: FSMCon
         )
         
         await state.finish()
-    
-    finally:
-        conn.close()
 
 # Обработчик для отмены удаления рейса
 @dp.callback_query_handler(lambda c: c.data == "cancel_delete", state="*")
@@ -967,11 +981,8 @@ async def cancel_delete_trip(callback_query: types.CallbackQuery, state: FSMCont
     trip_id = data.get('trip_id')
     
     # Возвращаемся к информации о рейсе
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     # Получаем данные о рейсе для повторного отображения
-    cursor.execute("""
+    trip_data = await db.fetchone("""
     SELECT t.id, d.name, v.truck_number, v.trailer_number, 
            t.trip_1c_number, t.loading_city, t.unloading_city, 
            t.distance, t.side_loading_count, t.roof_loading_count,
@@ -982,9 +993,6 @@ async def cancel_delete_trip(callback_query: types.CallbackQuery, state: FSMCont
     WHERE t.id = ?
     """, (trip_id,))
     
-    trip_data = cursor.fetchone()
-    conn.close()
-    
     if trip_data:
         # Создаем текст с информацией о рейсе
         trip_info = (
@@ -1102,19 +1110,13 @@ async def process_edit_new_value(message: types.Message, state: FSMContext):
     await state.update_data(new_value=new_value)
     
     # Получаем информацию о рейсе для подтверждения
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+    trip_info = await db.fetchone("""
     SELECT t.id, d.name, t.loading_city, t.unloading_city, t.trip_1c_number
     FROM trips t
     JOIN drivers d ON t.driver_id = d.id
     WHERE t.id = ?
     """, (data['trip_id'],))
     
-    trip_info = cursor.fetchone()
-    conn.close()
-    
     # Определяем названия полей для отображения
     field_names = {
         'trip_1c_number': 'Номер рейса из 1С',
@@ -1141,6 +1143,87 @@ async def process_edit_new_value(message: types.Message, state: FSMContext):
     
     await EditTripStates.waiting_for_confirmation.set()
 
+# Изменение поля рейса (с пересчетом оплаты); возвращает прежнее значение текстового поля
+def _update_trip_field(cursor, data):
+    before = trip_snapshot(cursor, data['trip_id'])
+    old_value = None
+    cursor.execute("SELECT loading_city, unloading_city, distance FROM trips WHERE id = ?", (data['trip_id'],))
+    old_route = cursor.fetchone()
+    
+    # Если редактируем расстояние, нужно пересчитать стоимость рейса
+    if data['field'] in ['distance', 'side_loading', 'roof_loading']:
+        # Получаем текущие данные рейса
+        cursor.execute("""
+        SELECT driver_id, distance, side_loading_count, roof_loading_count, created_at
+        FROM trips
+        WHERE id = ?
+        """, (data['trip_id'],))
+        
+        trip_data = cursor.fetchone()
+        
+        # Ставки водителя, действовавшие в день рейса
+        driver_rates = driver_rates_on(cursor, trip_data[0], trip_data[4])
+        rates = (driver_rates['km_rate'], driver_rates['side_loading_rate'], driver_rates['roof_loading_rate'])
+        
+        # Текущая оплата за километры
+        current_km_payment = trip_data[1] * rates[0]
+        current_side_loading_payment = trip_data[2] * rates[1]
+        current_roof_loading_payment = trip_data[3] * rates[2]
+        
+        # Новые значения
+        new_distance = data['new_value'] if data['field'] == 'distance' else trip_data[1]
+        new_side_loading = data['new_value'] if data['field'] == 'side_loading' else trip_data[2]
+        new_roof_loading = data['new_value'] if data['field'] == 'roof_loading' else trip_data[3]
+        
+        # Новая оплата
+        new_km_payment = new_distance * rates[0]
+        new_side_loading_payment = new_side_loading * rates[1]
+        new_roof_loading_payment = new_roof_loading * rates[2]
+        
+        # Разница в оплате
+        payment_difference = (
+            (new_km_payment - current_km_payment) +
+            (new_side_loading_payment - current_side_loading_payment) +
+            (new_roof_loading_payment - current_roof_loading_payment)
+        )
+        
+        # Обновляем поле и общую сумму оплаты
+        field_db_name = {
+            'distance': 'distance',
+            'side_loading': 'side_loading_count',
+            'roof_loading': 'roof_loading_count'
+        }.get(data['field'])
+        
+        cursor.execute(f"""
+        UPDATE trips
+        SET {field_db_name} = ?, total_payment = total_payment + ?
+        WHERE id = ?
+        """, (data['new_value'], payment_difference, data['trip_id']))
+    
+    else:
+        # Для текстовых полей просто обновляем значение
+        field_db_name = {
+            'trip_1c_number': 'trip_1c_number',
+            'loading_city': 'loading_city',
+            'unloading_city': 'unloading_city'
+        }.get(data['field'])
+        
+        cursor.execute(f"SELECT {field_db_name} FROM trips WHERE id = ?", (data['trip_id'],))
+        old_value = cursor.fetchone()[0]
+        cursor.execute(f"""
+        UPDATE trips
+        SET {field_db_name} = ?
+        WHERE id = ?
+        """, (data['new_value'], data['trip_id']))
+    
+    # Исправленное расстояние или город заменяют прежние в справочнике маршрутов
+    if data['field'] in ['distance', 'loading_city', 'unloading_city']:
+        cursor.execute("SELECT loading_city, unloading_city, distance FROM trips WHERE id = ?", (data['trip_id'],))
+        replace_route_trip(cursor, old_route, cursor.fetchone())
+    
+    apply_trip_change(cursor, before, trip_snapshot(cursor, data['trip_id']))
+    return old_value
+
 # Обработчик подтверждения редактирования
 @dp.message_handler(state=EditTripStates.waiting_for_confirmation)
 async def confirm_edit_trip(message: types.Message, state: FSMContext):
@@ -1152,91 +1235,19 @@ async def confirm_edit_trip(message: types.Message, state: FSMContext):
     # Получаем все данные из состояния
     data = await state.get_data()
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Если редактируем расстояние, нужно пересчитать стоимость рейса
-        if data['field'] in ['distance', 'side_loading', 'roof_loading']:
-            # Получаем текущие данные рейса
-            cursor.execute("""
-            SELECT driver_id, distance, side_loading_count, roof_loading_count
-            FROM trips
-            WHERE id = ?
-            """, (data['trip_id'],))
-            
-            trip_data = cursor.fetchone()
-            
-            # Получаем ставки водителя
-            cursor.execute("""
-            SELECT km_rate, side_loading_rate, roof_loading_rate
-            FROM drivers
-            WHERE id = ?
-            """, (trip_data[0],))
-            
-            rates = cursor.fetchone()
-            
-            # Текущая оплата за километры
-            current_km_payment = trip_data[1] * rates[0]
-            current_side_loading_payment = trip_data[2] * rates[1]
-            current_roof_loading_payment = trip_data[3] * rates[2]
-            
-            # Новые значения
-            new_distance = data['new_value'] if data['field'] == 'distance' else trip_data[1]
-            new_side_loading = data['new_value'] if data['field'] == 'side_loading' else trip_data[2]
-            new_roof_loading = data['new_value'] if data['field'] == 'roof_loading' else trip_data[3]
-            
-            # Новая оплата
-            new_km_payment = new_distance * rates[0]
-            new_side_loading_payment = new_side_loading * rates[1]
-            new_roof_loading_payment = new_roof_loading * rates[2]
-            
-            # Разница в оплате
-            payment_difference = (
-                (new_km_payment - current_km_payment) +
-                (new_side_loading_payment - current_side_loading_payment) +
-                (new_roof_loading_payment - current_roof_loading_payment)
-            )
-            
-            # Обновляем поле и общую сумму оплаты
-            field_db_name = {
-                'distance': 'distance',
-                'side_loading': 'side_loading_count',
-                'roof_loading': 'roof_loading_count'
-            }.get(data['field'])
-            
-            cursor.execute(f"""
-            UPDATE trips
-            SET {field_db_name} = ?, total_payment = total_payment + ?
-            WHERE id = ?
-            """, (data['new_value'], payment_difference, data['trip_id']))
-        
-        else:
-            # Для текстовых полей просто обновляем значение
-            field_db_name = {
-                'trip_1c_number': 'trip_1c_number',
-                'loading_city': 'loading_city',
-                'unloading_city': 'unloading_city'
-            }.get(data['field'])
-            
-            cursor.execute(f"""
-            UPDATE trips
-            SET {field_db_name} = ?
-            WHERE id = ?
-            """, (data['new_value'], data['trip_id']))
+        old_value = await db.transaction(_update_trip_field, data)
+        if data['field'] in ['loading_city', 'unloading_city']:
+            city_index.remove(old_value)
+            city_index.add(data['new_value'])
         
         # Логируем действие
-        cursor.execute(
-            "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-            (
-                message.from_user.id, 
-                "Редактирование рейса", 
-                f"Рейс #{data['trip_id']}: изменено поле '{data['field']}' на '{data['new_value']}'"
-            )
+        await audit(
+            message.from_user.id,
+            "Редактирование рейса",
+            f"Рейс #{data['trip_id']}: изменено поле '{data['field']}' на '{data['new_value']}'"
         )
         
-        conn.commit()
-        
         await message.answer(
             f"✅ Рейс успешно отредактирован!\n"
             f"Рейс #{data['trip_id']}\n"
@@ -1246,73 +1257,32 @@ async def confirm_edit_trip(message: types.Message, state: FSMContext):
         )
     
     except Exception as e:
-        conn.rollback()
         await message.answer(
             f"❌ Ошибка при редактировании рейса: {str(e)}",
             reply_markup=get_trips_menu()  # Заменяем на меню рейсов
         )
     
     finally:
-        conn.close()
         await state.finish()
         
-# Функция для обновления схемы базы данных (добавление колонки trip_1c_number)
-async def update_database_schema():
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    try:
-        # Проверяем, существует ли уже колонка trip_1c_number в таблице trips
-        cursor.execute("PRAGMA table_info(trips)")
-        columns = cursor.fetchall()
-        columns_names = [column[1] for column in columns]
-        
-        # Если колонки нет, добавляем ее
-        if 'trip_1c_number' not in columns_names:
-            cursor.execute("ALTER TABLE trips ADD COLUMN trip_1c_number TEXT")
-            conn.commit()
-            logging.info("Добавлена колонка trip_1c_number в таблицу trips")
-    except Exception as e:
-        logging.error(f"Ошибка при обновлении схемы базы данных: {str(e)}")
-    finally:
-        conn.close()
-
-# Обработчик на старте бота для обновления базы данных
+# Обработчик на старте бота
 @dp.message_handler(commands=['start'])
-async def on_start(message: types.Message):
-    # Обновляем схему базы данных
-    await update_database_schema()
-    
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
+async def on_start(message: types.Message, role):
     # Проверяем, зарегистрирован ли пользователь
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (message.from_user.id,))
-    user_role = cursor.fetchone()
-    
-    if user_role:
+    if role is not None:
         # Пользователь уже зарегистрирован, отправляем клавиатуру в зависимости от роли
-        if user_role[0] == 1:  # Редактор
+        if role == 1:  # Редактор
             await message.answer(f"Привет! Вы вошли как администратор.", reply_markup=get_editor_keyboard())
         else:  # Просмотрщик
             await message.answer(f"Привет! Вы вошли как пользователь.", reply_markup=get_viewer_keyboard())
     else:
         # Пользователь не зарегистрирован, показываем сообщение
         await message.answer("Вы не зарегистрированы в системе. Обратитесь к администратору.")
-    
-    conn.close()
 
 # Обработчик для просмотра истории рейсов
 @dp.message_handler(lambda message: message.text == "🗂️ История рейсов")
+@requires_role(2)
 async def view_trips_history(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=2):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     # Создаем клавиатуру для выбора периода
     keyboard = InlineKeyboardMarkup(row_width=2)
     keyboard.add(
@@ -1324,7 +1294,39 @@ async def view_trips_history(message: types.Message):
     )
     
     await message.answer("Выберите период для просмотра:", reply_markup=keyboard)
-    conn.close()
+
+# Страница истории рейсов за период (page.arg)
+async def render_history_page(page):
+    text = f"📋 История рейсов {get_period_name(page.arg)}:\n\n"
+    
+    for trip in page.rows:
+        trip_id, driver, truck, trailer, load_city, unload_city, distance, payment, date, trip_1c_number = trip
+        text += (
+            f"🔹 Рейс #{trip_id} ({date.split(' ')[0]})\n"
+            f"👤 Водитель: {driver}\n"
+            f"🚛 ТС: {truck}/{trailer}\n"
+            f"📝 Номер из 1С: {trip_1c_number or 'Не указан'}\n"
+            f"🗺️ Маршрут: {load_city} → {unload_city} ({distance} км)\n"
+            f"💰 Оплата: {payment} руб.\n\n"
+        )
+    return text, []
+
+history_list = PagedList(
+    'history',
+    columns="""t.id, d.name, v.truck_number, v.trailer_number,
+               t.loading_city, t.unloading_city, t.distance,
+               t.total_payment, t.created_at, t.trip_1c_number""",
+    tables="""trips t
+    JOIN drivers d ON t.driver_id = d.id
+    JOIN vehicles v ON t.vehicle_id = v.id""",
+    key=('t.created_at', 't.id'),
+    filters={
+        '7days': ("t.created_at >= datetime('now', '-7 days')", ()),
+        '30days': ("t.created_at >= datetime('now', '-30 days')", ()),
+    },
+    render=render_history_page,
+    cached=True
+)
 
 # Обработчик выбора периода истории
 @dp.callback_query_handler(lambda c: c.data.startswith('history_'))
@@ -1336,70 +1338,29 @@ async def process_history_selection(callback_query: types.CallbackQuery):
         await export_history(callback_query)
         return
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
+    # Первая страница за период, остальные - по кнопкам навигации
+    text, keyboard = await history_list.render_page(period)
     
-    query = """
-    SELECT t.id, d.name, v.truck_number, v.trailer_number,
-           t.loading_city, t.unloading_city, t.distance,
-           t.total_payment, t.created_at, t.trip_1c_number
-    FROM trips t
-    JOIN drivers d ON t.driver_id = d.id
-    JOIN vehicles v ON t.vehicle_id = v.id
-    """
-    
-    params = tuple()
-    
-    if period == "7days":
-        query += " WHERE t.created_at >= datetime('now', '-7 days')"
-    elif period == "30days":
-        query += " WHERE t.created_at >= datetime('now', '-30 days')"
-    
-    query += " ORDER BY t.created_at DESC LIMIT 10"
-    
-    cursor.execute(query, params)
-    trips = cursor.fetchall()
-    
-    if not trips:
+    if text is None:
         await bot.answer_callback_query(callback_query.id)
         await bot.edit_message_text(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
             text="За выбранный период рейсов не найдено."
         )
-        conn.close()
         return
-        
-    # Формируем сообщение с историей
-    text = f"📋 История рейсов {get_period_name(period)}:\n\n"
-    
-    for trip in trips:
-        trip_id, driver, truck, trailer, load_city, unload_city, distance, payment, date, trip_1c_number = trip
-        text += (
-            f"🔹 Рейс #{trip_id} ({date.split(' ')[0]})\n"
-            f"👤 Водитель: {driver}\n"
-            f"🚛 ТС: {truck}/{trailer}\n"
-            f"📝 Номер из 1С: {trip_1c_number or 'Не указан'}\n"
-            f"🗺️ Маршрут: {load_city} → {unload_city} ({distance} км)\n"
-            f"💰 Оплата: {payment} руб.\n\n"
-        )
-    
-    # Ограничиваем длину сообщения, если оно слишком большое
-    if len(text) > 4096:
-        text = text[:4000] + "...\n\n(Показаны не все рейсы из-за ограничения длины сообщения)"
     
     await bot.answer_callback_query(callback_query.id)
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
-        text=text
+        text=text,
+        reply_markup=keyboard
     )
-    
-    conn.close()
 
-    # Обработчик для кнопки "Назад" в истории рейсов
+# Обработчик для кнопки "Назад" в истории рейсов
 @dp.callback_query_handler(lambda c: c.data == "trip_cancel" and c.message.text and "Выберите период для просмотра" in c.message.text)
-async def history_back_to_menu(callback_query: types.CallbackQuery):
+async def history_back_to_menu(callback_query: types.CallbackQuery, role):
     # Специальная обработка для возврата из истории рейсов в главное меню
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
@@ -1408,60 +1369,14 @@ async def history_back_to_menu(callback_query: types.CallbackQuery):
         reply_markup=None
     )
     
-    # Определяем роль пользователя
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (callback_query.from_user.id,))
-    user_role = cursor.fetchone()
-    conn.close()
-    
-    # Проверяем роль и показываем соответствующую клавиатуру
-    if user_role and user_role[0] == 0:  # Если роль = 0 (Администратор)
-        await bot.send_message(
-            callback_query.message.chat.id,
-            "Главное меню:",
-            reply_markup=get_admin_keyboard()  # Используем клавиатуру администратора
-        )
-    elif user_role and user_role[0] == 1:  # Если роль = 1 (Редактор)
-        await bot.send_message(
-            callback_query.message.chat.id,
-            "Главное меню:",
-            reply_markup=get_editor_keyboard()  # Используем клавиатуру редактора
-        )
-    else:  # В остальных случаях (Просмотрщик)
-        await bot.send_message(
-            callback_query.message.chat.id,
-            "Главное меню:",
-            reply_markup=get_viewer_keyboard()  # Используем клавиатуру просмотрщика
-        )
-    
-    # Формируем сообщение с историей
-    text = f"📋 История рейсов {get_period_name(period)}:\n\n"
-    
-    for trip in trips:
-        trip_id, driver, truck, trailer, load_city, unload_city, distance, payment, date, trip_1c_number = trip
-        text += (
-            f"🔹 Рейс #{trip_id} ({date.split(' ')[0]})\n"
-            f"👤 Водитель: {driver}\n"
-            f"🚛 ТС: {truck}/{trailer}\n"
-            f"📝 Номер из 1С: {trip_1c_number or 'Не указан'}\n"
-            f"🗺️ Маршрут: {load_city} → {unload_city} ({distance} км)\n"
-            f"💰 Оплата: {payment} руб.\n\n"
-        )
-    
-    # Ограничиваем длину сообщения, если оно слишком большое
-    if len(text) > 4096:
-        text = text[:4000] + "...\n\n(Показаны не все рейсы из-за ограничения длины сообщения)"
-    
-    await bot.answer_callback_query(callback_query.id)
-    await bot.edit_message_text(
-        chat_id=callback_query.message.chat.id,
-        message_id=callback_query.message.message_id,
-        text=text
+    # Показываем клавиатуру по роли пользователя
+    await bot.send_message(
+        callback_query.message.chat.id,
+        "Главное меню:",
+        reply_markup=get_main_keyboard(role)
     )
     
-    conn.close()
+    await bot.answer_callback_query(callback_query.id)
 
 # Вспомогательная функция для названия периода
 def get_period_name(period):
@@ -1474,57 +1389,28 @@ def get_period_name(period):
 
 # Функция экспорта истории в CSV
 async def export_history(callback_query):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Получаем все рейсы
-        cursor.execute("""
-        SELECT t.id, d.name, v.truck_number, v.trailer_number,
-               t.trip_1c_number, t.loading_city, t.unloading_city, t.distance,
-               t.side_loading_count, t.roof_loading_count,
-               t.total_payment, t.created_at
-        FROM trips t
-        JOIN drivers d ON t.driver_id = d.id
-        JOIN vehicles v ON t.vehicle_id = v.id
-        ORDER BY t.created_at DESC
-        """)
-        
-        trips = cursor.fetchall()
-        
-        if not trips:
-            await bot.answer_callback_query(callback_query.id)
-            await bot.send_message(
-                callback_query.message.chat.id,
-                "Нет данных для экспорта."
-            )
-            return
-        
-        # Создаем CSV в памяти
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter=';', quotechar='"')
-        
-        # Заголовки
-        writer.writerow([
-            "ID", "Водитель", "Тягач", "Прицеп", "Номер из 1С", "Город погрузки", 
-            "Город разгрузки", "Расстояние (км)", "Боковой тент", 
-            "Крыша", "Сумма (руб)", "Дата"
-        ])
-        
-        # Данные
-        for trip in trips:
-            writer.writerow(trip)
-        
-        # Конвертируем в байты
-        csv_bytes = output.getvalue().encode('utf-8-sig')
-        
-        # Отправляем файл
-        filename = f"trips_history_{datetime.now().strftime('%Y-%m-%d')}.csv"
-        
-        await bot.answer_callback_query(callback_query.id)
-        await bot.send_document(
-            callback_query.message.chat.id,
-            (filename, io.BytesIO(csv_bytes)),
+        # Файл собирается в фоне, обработчик отвечает сразу
+        await submit_export(
+            callback_query,
+            title="История рейсов",
+            sql="""
+            SELECT t.id, d.name, v.truck_number, v.trailer_number,
+                   t.trip_1c_number, t.loading_city, t.unloading_city, t.distance,
+                   t.side_loading_count, t.roof_loading_count,
+                   t.total_payment, t.created_at
+            FROM trips t
+            JOIN drivers d ON t.driver_id = d.id
+            JOIN vehicles v ON t.vehicle_id = v.id
+            ORDER BY t.created_at DESC
+            """,
+            params=(),
+            header=[
+                "ID", "Водитель", "Тягач", "Прицеп", "Номер из 1С", "Город погрузки", 
+                "Город разгрузки", "Расстояние (км)", "Боковой тент", 
+                "Крыша", "Сумма (руб)", "Дата"
+            ],
+            filename=f"trips_history_{datetime.now().strftime('%Y-%m-%d')}",
             caption="История рейсов"
         )
     
@@ -1534,9 +1420,6 @@ async def export_history(callback_query):
             callback_query.message.chat.id,
             f"Ошибка при экспорте: {str(e)}"
         )
-    
-    finally:
-        conn.close()
 
 # Обновление клавиатуры главного меню с добавлением кнопки редактирования
 def get_editor_keyboard():
@@ -1553,22 +1436,13 @@ def get_editor_keyboard():
 
 # Обработчик для добавления простоя к существующему рейсу
 @dp.message_handler(lambda message: message.text == "⏱️ Добавить простой")
+@requires_role(1)
 async def add_downtime(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     # Проверяем наличие рейсов
-    cursor.execute("SELECT COUNT(*) FROM trips")
-    trips_count = cursor.fetchone()[0]
+    trips_count = (await db.fetchone("SELECT COUNT(*) FROM trips"))[0]
     
     if trips_count == 0:
         await message.answer("Нет рейсов для добавления простоя.")
-        conn.close()
         return
     
     # Добавляем клавиатуру с кнопкой отмены
@@ -1581,7 +1455,6 @@ async def add_downtime(message: types.Message):
     )
     
     await DowntimeStates.waiting_for_trip_id.set()
-    conn.close()
 
 # Обработчик для кнопки отмены добавления простоя
 @dp.callback_query_handler(lambda c: c.data == "cancel_downtime", state=DowntimeStates.waiting_for_trip_id)
@@ -1599,6 +1472,20 @@ async def cancel_downtime(callback_query: types.CallbackQuery, state: FSMContext
         reply_markup=get_trips_menu()
     )
     
+# Рейс для простоя и ставки простоя, действовавшие в день рейса
+def _downtime_trip(cursor, trip_id):
+    cursor.execute("""
+    SELECT t.id, d.name, t.loading_city, t.unloading_city, t.driver_id, t.created_at
+    FROM trips t
+    JOIN drivers d ON t.driver_id = d.id
+    WHERE t.id = ?
+    """, (trip_id,))
+    trip = cursor.fetchone()
+    if trip is None:
+        return None
+    rates = driver_rates_on(cursor, trip[4], trip[5])
+    return trip[:4] + (rates['regular_downtime_rate'], rates['forced_downtime_rate'])
+
 # Обработчик ввода ID рейса для простоя
 @dp.message_handler(state=DowntimeStates.waiting_for_trip_id)
 async def process_trip_id_for_downtime(message: types.Message, state: FSMContext):
@@ -1608,22 +1495,11 @@ async def process_trip_id_for_downtime(message: types.Message, state: FSMContext
         await message.answer("Пожалуйста, введите корректный ID рейса (целое число).")
         return
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Проверяем существование рейса
-    cursor.execute("""
-    SELECT t.id, d.name, t.loading_city, t.unloading_city
-    FROM trips t
-    JOIN drivers d ON t.driver_id = d.id
-    WHERE t.id = ?
-    """, (trip_id,))
-    
-    trip_data = cursor.fetchone()
+    # Проверяем существование рейса и получаем ставки водителя для расчета оплаты
+    trip_data = await db.transaction(_downtime_trip, trip_id)
     
     if not trip_data:
         await message.answer("Рейс с таким ID не найден. Проверьте номер и попробуйте снова.")
-        conn.close()
         return
     
     await state.update_data(
@@ -1631,19 +1507,9 @@ async def process_trip_id_for_downtime(message: types.Message, state: FSMContext
         trip_info=f"Рейс #{trip_data[0]}: Водитель {trip_data[1]}, {trip_data[2]} → {trip_data[3]}"
     )
     
-    # Получаем данные о водителе для расчета оплаты
-    cursor.execute("""
-    SELECT d.regular_downtime_rate, d.forced_downtime_rate
-    FROM trips t
-    JOIN drivers d ON t.driver_id = d.id
-    WHERE t.id = ?
-    """, (trip_id,))
-    
-    downtime_rates = cursor.fetchone()
-    
     await state.update_data(
-        regular_downtime_rate=downtime_rates[0],
-        forced_downtime_rate=downtime_rates[1]
+        regular_downtime_rate=trip_data[4],
+        forced_downtime_rate=trip_data[5]
     )
     
     # Создаем клавиатуру для выбора типа простоя
@@ -1663,7 +1529,6 @@ async def process_trip_id_for_downtime(message: types.Message, state: FSMContext
     )
     
     await DowntimeStates.waiting_for_downtime_type.set()
-    conn.close()
 
 # Обработчик выбора типа простоя
 @dp.callback_query_handler(lambda c: c.data.startswith('downtime_'), state=DowntimeStates.waiting_for_downtime_type)
@@ -1728,6 +1593,30 @@ async def process_downtime_hours(message: types.Message, state: FSMContext):
     await message.answer(summary, reply_markup=keyboard)
     await DowntimeStates.waiting_for_confirmation.set()
 
+# Сохранение простоя и пересчет суммы рейса
+def _save_downtime(cursor, data):
+    before = trip_snapshot(cursor, data['trip_id'])
+    
+    # Добавляем простой в базу данных
+    cursor.execute(
+        """
+        INSERT INTO downtimes (trip_id, type, hours, payment)
+        VALUES (?, ?, ?, ?)
+        """,
+        (data['trip_id'], data['downtime_type'], data['hours'], data['payment'])
+    )
+    
+    # Обновляем общую сумму рейса
+    cursor.execute(
+        """
+        UPDATE trips
+        SET total_payment = total_payment + ?
+        WHERE id = ?
+        """,
+        (data['payment'], data['trip_id'])
+    )
+    apply_trip_change(cursor, before, trip_snapshot(cursor, data['trip_id']))
+
 # Обработчик подтверждения добавления простоя
 @dp.message_handler(state=DowntimeStates.waiting_for_confirmation)
 async def confirm_downtime(message: types.Message, state: FSMContext):
@@ -1739,41 +1628,16 @@ async def confirm_downtime(message: types.Message, state: FSMContext):
     # Получаем данные из состояния
     data = await state.get_data()
     
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
     try:
-        # Добавляем простой в базу данных
-        cursor.execute(
-            """
-            INSERT INTO downtimes (trip_id, type, hours, payment)
-            VALUES (?, ?, ?, ?)
-            """,
-            (data['trip_id'], data['downtime_type'], data['hours'], data['payment'])
-        )
-        
-        # Обновляем общую сумму рейса
-        cursor.execute(
-            """
-            UPDATE trips
-            SET total_payment = total_payment + ?
-            WHERE id = ?
-            """,
-            (data['payment'], data['trip_id'])
-        )
+        await db.transaction(_save_downtime, data)
         
         # Логируем действие
-        cursor.execute(
-            "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-            (
-                message.from_user.id, 
-                "Добавление простоя", 
-                f"Рейс #{data['trip_id']}: {data['downtime_name']}, {data['hours']} ч, {data['payment']} руб."
-            )
+        await audit(
+            message.from_user.id,
+            "Добавление простоя",
+            f"Рейс #{data['trip_id']}: {data['downtime_name']}, {data['hours']} ч, {data['payment']} руб."
         )
         
-        conn.commit()
-        
         await message.answer(
             f"✅ Простой успешно добавлен!\n"
             f"Рейс #{data['trip_id']}\n"
@@ -1784,61 +1648,219 @@ async def confirm_downtime(message: types.Message, state: FSMContext):
         )
     
     except Exception as e:
-        conn.rollback()
         await message.answer(
             f"❌ Ошибка при добавлении простоя: {str(e)}",
             reply_markup=get_trips_menu()
         )
     
     finally:
-        conn.close()
         await state.finish()
         
+# Статистика водителей за период: по дневной сводке daily_driver_stats,
+# поэтому любой период стоит одинаково - несколько сотен строк сводки
+class DriverStatsStates(StatesGroup):
+    waiting_for_period = State()
+
+STATS_PERIODS = [
+    ("7 дней", "7days"),
+    ("30 дней", "30days"),
+    ("Текущий месяц", "month"),
+    ("Квартал", "quarter"),
+]
+
+MESSAGE_LIMIT = 4096  # Лимит длины сообщения Telegram
+
+# Границы периода [начало, конец] в днях UTC, как и даты рейсов в базе
+def stats_period_bounds(period):
+    today = datetime.utcnow().date()
+    if period == "7days":
+        return today - timedelta(days=6), today
+    if period == "30days":
+        return today - timedelta(days=29), today
+    if period == "month":
+        return today.replace(day=1), today
+    if period == "quarter":
+        return today.replace(month=(today.month - 1) // 3 * 3 + 1, day=1), today
+    raise ValueError(f"Неизвестный период: {period}")
+
+def get_stats_period_keyboard():
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.add(*[
+        InlineKeyboardButton(label, callback_data=f"dstat_{period}") for label, period in STATS_PERIODS
+    ])
+    keyboard.add(InlineKeyboardButton("📅 Свой период", callback_data="dstat_custom"))
+    return keyboard
+
 # Обработчик для статистики водителей
 @dp.message_handler(lambda message: message.text == "📊 Статистика водителей")
+@requires_role(1)
 async def driver_statistics(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
+    await message.answer("Выберите период для статистики водителей:", reply_markup=get_stats_period_keyboard())
+
+# Обработчик выбора периода статистики
+@dp.callback_query_handler(lambda c: c.data.startswith("dstat_"))
+@requires_role(1)
+async def process_stats_period(callback_query: types.CallbackQuery):
+    period = callback_query.data[len("dstat_"):]
+    await bot.answer_callback_query(callback_query.id)
     
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
+    if period == "custom":
+        await bot.send_message(
+            callback_query.from_user.id,
+            f"Введите период в формате {PERIOD_FORMAT_HINT}\nНапример: 01.01.2024-31.03.2024"
+        )
+        await DriverStatsStates.waiting_for_period.set()
         return
     
-    # Получаем статистику по водителям за последние 30 дней
-    cursor.execute("""
-    SELECT d.name, 
-           COUNT(t.id) as trips_count,
-           SUM(t.distance) as total_distance,
-           SUM(t.total_payment) as total_payment
-    FROM drivers d
-    LEFT JOIN trips t ON d.id = t.driver_id AND t.created_at >= datetime('now', '-30 days')
-    GROUP BY d.id
-    ORDER BY total_payment DESC
-    """)
-    
-    stats = cursor.fetchall()
+    try:
+        start, end = stats_period_bounds(period)
+    except ValueError:
+        await bot.send_message(callback_query.from_user.id, "Неизвестный период, выберите его заново.")
+        return
     
-    if not stats:
-        await message.answer("Нет данных для статистики.")
-        conn.close()
+    await send_driver_statistics(callback_query.from_user.id, start, end)
+
+# Обработчик ввода своего периода
+@dp.message_handler(state=DriverStatsStates.waiting_for_period)
+async def process_custom_stats_period(message: types.Message, state: FSMContext):
+    try:
+        start, end = parse_period(message.text)
+    except ValueError:
+        await message.answer(f"Неверный период. Введите его в формате {PERIOD_FORMAT_HINT}")
         return
     
-    text = "📊 Статистика водителей за последние 30 дней:\n\n"
+    await state.finish()
+    await send_driver_statistics(message.chat.id, start, end)
+
+async def send_driver_statistics(chat_id, start, end):
+    # Одна и та же статистика для всех, пока рейсы не менялись - из кэша отчетов
+    try:
+        chunks = await cached_report(
+            'driver_statistics', (start.isoformat(), end.isoformat()),
+            lambda: build_driver_statistics(start, end)
+        )
+    except Exception as e:
+        logging.error(f"Ошибка при получении статистики водителей: {str(e)}")
+        await bot.send_message(chat_id, f"❌ Ошибка при получении статистики: {str(e)}")
+        return
+    
+    if not chunks:
+        await bot.send_message(chat_id, "Нет данных для статистики.")
+        return
+    
+    for chunk in chunks:
+        await bot.send_message(chat_id, chunk)
+
+# Текст статистики водителей за дни [start, end], разбитый на сообщения
+# не длиннее MESSAGE_LIMIT (пустой список - водителей нет)
+async def build_driver_statistics(start, end):
+    stats = await db.fetchall(DRIVER_STATS_FOR_RANGE, (start.isoformat(), end.isoformat()))
+    
+    if not stats:
+        return []
     
-    for name, trips_count, total_distance, total_payment in stats:
-        if trips_count is None or trips_count == 0:
-            text += f"👤 {name}: нет рейсов\n\n"
+    chunks = []
+    text = f"📊 Статистика водителей за {start.strftime('%d.%m.%Y')} - {end.strftime('%d.%m.%Y')}:\n\n"
+    
+    for name, trips_count, distance, side, roof, downtime_hours, accrued, paid in stats:
+        if not trips_count:
+            block = f"👤 {name}: нет рейсов\n\n"
         else:
-            text += (
+            block = (
                 f"👤 {name}:\n"
                 f"  • Рейсов: {trips_count}\n"
-                f"  • Пробег: {int(total_distance) if total_distance else 0} км\n"
-                f"  • Заработок: {int(total_payment) if total_payment else 0} руб.\n\n"
+                f"  • Пробег: {int(distance)} км\n"
+                f"  • Погрузок: боковых {side}, через крышу {roof}\n"
+                f"  • Простой: {downtime_hours:g} ч\n"
+                f"  • Начислено: {int(accrued)} руб.\n"
+                f"  • Выплачено: {int(paid)} руб.\n\n"
+            )
+        if len(text) + len(block) > MESSAGE_LIMIT:
+            chunks.append(text)
+            text = ""
+        text += block
+    
+    chunks.append(text)
+    return chunks
+
+# Импорт рейсов из выгрузки 1С
+class TripImportStates(StatesGroup):
+    waiting_for_file = State()
+
+IMPORT_ERRORS_SHOWN = 30  # Сколько ошибок показать в ответе
+
+@dp.message_handler(lambda message: message.text == "📥 Импорт из 1С")
+@requires_role(1)
+async def start_trip_import(message: types.Message):
+    await message.answer(
+        "Пришлите файл выгрузки рейсов из 1С (.csv или .xlsx).\n\n"
+        "Обязательные колонки: Водитель, Погрузка, Разгрузка, Расстояние.\n"
+        "Необязательные: Номер рейса, Дата, Тягач, Боковой тент, Крыша, "
+        "Простой, Вынужденный простой.\n\n"
+        "Рейсы с номером 1С, который уже есть в базе, пропускаются.\n"
+        "Для отмены введите 'Отмена'."
+    )
+    await TripImportStates.waiting_for_file.set()
+
+# Обработчик файла для импорта
+@dp.message_handler(content_types=types.ContentTypes.DOCUMENT, state=TripImportStates.waiting_for_file)
+async def process_import_file(message: types.Message, state: FSMContext):
+    document = message.document
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer("Файл слишком большой (больше 20 МБ). Разделите его на части.")
+        return
+    
+    await message.answer("⏳ Импорт рейсов...")
+    
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE, mode='w+b') as upload:
+            await bot.download_file_by_id(document.file_id, destination=upload)
+            upload.seek(0)
+            added, duplicates, errors = await db.transaction(
+                import_trips, read_import_rows(upload, document.file_name or '')
             )
+    except ImportFileError as e:
+        await message.answer(f"❌ {e}")
+        return
+    except Exception as e:
+        logging.error(f"Ошибка при импорте рейсов: {str(e)}")
+        await message.answer(f"❌ Ошибка при импорте рейсов: {str(e)}", reply_markup=get_trips_menu())
+        await state.finish()
+        return
+    
+    await state.finish()
+    if added:
+        # Новые города импорта - при следующей подсказке индекс строится заново
+        city_index.clear()
+    
+    # Логируем действие
+    await audit(
+        message.from_user.id,
+        "Импорт рейсов",
+        f"Файл {document.file_name}: добавлено {added}, дублей {duplicates}, ошибок {len(errors)}"
+    )
+    
+    text = (
+        f"✅ Импорт завершен\n\n"
+        f"Добавлено рейсов: {added}\n"
+        f"Пропущено (уже есть в базе): {duplicates}\n"
+        f"Строк с ошибками: {len(errors)}\n"
+    )
+    if errors:
+        text += "\n" + "\n".join(f"Строка {line}: {error}" for line, error in errors[:IMPORT_ERRORS_SHOWN])
+        if len(errors) > IMPORT_ERRORS_SHOWN:
+            text += f"\n... и еще {len(errors) - IMPORT_ERRORS_SHOWN}"
+    await message.answer(text[:MESSAGE_LIMIT], reply_markup=get_trips_menu())
+
+# Текст вместо файла
+@dp.message_handler(state=TripImportStates.waiting_for_file)
+async def process_import_text(message: types.Message, state: FSMContext):
+    if message.text and message.text.lower() == "отмена":
+        await state.finish()
+        await message.answer("Импорт отменен.", reply_markup=get_trips_menu())
+        return
     
-    await message.answer(text)
-    conn.close()
+    await message.answer("Пришлите файл .csv или .xlsx либо введите 'Отмена'.")
 
 # Универсальный обработчик всех текстовых сообщений
 @dp.message_handler(content_types=types.ContentTypes.TEXT, state="*")
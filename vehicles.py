@@ -1,8 +1,10 @@
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from bot import dp, bot, check_user_access
-import sqlite3
+from bot import dp, bot, requires_role
+from audit import audit
+from database import db
+from paging import PagedList
 
 # Состояния для добавления/редактирования автопоезда
 class VehicleStates(StatesGroup):
@@ -23,33 +25,16 @@ def get_vehicles_keyboard():
 
 # Обработчик выбора раздела автопоездов
 @dp.message_handler(lambda message: message.text == "🚚 Автопоезда")
+@requires_role(1)
 async def manage_vehicles(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     await message.answer("Управление автопоездами", reply_markup=get_vehicles_keyboard())
-    conn.close()
 
 # Обработчик для добавления автопоезда
 @dp.message_handler(lambda message: message.text == "➕ Добавить автопоезд")
+@requires_role(1)
 async def add_vehicle(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
     await message.answer("Введите номер тягача:")
     await VehicleStates.waiting_for_truck_number.set()
-    
-    conn.close()
 
 # Последовательность шагов для ввода данных об автопоезде
 @dp.message_handler(state=VehicleStates.waiting_for_truck_number)
@@ -90,20 +75,8 @@ async def process_notes(message: types.Message, state: FSMContext):
     await message.answer(confirmation_text)
     await VehicleStates.waiting_for_confirmation.set()
 
-@dp.message_handler(state=VehicleStates.waiting_for_confirmation)
-async def process_confirmation(message: types.Message, state: FSMContext):
-    if message.text.lower() not in ["да", "сохранить", "+"]:
-        await message.answer("Отменено. Данные не сохранены.", reply_markup=get_vehicles_keyboard())
-        await state.finish()
-        return
-    
-    # Получаем все введенные данные
-    data = await state.get_data()
-    
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    # Сохраняем в базу
+# Сохранение автопоезда
+def _save_vehicle(cursor, data):
     cursor.execute(
         """
         INSERT INTO vehicles 
@@ -116,16 +89,22 @@ async def process_confirmation(message: types.Message, state: FSMContext):
             data.get('notes', '')
         )
     )
+
+@dp.message_handler(state=VehicleStates.waiting_for_confirmation)
+async def process_confirmation(message: types.Message, state: FSMContext):
+    if message.text.lower() not in ["да", "сохранить", "+"]:
+        await message.answer("Отменено. Данные не сохранены.", reply_markup=get_vehicles_keyboard())
+        await state.finish()
+        return
     
-    # Логируем действие
-    cursor.execute(
-        "INSERT INTO logs (user_id, action, details) VALUES (?, ?, ?)",
-        (message.from_user.id, "Добавление автопоезда", 
-         f"Добавлен автопоезд: {data.get('truck_number')}/{data.get('trailer_number')}")
-    )
+    # Получаем все введенные данные
+    data = await state.get_data()
+    
+    await db.transaction(_save_vehicle, data)
     
-    conn.commit()
-    conn.close()
+    # Логируем действие
+    await audit(message.from_user.id, "Добавление автопоезда", 
+                f"Добавлен автопоезд: {data.get('truck_number')}/{data.get('trailer_number')}")
     
     await message.answer(
         f"Автопоезд {data.get('truck_number')}/{data.get('trailer_number')} успешно добавлен!", 
@@ -133,33 +112,40 @@ async def process_confirmation(message: types.Message, state: FSMContext):
     )
     await state.finish()
 
-# Обработчик для просмотра списка автопоездов
-@dp.message_handler(lambda message: message.text == "📋 Список автопоездов")
-async def list_vehicles(message: types.Message):
-    conn = sqlite3.connect('salary_bot.db')
-    cursor = conn.cursor()
-    
-    if not await check_user_access(cursor, message.from_user.id, required_role=1):
-        await message.answer("У вас нет доступа к этой функции.")
-        conn.close()
-        return
-    
-    cursor.execute("SELECT id, truck_number, trailer_number, notes FROM vehicles ORDER BY id")
-    vehicles = cursor.fetchall()
-    
-    if not vehicles:
-        await message.answer("Список автопоездов пуст.", reply_markup=get_vehicles_keyboard())
-        conn.close()
-        return
-    
-    # Формируем список автопоездов с кнопками для редактирования/удаления
+# Страница списка автопоездов
+async def render_vehicles_page(page):
     text = "📋 Список автопоездов:\n\n"
     
-    for vehicle_id, truck, trailer, notes in vehicles:
+    for vehicle_id, truck, trailer, notes in page.rows:
         text += f"ID: {vehicle_id} | 🚛 {truck} | 🚜 {trailer}"
         if notes:
             text += f" | 📝 {notes}"
         text += "\n"
+    return text, []
+
+# Автопоезда в порядке добавления
+vehicles_list = PagedList(
+    'vehicles',
+    columns="v.id, v.truck_number, v.trailer_number, v.notes",
+    tables="vehicles v",
+    key=('v.created_at', 'v.id'),
+    descending=False,
+    render=render_vehicles_page,
+    page_size=20,
+    required_role=1
+)
+
+# Обработчик для просмотра списка автопоездов
+@dp.message_handler(lambda message: message.text == "📋 Список автопоездов")
+@requires_role(1)
+async def list_vehicles(message: types.Message):
+    text, keyboard = await vehicles_list.render_page()
+    
+    if text is None:
+        await message.answer("Список автопоездов пуст.", reply_markup=get_vehicles_keyboard())
+        return
     
-    await message.answer(text, reply_markup=get_vehicles_keyboard())
-    conn.close()
+    # Если список на одной странице, оставляем клавиатуру раздела
+    if not keyboard.inline_keyboard:
+        keyboard = get_vehicles_keyboard()
+    await message.answer(text, reply_markup=keyboard)